@@ -2,5 +2,9 @@
 
 set +euxo pipefail
 
-# run worker
-$HOME/env/bin/python spongeauth/manage.py rqworker default
+# schedule the recurring stale data cleanup, if it isn't already
+$HOME/env/bin/python spongeauth/manage.py cleanup_stale_data --schedule
+
+# run workers - outgoing mail gets its own, so it isn't stuck behind sso syncs
+$HOME/env/bin/python spongeauth/manage.py rqworker --with-scheduler mail &
+$HOME/env/bin/python spongeauth/manage.py rqworker --with-scheduler default
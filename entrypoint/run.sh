@@ -12,4 +12,10 @@ set +euxo pipefail
 # run worker - necessary for background sso syncs
 ./entrypoint/run-worker.sh &
 
-$HOME/env/bin/gunicorn -b :8080 -w 4 --chdir spongeauth spongeauth.wsgi
+# SERVER_MODE=asgi serves the async views natively, so slow password hashes,
+# avatar resizes and outgoing requests don't each hold up a whole worker.
+if [ "${SERVER_MODE:-wsgi}" = "asgi" ]; then
+    $HOME/env/bin/uvicorn --host 0.0.0.0 --port 8080 --workers 4 --app-dir spongeauth spongeauth.asgi:application
+else
+    $HOME/env/bin/gunicorn -b :8080 -w 4 --chdir spongeauth spongeauth.wsgi
+fi
@@ -8,6 +8,8 @@ from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Submit, Layout, Field, HTML, Hidden
 import crispy_forms.bootstrap
 
+from asgiref.sync import sync_to_async
+
 from . import models
 
 
@@ -191,24 +193,47 @@ class AuthenticationForm(forms.Form):
         # but it's easy enough to find usernames anyway
         # so I'm not especially concerned
         username = self.cleaned_data["username"]
-        if not models.User.objects.filter(username__iexact=username).exists():
+        # fetch the whole user here, rather than just checking it exists:
+        # it's reused for the password check and for logging in, so a login
+        # only needs to look the user up once.
+        try:
+            self._user = models.User.objects.get_by_natural_key(username)
+        except models.User.DoesNotExist:
             raise forms.ValidationError(_("There is no user with that username."))
         return username
 
     def clean(self):
         cleaned_data = super().clean()
         self.cached_user = None
-        username = cleaned_data.get("username")
+        user = getattr(self, "_user", None)
         password = cleaned_data.get("password")
 
-        if username and password:
-            user = django.contrib.auth.authenticate(username=username, password=password)
-            self.cached_user = user
-            if not user:
-                self.add_error("password", _("The provided password was incorrect."))
+        if user and password and not getattr(self, "_defer_password_check", False):
+            self._check_credentials(user, user.check_password(password))
 
         return cleaned_data
 
+    def _check_credentials(self, user, password_correct):
+        if password_correct and user.is_active:
+            self.cached_user = user
+        else:
+            self.add_error("password", _("The provided password was incorrect."))
+
+    async def ais_valid(self):
+        # Validate everything else first, then check the password with
+        # User.acheck_password so hashing it doesn't tie up the thread that
+        # runs synchronous code for the whole process.
+        self._defer_password_check = True
+        try:
+            if not await sync_to_async(self.is_valid)():
+                return False
+        finally:
+            self._defer_password_check = False
+
+        user = self._user
+        self._check_credentials(user, await user.acheck_password(self.cleaned_data["password"]))
+        return not self.errors
+
 
 class ForgotPasswordForm(forms.Form):
     email = forms.EmailField(label="Email", max_length=255)
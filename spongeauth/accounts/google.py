@@ -0,0 +1,60 @@
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from oauth2client import client, crypt
+import requests
+
+
+CERTS_CACHE_KEY = "accounts.google.certs"
+
+_MAX_AGE_RE = re.compile(r"(?:^|,)\s*max-age\s*=\s*(\d+)")
+
+# (certs, expires_at), shared by every request handled by this process.
+_process_certs = None
+
+
+def _parse_max_age(cache_control):
+    match = _MAX_AGE_RE.search(cache_control or "")
+    if not match:
+        return 0
+    return int(match.group(1))
+
+
+def _fetch_certs():
+    try:
+        resp = requests.get(settings.GOOGLE_ID_TOKEN_CERTS_URI, timeout=10)
+    except requests.RequestException as exc:
+        raise client.VerifyJwtTokenError("Fetching certificates failed: {}".format(exc))
+    if resp.status_code != 200:
+        raise client.VerifyJwtTokenError("Status code: {}".format(resp.status_code))
+    return resp.json(), _parse_max_age(resp.headers.get("Cache-Control"))
+
+
+def get_certs(now=None):
+    global _process_certs
+
+    if settings.GOOGLE_ID_TOKEN_CERTS is not None:
+        return settings.GOOGLE_ID_TOKEN_CERTS
+
+    now = time.time() if now is None else now
+    if _process_certs and _process_certs[1] > now:
+        return _process_certs[0]
+
+    cached = cache.get(CERTS_CACHE_KEY)
+    if cached and cached[1] > now:
+        certs, expires_at = cached
+    else:
+        certs, max_age = _fetch_certs()
+        expires_at = now + max_age
+        if max_age:
+            cache.set(CERTS_CACHE_KEY, (certs, expires_at), timeout=max_age)
+
+    _process_certs = (certs, expires_at)
+    return certs
+
+
+def verify_id_token(id_token, audience):
+    return crypt.verify_signed_jwt_with_certs(id_token, get_certs(), audience)
@@ -0,0 +1,94 @@
+import collections
+import concurrent.futures
+import math
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.db.models import CharField, Count, F, Func, Value
+from django.utils.crypto import get_random_string
+
+from . import models
+
+
+Benchmark = collections.namedtuple("Benchmark", ["algorithm", "work_factor", "current", "elapsed"])
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    # This keeps Django's algorithm name, so existing hashes (including the
+    # 64000 iteration ones imported from the Play app) still verify.
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS or hashers.PBKDF2PasswordHasher.iterations
+
+    def must_update(self, encoded):
+        # Only ever strengthen hashes: otherwise hosts calibrated to different
+        # iteration counts would keep rehashing each other's hashes on login.
+        decoded = self.decode(encoded)
+        if decoded["iterations"] < self.iterations:
+            return True
+        return hashers.must_update_salt(decoded["salt"], self.salt_entropy)
+
+
+def _split_part(field, n):
+    return Func(F(field), Value("$"), Value(n), function="split_part", output_field=CharField())
+
+
+def stored_hashes():
+    # Counts of stored hashes by algorithm and first parameter (the iteration
+    # count, for PBKDF2), so it's clear how many legacy hashes remain.
+    return (
+        models.User.objects.exclude(password__startswith=hashers.UNUSABLE_PASSWORD_PREFIX)
+        .annotate(algorithm=_split_part("password", 1), params=_split_part("password", 2))
+        .values_list("algorithm", "params")
+        .annotate(count=Count("pk"))
+        .order_by("algorithm", "params")
+    )
+
+
+def _work_factor(hasher):
+    for name in ["iterations", "time_cost", "rounds", "work_factor"]:
+        if hasattr(hasher, name):
+            return name
+    return None
+
+
+def benchmark(hasher, samples=5):
+    password = get_random_string(16)
+    timings = []
+    for _ in range(samples):
+        salt = hasher.salt()
+        started = time.perf_counter()
+        hasher.encode(password, salt)
+        timings.append(time.perf_counter() - started)
+    work_factor = _work_factor(hasher)
+    current = getattr(hasher, work_factor) if work_factor else None
+    return Benchmark(hasher.algorithm, work_factor, current, statistics.median(timings))
+
+
+def recommend(result, target):
+    if result.work_factor is None or not result.elapsed:
+        return None
+    ratio = target / result.elapsed
+    if result.work_factor == "rounds":
+        # bcrypt's cost is a power of two
+        return max(4, result.current + round(math.log2(ratio)))
+    if result.work_factor == "work_factor":
+        # scrypt's N must be a power of two
+        return 2 ** max(1, round(math.log2(result.current * ratio)))
+    if result.work_factor == "iterations":
+        return max(1000, int(round(result.current * ratio, -3)))
+    return max(1, round(result.current * ratio))
+
+
+def hash_passwords(passwords, workers=None):
+    # The hash functions release the GIL while they run, so a thread pool
+    # hashes in parallel without the cost of starting worker processes.
+    passwords = list(passwords)
+    workers = min(workers or settings.PASSWORD_HASH_WORKERS, len(passwords))
+    if workers <= 1:
+        return [hashers.make_password(password) for password in passwords]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(hashers.make_password, passwords))
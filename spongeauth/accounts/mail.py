@@ -0,0 +1,122 @@
+import hashlib
+import json
+import logging
+import smtplib
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import render_to_string
+
+import django_rq
+import redis.exceptions
+from rq import Retry
+
+from core import metrics
+import core.utils
+from . import models
+
+
+logger = logging.getLogger(__name__)
+
+FROM_EMAIL = "admin@spongepowered.org"
+
+# (backend, connection), kept open for the lifetime of the worker process so
+# consecutive messages don't each pay for a new SMTP handshake.
+_connection = None
+
+
+def get_persistent_connection():
+    global _connection
+    if _connection is None or _connection[0] != settings.EMAIL_BACKEND:
+        connection = get_connection()
+        connection.open()
+        _connection = (settings.EMAIL_BACKEND, connection)
+    return _connection[1]
+
+
+def close_persistent_connection():
+    global _connection
+    if _connection is None:
+        return
+    connection = _connection[1]
+    _connection = None
+    try:
+        connection.close()
+    except Exception:
+        logger.warning("Failed to close mail connection", exc_info=True)
+
+
+def send_messages(messages):
+    connection = get_persistent_connection()
+    try:
+        return connection.send_messages(messages)
+    except smtplib.SMTPServerDisconnected:
+        # The server probably timed out our idle connection: reconnect and try
+        # once more before giving up and leaving it to the job to retry.
+        close_persistent_connection()
+        return get_persistent_connection().send_messages(messages)
+    except Exception:
+        close_persistent_connection()
+        raise
+
+
+def _dedupe_key(template_name, recipient_list, user_id):
+    ident = json.dumps([template_name, sorted(recipient_list), user_id]).encode("utf8")
+    return "spongeauth:mail:dedupe:{}".format(hashlib.sha256(ident).hexdigest())
+
+
+def _claim_send(template_name, recipient_list, user_id, now):
+    # Sliding window log: a sorted set of the times this message was sent,
+    # trimmed to the window on every attempt.
+    key = _dedupe_key(template_name, recipient_list, user_id)
+    window = settings.MAIL_DEDUPE_WINDOW
+    result = {}
+
+    def _txn(pipe):
+        result["allowed"] = pipe.zcount(key, now - window, "+inf") < settings.MAIL_DEDUPE_MAX_SENDS
+        pipe.multi()
+        pipe.zremrangebyscore(key, "-inf", now - window)
+        if result["allowed"]:
+            pipe.zadd(key, {str(now): now})
+        pipe.expire(key, window)
+
+    core.utils.redis_connection().transaction(_txn, key)
+    return result["allowed"]
+
+
+def queue_mail(subject, template_name, context, recipient_list, user_id=None, now=None):
+    now = time.time() if now is None else now
+    try:
+        allowed = _claim_send(template_name, recipient_list, user_id, now)
+    except redis.exceptions.RedisError:
+        logger.warning("Mail deduplication unavailable, sending anyway", exc_info=True)
+        allowed = True
+
+    if not allowed:
+        metrics.incr("mail.suppressed.{}".format(template_name))
+        return False
+
+    send_templated_mail.delay(subject, template_name, context, recipient_list, user_id=user_id)
+    metrics.incr("mail.queued.{}".format(template_name))
+    return True
+
+
+def render_mail(subject, template_name, context, recipient_list):
+    msg_text = render_to_string(template_name + ".txt", context)
+    msg_html = render_to_string(template_name + ".html", context)
+    msg = EmailMultiAlternatives(subject, msg_text, FROM_EMAIL, recipient_list)
+    msg.attach_alternative(msg_html, "text/html")
+    return msg
+
+
+@django_rq.job("mail", retry=Retry(max=len(settings.MAIL_RETRY_INTERVALS), interval=settings.MAIL_RETRY_INTERVALS))
+def send_templated_mail(subject, template_name, context, recipient_list, user_id=None):
+    context = dict(context)
+    if user_id is not None:
+        try:
+            context["user"] = models.User.objects.get(pk=user_id)
+        except models.User.DoesNotExist:
+            return
+    send_messages([render_mail(subject, template_name, context, recipient_list)])
+    metrics.incr("mail.sent.{}".format(template_name))
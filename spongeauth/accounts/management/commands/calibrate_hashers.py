@@ -0,0 +1,60 @@
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import hashers
+
+
+class Command(BaseCommand):
+    help = "Benchmark the configured password hashers on this host and recommend work factors for a target latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument("algorithm", nargs="*", type=str, help="Only benchmark these hashers")
+        parser.add_argument("--target-ms", type=float, default=250, help="Desired time to hash one password")
+        parser.add_argument("--samples", type=int, default=5)
+        parser.add_argument("--skip-stored", action="store_true", help="Don't summarise the hashes in the database")
+
+    def handle(self, *args, **options):
+        if options["target_ms"] <= 0 or options["samples"] < 1:
+            raise CommandError("--target-ms and --samples must be positive")
+
+        configured = {hasher.algorithm: hasher for hasher in get_hashers()}
+        unknown = set(options["algorithm"]) - set(configured)
+        if unknown:
+            raise CommandError('Unknown hasher: "{}"'.format('", "'.join(sorted(unknown))))
+
+        target = options["target_ms"] / 1000
+        results = {}
+        for algorithm, hasher in configured.items():
+            if options["algorithm"] and algorithm not in options["algorithm"]:
+                continue
+            try:
+                result = hashers.benchmark(hasher, samples=options["samples"])
+            except ValueError as exc:
+                # the hasher's library isn't installed
+                self.stdout.write(self.style.WARNING("{}: skipped ({})".format(algorithm, exc)))
+                continue
+            results[algorithm] = result
+
+            line = "{}: {:.1f}ms per hash".format(algorithm, result.elapsed * 1000)
+            if result.work_factor:
+                line = "{}: {} {}, {:.1f}ms per hash; use {} {} for {:.0f}ms".format(
+                    algorithm,
+                    result.current,
+                    result.work_factor,
+                    result.elapsed * 1000,
+                    hashers.recommend(result, target),
+                    result.work_factor,
+                    options["target_ms"],
+                )
+            self.stdout.write(line)
+
+        if options["skip_stored"]:
+            return
+
+        self.stdout.write("Stored hashes:")
+        for algorithm, params, count in hashers.stored_hashes():
+            line = "  {} {}: {} users".format(algorithm, params, count)
+            result = results.get(algorithm)
+            if result and result.work_factor == "iterations" and params.isdigit():
+                line += " (~{:.1f}ms to verify)".format(result.elapsed * 1000 * int(params) / result.current)
+            self.stdout.write(line)
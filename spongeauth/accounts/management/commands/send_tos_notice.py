@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import models, tos_notice
+
+
+class Command(BaseCommand):
+    help = "Email every active user with a verified email address about a Terms of Service change"
+
+    def add_arguments(self, parser):
+        parser.add_argument("tos", type=str, help="Name of the Terms of Service")
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--rate", type=float, default=None, help="Maximum emails per second, 0 for no limit")
+        parser.add_argument("--language", type=str, default=None)
+        parser.add_argument(
+            "--restart", action="store_true", help="Ignore the checkpoint left by a previous run and start over"
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Count recipients without sending anything")
+
+    def handle(self, *args, **options):
+        try:
+            tos = models.TermsOfService.objects.get(name=options["tos"])
+        except models.TermsOfService.DoesNotExist:
+            raise CommandError('Unknown Terms of Service: "{}"'.format(options["tos"]))
+
+        checkpoint = None if options["restart"] else tos_notice.get_checkpoint(tos)
+        if checkpoint is not None:
+            self.stdout.write("Resuming after user {}".format(checkpoint))
+
+        try:
+            result = tos_notice.send_notices(
+                tos,
+                batch_size=options["batch_size"],
+                rate=options["rate"],
+                resume=not options["restart"],
+                dry_run=options["dry_run"],
+                language=options["language"],
+            )
+        except Exception as ex:
+            raise CommandError(
+                "Sending failed after user {}, run again to resume: {}".format(tos_notice.get_checkpoint(tos), repr(ex))
+            )
+
+        verb = "Would send" if options["dry_run"] else "Sent"
+        self.stdout.write(self.style.SUCCESS("{} {} notices in {:.2f}s".format(verb, result.sent, result.elapsed)))
@@ -3,22 +3,18 @@ import urllib.parse
 from django.urls import resolve, reverse
 from django.shortcuts import redirect
 from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
 import django.urls.exceptions
 
 
-class RedirectIfConditionUnmet:
+class RedirectIfConditionUnmet(MiddlewareMixin):
     REDIRECT_TO = None
 
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):
+    def process_request(self, request):
         if self.must_verify(request.user) and not self.may_pass(request.path):
             params = urllib.parse.urlencode({"next": request.get_full_path()})
             return redirect("{}?{}".format(reverse(self.REDIRECT_TO), params))
-
-        response = self.get_response(request)
-        return response
+        return None
 
     @staticmethod
     def must_verify(user):
@@ -5,9 +5,12 @@ import re
 
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.contrib.auth.hashers import verify_password
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.utils.translation import gettext_lazy as _
 
+from asgiref.sync import sync_to_async
+
 import PIL.Image
 
 from . import letter_avatar
@@ -125,6 +128,19 @@ class User(AbstractBaseUser):
 
     objects = UserManager()
 
+    async def acheck_password(self, raw_password):
+        # Django's version hashes on the event loop, stalling every other
+        # request on it: do the hashing on the thread pool instead.
+        is_correct, must_update = await sync_to_async(verify_password, thread_sensitive=False)(
+            raw_password, self.password
+        )
+        if is_correct and must_update:
+            await sync_to_async(self.set_password, thread_sensitive=False)(raw_password)
+            # Password hash upgrades shouldn't be considered password changes.
+            self._password = None
+            await self.asave(update_fields=["password"])
+        return is_correct
+
     @property
     def avatar(self):
         if self.current_avatar:
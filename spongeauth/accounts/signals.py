@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+# Sent with a user argument when a user's groups have been changed in bulk
+# without going through the groups relation, and so without m2m_changed.
+groups_resynced = Signal()
+
+# Sent with a users argument when users have been created together with
+# bulk_create, and so without post_save.
+users_created = Signal()
@@ -5,6 +5,8 @@ import pytest
 import unittest.mock
 import PIL
 
+from asgiref.sync import async_to_sync
+
 from .. import models, views
 
 _TESTDATA = os.path.join(os.path.dirname(__file__), "testdata")
@@ -43,7 +45,7 @@ def test_avatar_for_user_upload(size, out_filename):
     user, request = _create_mocks(size, "image/png")
     with unittest.mock.patch.object(views, "get_object_or_404") as get_object_or_404:
         get_object_or_404.return_value = user
-        resp = views.avatar_for_user(request, "foo")
+        resp = async_to_sync(views.avatar_for_user)(request, "foo")
     assert resp.status_code == 200
     assert resp["Content-Type"] == "image/png"
     im = PIL.Image.open(io.BytesIO(resp.getvalue()))
@@ -59,7 +61,7 @@ def test_avatar_for_user_upload_webp():
     user, request = _create_mocks("210x210", "image/webp")
     with unittest.mock.patch.object(views, "get_object_or_404") as get_object_or_404:
         get_object_or_404.return_value = user
-        resp = views.avatar_for_user(request, "foo")
+        resp = async_to_sync(views.avatar_for_user)(request, "foo")
     assert resp.status_code == 200
     assert resp["Content-Type"] == "image/webp"
     assert PIL.Image.open(io.BytesIO(resp.getvalue()))
@@ -71,7 +73,7 @@ def test_avatar_for_user_upload_slowpath():
     user.avatar.image_file.file = None
     with unittest.mock.patch.object(views, "get_object_or_404") as get_object_or_404:
         get_object_or_404.return_value = user
-        resp = views.avatar_for_user(request, "foo")
+        resp = async_to_sync(views.avatar_for_user)(request, "foo")
     assert resp.status_code == 200
     assert resp["Content-Type"] == "image/png"
     assert PIL.Image.open(io.BytesIO(resp.getvalue()))
@@ -96,6 +98,6 @@ def test_avatar_for_user_gravatar(size, out_s):
     user.avatar = models.Avatar(source=models.Avatar.URL, remote_url="https://example.com/foo.png")
     with unittest.mock.patch.object(views, "get_object_or_404") as get_object_or_404:
         get_object_or_404.return_value = user
-        resp = views.avatar_for_user(request, "foo")
+        resp = async_to_sync(views.avatar_for_user)(request, "foo")
     assert resp.status_code == 302
     assert resp["Location"] == "https://example.com/foo.png?s=" + out_s
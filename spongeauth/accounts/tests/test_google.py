@@ -0,0 +1,101 @@
+import os.path
+import time
+import unittest.mock
+
+from django.core.cache import cache
+
+from oauth2client import client, crypt
+import pytest
+import requests
+
+from .. import google
+
+
+TESTDATA = os.path.join(os.path.dirname(__file__), "testdata")
+
+
+def _read_testdata(name):
+    with open(os.path.join(TESTDATA, name), "rb") as fh:
+        return fh.read()
+
+
+TEST_CERTS = {"test-key": _read_testdata("google_test_cert.pem").decode("ascii")}
+
+
+def _make_token(audience="gcid", **claims):
+    now = int(time.time())
+    payload = {"iss": "accounts.google.com", "aud": audience, "sub": "15151", "iat": now, "exp": now + 300}
+    payload.update(claims)
+    signer = crypt.Signer.from_string(_read_testdata("google_test_key.pem"))
+    return crypt.make_signed_jwt(signer, payload, key_id="test-key").decode("ascii")
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    cache.delete(google.CERTS_CACHE_KEY)
+    google._process_certs = None
+    yield
+    google._process_certs = None
+
+
+@pytest.fixture
+def fake_get():
+    with unittest.mock.patch.object(requests, "get") as fake_get:
+        fake_get.return_value.status_code = 200
+        fake_get.return_value.json.return_value = TEST_CERTS
+        fake_get.return_value.headers = {"Cache-Control": "public, max-age=19000, must-revalidate, no-transform"}
+        yield fake_get
+
+
+def test_parse_max_age():
+    assert google._parse_max_age("public, max-age=19000, must-revalidate") == 19000
+    assert google._parse_max_age("max-age=60") == 60
+    assert google._parse_max_age("no-store") == 0
+    assert google._parse_max_age(None) == 0
+
+
+def test_verifies_against_local_certs(settings):
+    settings.GOOGLE_ID_TOKEN_CERTS = TEST_CERTS
+    with unittest.mock.patch.object(requests, "get") as fake_get:
+        idinfo = google.verify_id_token(_make_token(), "gcid")
+    assert idinfo["sub"] == "15151"
+    fake_get.assert_not_called()
+
+
+def test_rejects_wrong_audience(settings):
+    settings.GOOGLE_ID_TOKEN_CERTS = TEST_CERTS
+    with pytest.raises(crypt.AppIdentityError):
+        google.verify_id_token(_make_token(audience="someone-else"), "gcid")
+
+
+def test_fetches_certs_once(fake_get):
+    assert google.get_certs(now=1000) == TEST_CERTS
+    assert google.get_certs(now=1000 + 18999) == TEST_CERTS
+    fake_get.assert_called_once()
+
+
+def test_refetches_after_max_age(fake_get):
+    google.get_certs(now=time.time())
+    google.get_certs(now=time.time() + 19001)
+    assert fake_get.call_count == 2
+
+
+def test_shares_certs_through_cache(fake_get):
+    now = time.time()
+    google.get_certs(now=now)
+    google._process_certs = None  # as if in another process
+    assert google.get_certs(now=now + 1) == TEST_CERTS
+    fake_get.assert_called_once()
+
+
+def test_no_caching_without_max_age(fake_get):
+    fake_get.return_value.headers = {}
+    google.get_certs(now=1000)
+    google.get_certs(now=1000)
+    assert fake_get.call_count == 2
+
+
+def test_fetch_failure(fake_get):
+    fake_get.return_value.status_code = 500
+    with pytest.raises(client.VerifyJwtTokenError):
+        google.get_certs()
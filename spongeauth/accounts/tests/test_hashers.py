@@ -0,0 +1,94 @@
+import io
+import unittest.mock
+
+from django.contrib.auth import hashers as django_hashers
+from django.core.management import call_command, CommandError
+import django.shortcuts
+import django.test
+
+import pytest
+
+from . import factories
+from .. import hashers
+
+
+def _legacy_hash(password, iterations):
+    return django_hashers.PBKDF2PasswordHasher().encode(password, "legacysaltlegacysalt1234", iterations)
+
+
+@django.test.override_settings(PASSWORD_PBKDF2_ITERATIONS=2000)
+class TestPBKDF2PasswordHasher(django.test.TestCase):
+    def test_uses_configured_iterations(self):
+        encoded = django_hashers.make_password("secret")
+        assert encoded.startswith("pbkdf2_sha256$2000$")
+
+    def test_upgrades_weaker_hashes(self):
+        hasher = hashers.PBKDF2PasswordHasher()
+        assert hasher.must_update(_legacy_hash("secret", 1000))
+        assert not hasher.must_update(_legacy_hash("secret", 2000))
+        # stronger hashes are left alone rather than downgraded
+        assert not hasher.must_update(_legacy_hash("secret", 3000))
+
+    def test_login_rehashes_legacy_hash_once(self):
+        user = factories.UserFactory.create()
+        user.password = _legacy_hash("secret", 1000)
+        user.save()
+
+        with unittest.mock.patch("django.contrib.auth.hashers.pbkdf2", wraps=django_hashers.pbkdf2) as mock_pbkdf2:
+            resp = self.client.post(
+                django.shortcuts.reverse("accounts:login"), {"username": user.username, "password": "secret"}
+            )
+        assert resp.status_code == 302
+        # one hash to check the password, and one more to upgrade it
+        assert [call.args[2] for call in mock_pbkdf2.call_args_list] == [1000, 2000]
+
+        user.refresh_from_db()
+        assert user.password.startswith("pbkdf2_sha256$2000$")
+
+
+def test_recommend():
+    result = hashers.Benchmark("pbkdf2_sha256", "iterations", 100000, 0.1)
+    assert hashers.recommend(result, 0.25) == 250000
+    result = hashers.Benchmark("bcrypt_sha256", "rounds", 12, 0.4)
+    assert hashers.recommend(result, 0.1) == 10
+    result = hashers.Benchmark("scrypt", "work_factor", 2**14, 0.05)
+    assert hashers.recommend(result, 0.2) == 2**16
+    result = hashers.Benchmark("argon2", "time_cost", 2, 0.1)
+    assert hashers.recommend(result, 0.25) == 5
+
+
+@pytest.mark.django_db
+@django.test.override_settings(PASSWORD_PBKDF2_ITERATIONS=2000)
+def test_command_reports_benchmarks_and_stored_hashes():
+    user = factories.UserFactory.create()
+    user.password = _legacy_hash("secret", 1000)
+    user.save()
+    unusable = factories.UserFactory.create()
+    unusable.set_unusable_password()
+    unusable.save()
+    out = io.StringIO()
+
+    call_command("calibrate_hashers", "pbkdf2_sha256", "--samples=1", "--target-ms=1000", stdout=out)
+
+    output = out.getvalue()
+    assert "pbkdf2_sha256: 2000 iterations, " in output
+    assert "iterations for 1000ms" in output
+    assert "pbkdf2_sha1" not in output
+    assert "pbkdf2_sha256 1000: 1 users (~" in output
+    assert "!" not in output
+
+
+def test_command_unknown_hasher():
+    with pytest.raises(CommandError) as exc:
+        call_command("calibrate_hashers", "rot13")
+    assert str(exc.value) == 'Unknown hasher: "rot13"'
+
+
+def test_hash_passwords(settings):
+    settings.PASSWORD_HASH_WORKERS = 4
+    passwords = ["secret{}".format(n) for n in range(6)]
+
+    encoded = hashers.hash_passwords(passwords)
+    assert all(django_hashers.check_password(password, hashed) for password, hashed in zip(passwords, encoded))
+    assert hashers.hash_passwords([]) == []
+    assert not django_hashers.is_password_usable(hashers.hash_passwords([None])[0])
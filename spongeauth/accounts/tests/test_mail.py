@@ -0,0 +1,126 @@
+import smtplib
+import unittest.mock
+
+import django.core.mail
+
+import fakeredis
+import pytest
+import redis.exceptions
+
+from core import metrics
+from . import factories
+from .. import mail
+
+
+@pytest.fixture(autouse=True)
+def fresh_connection():
+    mail.close_persistent_connection()
+    yield
+    mail.close_persistent_connection()
+
+
+@pytest.mark.django_db
+def test_send_templated_mail():
+    user = factories.UserFactory.create(username="fred")
+
+    mail.send_templated_mail.delay(
+        "Subject", "accounts/verify/email", {"link": "https://example.com/link"}, ["fred@example.com"], user_id=user.pk
+    )
+
+    assert len(django.core.mail.outbox) == 1
+    msg = django.core.mail.outbox[0]
+    assert msg.subject == "Subject"
+    assert msg.from_email == "admin@spongepowered.org"
+    assert msg.to == ["fred@example.com"]
+    assert "Hi fred," in msg.body
+    assert "https://example.com/link" in msg.body
+    html, mimetype = msg.alternatives[0]
+    assert mimetype == "text/html"
+    assert '<a href="https://example.com/link">' in html
+
+
+@pytest.mark.django_db
+def test_send_templated_mail_user_gone():
+    mail.send_templated_mail.delay("Subject", "accounts/verify/email", {"link": "x"}, ["a@example.com"], user_id=-1)
+    assert not django.core.mail.outbox
+
+
+def test_reuses_connection():
+    assert mail.get_persistent_connection() is mail.get_persistent_connection()
+
+
+def test_reconnects_when_disconnected():
+    connections = [unittest.mock.MagicMock(), unittest.mock.MagicMock()]
+    connections[0].send_messages.side_effect = smtplib.SMTPServerDisconnected("bye")
+    with unittest.mock.patch("accounts.mail.get_connection", side_effect=connections):
+        mail.send_messages(["message"])
+
+    connections[0].close.assert_called_once_with()
+    connections[1].open.assert_called_once_with()
+    connections[1].send_messages.assert_called_once_with(["message"])
+
+
+def test_drops_connection_on_failure():
+    connections = [unittest.mock.MagicMock(), unittest.mock.MagicMock()]
+    connections[0].send_messages.side_effect = smtplib.SMTPDataError(451, "try again later")
+    with unittest.mock.patch("accounts.mail.get_connection", side_effect=connections):
+        with pytest.raises(smtplib.SMTPDataError):
+            mail.send_messages(["message"])
+        assert mail.get_persistent_connection() is connections[1]
+
+    connections[0].close.assert_called_once_with()
+
+
+@pytest.fixture
+def fake_redis():
+    conn = fakeredis.FakeStrictRedis()
+    with unittest.mock.patch("core.utils.redis_connection", return_value=conn):
+        yield conn
+
+
+@unittest.mock.patch("accounts.mail.send_templated_mail")
+def test_queue_mail_collapses_duplicates(mock_send_templated_mail, fake_redis, settings):
+    settings.MAIL_DEDUPE_WINDOW = 300
+    settings.MAIL_DEDUPE_MAX_SENDS = 1
+
+    assert mail.queue_mail("Subject", "accounts/verify/email", {"link": "1"}, ["a@example.com"], user_id=1, now=1000)
+    assert not mail.queue_mail(
+        "Subject", "accounts/verify/email", {"link": "2"}, ["a@example.com"], user_id=1, now=1200
+    )
+    mock_send_templated_mail.delay.assert_called_once_with(
+        "Subject", "accounts/verify/email", {"link": "1"}, ["a@example.com"], user_id=1
+    )
+
+    # Other templates, recipients and users aren't affected.
+    assert mail.queue_mail("Subject", "accounts/forgot/email", {}, ["a@example.com"], user_id=1, now=1200)
+    assert mail.queue_mail("Subject", "accounts/verify/email", {}, ["b@example.com"], user_id=1, now=1200)
+    assert mail.queue_mail("Subject", "accounts/verify/email", {}, ["a@example.com"], user_id=2, now=1200)
+
+    assert metrics.get_all("mail.") == {
+        "mail.queued.accounts/forgot/email": 1,
+        "mail.queued.accounts/verify/email": 3,
+        "mail.suppressed.accounts/verify/email": 1,
+    }
+
+
+@unittest.mock.patch("accounts.mail.send_templated_mail")
+def test_queue_mail_window_slides(mock_send_templated_mail, fake_redis, settings):
+    settings.MAIL_DEDUPE_WINDOW = 300
+    settings.MAIL_DEDUPE_MAX_SENDS = 2
+
+    assert mail.queue_mail("Subject", "accounts/verify/email", {}, ["a@example.com"], now=1000)
+    assert mail.queue_mail("Subject", "accounts/verify/email", {}, ["a@example.com"], now=1200)
+    assert not mail.queue_mail("Subject", "accounts/verify/email", {}, ["a@example.com"], now=1250)
+    # the first send has left the window, but the second hasn't
+    assert mail.queue_mail("Subject", "accounts/verify/email", {}, ["a@example.com"], now=1301)
+    assert not mail.queue_mail("Subject", "accounts/verify/email", {}, ["a@example.com"], now=1302)
+    assert mock_send_templated_mail.delay.call_count == 3
+
+
+@unittest.mock.patch("accounts.mail.send_templated_mail")
+def test_queue_mail_without_redis(mock_send_templated_mail):
+    conn = unittest.mock.MagicMock()
+    conn.transaction.side_effect = redis.exceptions.ConnectionError("boom")
+    with unittest.mock.patch("core.utils.redis_connection", return_value=conn):
+        assert mail.queue_mail("Subject", "accounts/verify/email", {}, ["a@example.com"])
+    mock_send_templated_mail.delay.assert_called_once()
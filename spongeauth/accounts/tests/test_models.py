@@ -1,7 +1,9 @@
 import io
 
+from django.contrib.auth.hashers import make_password
 from django.core.files.uploadedfile import SimpleUploadedFile
 
+from asgiref.sync import async_to_sync
 import pytest
 
 from .. import models
@@ -48,6 +50,18 @@ class TestUser:
         assert admin.has_module_perms("blah")
         assert admin.is_staff
 
+    @pytest.mark.django_db
+    def test_acheck_password_upgrades_hash(self):
+        user = factories.UserFactory.create()
+        user.password = make_password("secret", hasher="pbkdf2_sha1")
+        user.save()
+
+        assert not async_to_sync(user.acheck_password)("wrong")
+        assert async_to_sync(user.acheck_password)("secret")
+        user.refresh_from_db()
+        assert user.password.startswith("pbkdf2_sha256$")
+        assert user.check_password("secret")
+
 
 @pytest.mark.django_db
 class TestUserManager:
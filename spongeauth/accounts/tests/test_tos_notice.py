@@ -0,0 +1,125 @@
+import datetime
+import io
+import unittest.mock
+
+from django.core.management import call_command, CommandError
+import django.core.mail
+
+import fakeredis
+import pytest
+
+from . import factories
+from .. import mail, models, tos_notice
+
+
+@pytest.fixture(autouse=True)
+def fake_redis():
+    mail.close_persistent_connection()
+    conn = fakeredis.FakeStrictRedis()
+    with unittest.mock.patch("core.utils.redis_connection", return_value=conn):
+        yield conn
+
+
+@pytest.fixture
+def users():
+    # users created before the ToS exists haven't agreed to it
+    return [
+        factories.UserFactory.create(username="user{}".format(n), email="user{}@example.com".format(n))
+        for n in range(5)
+    ]
+
+
+@pytest.fixture
+def tos(users):
+    return models.TermsOfService.objects.create(
+        name="Privacy Policy",
+        tos_date=datetime.date(2026, 10, 1),
+        tos_url="https://example.com/privacy",
+        current_tos=True,
+        group=factories.GroupFactory.create(),
+    )
+
+
+def _recipients():
+    return [msg.to[0] for msg in django.core.mail.outbox]
+
+
+@pytest.mark.django_db
+def test_skips_ineligible_users(users, tos):
+    users[0].is_active = False
+    users[0].save()
+    users[1].email_verified = False
+    users[1].save()
+    models.TermsOfServiceAcceptance.objects.create(user=users[2], tos=tos)
+
+    result = tos_notice.send_notices(tos, rate=0)
+
+    assert result.sent == 2
+    assert _recipients() == ["user3@example.com", "user4@example.com"]
+    msg = django.core.mail.outbox[0]
+    assert msg.subject == "[Sponge] We've updated our Privacy Policy"
+    assert "https://example.com/privacy" in msg.body
+    assert "https://example.com/privacy" in msg.alternatives[0][0]
+
+
+@pytest.mark.django_db
+def test_sends_in_batches_at_rate(users, tos):
+    sleep = unittest.mock.Mock()
+    with unittest.mock.patch("accounts.mail.send_messages", wraps=mail.send_messages) as mock_send_messages:
+        result = tos_notice.send_notices(tos, batch_size=2, rate=1, sleep=sleep)
+
+    assert result.sent == 5
+    assert [len(call[0][0]) for call in mock_send_messages.call_args_list] == [2, 2, 1]
+    # no need to wait after the last batch
+    assert sleep.call_count == 2
+    assert 1.5 < sleep.call_args[0][0] <= 2
+
+
+@pytest.mark.django_db
+def test_resumes_from_checkpoint(users, tos):
+    with unittest.mock.patch("accounts.mail.send_messages", side_effect=[1, 1, RuntimeError("down")]):
+        with pytest.raises(RuntimeError):
+            tos_notice.send_notices(tos, batch_size=2, rate=0)
+    assert tos_notice.get_checkpoint(tos) == users[3].pk
+
+    result = tos_notice.send_notices(tos, batch_size=2, rate=0)
+
+    assert result.sent == 1
+    assert _recipients() == ["user4@example.com"]
+
+
+@pytest.mark.django_db
+def test_restart_clears_checkpoint(users, tos):
+    tos_notice.set_checkpoint(tos, users[3].pk)
+
+    tos_notice.send_notices(tos, rate=0, resume=False, dry_run=True)
+    assert tos_notice.get_checkpoint(tos) == users[3].pk
+
+    with unittest.mock.patch("accounts.mail.send_messages", side_effect=RuntimeError("down")):
+        with pytest.raises(RuntimeError):
+            tos_notice.send_notices(tos, batch_size=2, rate=0, resume=False)
+    assert tos_notice.get_checkpoint(tos) is None
+
+
+@pytest.mark.django_db
+def test_command(users, tos):
+    tos_notice.set_checkpoint(tos, users[1].pk)
+    out = io.StringIO()
+
+    call_command("send_tos_notice", "Privacy Policy", "--rate=0", stdout=out)
+
+    assert "Resuming after user {}".format(users[1].pk) in out.getvalue()
+    assert "Sent 3 notices" in out.getvalue()
+
+    django.core.mail.outbox = []
+    call_command("send_tos_notice", "Privacy Policy", "--rate=0", "--restart", "--dry-run", stdout=out)
+
+    assert "Would send 5 notices" in out.getvalue()
+    assert not django.core.mail.outbox
+
+
+@pytest.mark.django_db
+def test_command_unknown_tos():
+    with pytest.raises(CommandError) as exc:
+        call_command("send_tos_notice", "Bananas")
+    assert str(exc.value) == 'Unknown Terms of Service: "Bananas"'
@@ -1,7 +1,9 @@
 import unittest.mock
 
+import django.db
 import django.test
 import django.test.client
+import django.test.utils
 import django.shortcuts
 from django.contrib.sessions.middleware import SessionMiddleware
 
@@ -9,6 +11,8 @@ import pytest
 import oauth2client.crypt
 
 from . import factories
+from .. import models
+from .. import signals
 from .. import views
 
 
@@ -54,6 +58,42 @@ class TestLogUserIn:
         assert response["Location"] == "/"
 
 
+@pytest.mark.django_db
+class TestResyncToSGroups:
+    def setup_method(self):
+        self.user = factories.UserFactory.create()
+        self.tos_groups = []
+        for n in range(3):
+            group = factories.GroupFactory.create(internal_name="tos-group-{}".format(n))
+            models.TermsOfService.objects.create(
+                name="ToS {}".format(n), tos_date="2018-01-01", tos_url="https://example.com/{}".format(n), group=group
+            )
+            self.tos_groups.append(group)
+        self.other_group = factories.GroupFactory.create(internal_name="not-a-tos-group")
+
+        # Accepted ToS 0 and 1, but only in the group for ToS 1 and 2.
+        models.TermsOfServiceAcceptance.objects.filter(user=self.user).delete()
+        for group in self.tos_groups[:2]:
+            models.TermsOfServiceAcceptance.objects.create(user=self.user, tos=group.termsofservice_set.get())
+        self.user.groups.set(self.tos_groups[1:] + [self.other_group])
+
+    def test_resyncs_groups(self):
+        with unittest.mock.patch.object(signals.groups_resynced, "send") as mock_send:
+            views._resync_tos_groups(self.user)
+
+        assert set(self.user.groups.all()) == set(self.tos_groups[:2] + [self.other_group])
+        mock_send.assert_called_once_with(sender=models.User, user=self.user)
+
+    def test_no_op_if_in_sync(self):
+        views._resync_tos_groups(self.user)
+        with unittest.mock.patch.object(signals.groups_resynced, "send") as mock_send:
+            with django.test.utils.CaptureQueriesContext(django.db.connection) as queries:
+                views._resync_tos_groups(self.user)
+
+        assert len(queries) == 1
+        mock_send.assert_not_called()
+
+
 class TestLoginRedirectURL:
     def test_next_from_post(self):
         request = unittest.mock.MagicMock()
@@ -170,7 +210,7 @@ class TestVerifyGoogleIDToken:
             views._verify_google_id_token(request)
         assert "google_id_token" in str(exc.value)
 
-    @unittest.mock.patch("oauth2client.client.verify_id_token")
+    @unittest.mock.patch("accounts.google.verify_id_token")
     @django.test.override_settings(GOOGLE_CLIENT_ID="gcid")
     def test_invalid_issuer(self, mock_verify_id_token):
         mock_verify_id_token.return_value = {"iss": "invalid.foo.com"}
@@ -181,7 +221,7 @@ class TestVerifyGoogleIDToken:
         assert str(exc.value) == "Invalid issuer."
         mock_verify_id_token.assert_called_once_with("baz", "gcid")
 
-    @unittest.mock.patch("oauth2client.client.verify_id_token")
+    @unittest.mock.patch("accounts.google.verify_id_token")
     @django.test.override_settings(GOOGLE_CLIENT_ID="gcid")
     def test_valid_token(self, mock_verify_id_token):
         mock_verify_id_token.return_value = {"iss": "accounts.google.com"}
@@ -191,96 +231,82 @@ class TestVerifyGoogleIDToken:
         assert got_token == "baz"
         assert got_idinfo == mock_verify_id_token.return_value
 
+    @unittest.mock.patch("accounts.google.verify_id_token")
+    @django.test.override_settings(GOOGLE_CLIENT_ID="gcid")
+    def test_verifies_once_per_request(self, mock_verify_id_token):
+        mock_verify_id_token.return_value = {"iss": "accounts.google.com"}
+        request = django.test.client.RequestFactory().post("/", {"google_id_token": "baz"})
+        assert views._verify_google_id_token(request) == ("baz", mock_verify_id_token.return_value)
+        assert views._verify_google_id_token(request) == ("baz", mock_verify_id_token.return_value)
+        mock_verify_id_token.assert_called_once_with("baz", "gcid")
 
-@unittest.mock.patch("accounts.views.render_to_string")
-@unittest.mock.patch("accounts.views.send_mail")
+
+@unittest.mock.patch("accounts.mail.queue_mail")
 @unittest.mock.patch("accounts.views.verify_token_generator")
-def test_send_verify_email(mock_token_generator, mock_send_mail, mock_render_to_string):
-    mock_render_to_string.side_effect = lambda template, kwargs: template
+def test_send_verify_email(mock_token_generator, mock_queue_mail):
     mock_token_generator.make_token.return_value = "deadbeef-cafe"
     request = unittest.mock.MagicMock()
     request.build_absolute_uri.side_effect = lambda inp: inp
     user = factories.UserFactory.build()
     views._send_verify_email(request, user)
-    mock_send_mail.assert_called_once_with(
+    mock_queue_mail.assert_called_once_with(
         "[Sponge] Confirm your email address",
-        "accounts/verify/email.txt",
-        "admin@spongepowered.org",
+        "accounts/verify/email",
+        {"link": "/accounts/verify/Tm9uZQ/deadbeef-cafe/"},
         [user.email],
-        html_message="accounts/verify/email.html",
+        user_id=user.pk,
     )
-    template_kwargs = {"user": user, "link": "/accounts/verify/Tm9uZQ/deadbeef-cafe/"}
-    mock_render_to_string.assert_any_call("accounts/verify/email.html", template_kwargs)
-    mock_render_to_string.assert_any_call("accounts/verify/email.txt", template_kwargs)
 
 
-@unittest.mock.patch("accounts.views.render_to_string")
-@unittest.mock.patch("accounts.views.send_mail")
+@unittest.mock.patch("accounts.mail.queue_mail")
 @unittest.mock.patch("accounts.views.forgot_token_generator")
-def test_send_forgot_email(mock_token_generator, mock_send_mail, mock_render_to_string):
-    mock_render_to_string.side_effect = lambda template, kwargs: template
+def test_send_forgot_email(mock_token_generator, mock_queue_mail):
     mock_token_generator.make_token.return_value = "deadbeef-cafe"
     request = unittest.mock.MagicMock()
     request.META = {"REMOTE_ADDR": "::1"}
     request.build_absolute_uri.side_effect = lambda inp: inp
     user = factories.UserFactory.build()
     views._send_forgot_email(request, user)
-    mock_send_mail.assert_called_once_with(
+    mock_queue_mail.assert_called_once_with(
         "[Sponge] Reset your password",
-        "accounts/forgot/email.txt",
-        "admin@spongepowered.org",
+        "accounts/forgot/email",
+        {"ip": "::1", "link": "/accounts/reset/Tm9uZQ/deadbeef-cafe/"},
         [user.email],
-        html_message="accounts/forgot/email.html",
+        user_id=user.pk,
     )
-    template_kwargs = {"user": user, "ip": "::1", "link": "/accounts/reset/Tm9uZQ/deadbeef-cafe/"}
-    mock_render_to_string.assert_any_call("accounts/forgot/email.html", template_kwargs)
-    mock_render_to_string.assert_any_call("accounts/forgot/email.txt", template_kwargs)
 
 
-@unittest.mock.patch("accounts.views.render_to_string")
-@unittest.mock.patch("accounts.views.send_mail")
+@unittest.mock.patch("accounts.mail.queue_mail")
 @unittest.mock.patch("accounts.views.verify_token_generator")
-def test_send_change_email(mock_token_generator, mock_send_mail, mock_render_to_string):
-    mock_render_to_string.side_effect = lambda template, kwargs: template
+def test_send_change_email(mock_token_generator, mock_queue_mail):
     mock_token_generator.make_token.return_value = "deadbeef-cafe"
     request = unittest.mock.MagicMock()
     request.META = {"REMOTE_ADDR": "::1"}
     request.build_absolute_uri.side_effect = lambda inp: inp
     user = factories.UserFactory.build()
     views._send_change_email(request, user, "new-email@example.com")
-    mock_send_mail.assert_called_once_with(
+    mock_queue_mail.assert_called_once_with(
         "[Sponge] Confirm your new email address",
-        "accounts/change_email/email.txt",
-        "admin@spongepowered.org",
+        "accounts/change_email/email",
+        {"link": "/accounts/change-email/Tm9uZQ/deadbeef-cafe/bmV3LWVtYWlsQGV4YW1wbGUuY29t/"},
         ["new-email@example.com"],
-        html_message="accounts/change_email/email.html",
+        user_id=user.pk,
     )
-    template_kwargs = {
-        "user": user,
-        "link": "/accounts/change-email/Tm9uZQ/deadbeef-cafe/bmV3LWVtYWlsQGV4YW1wbGUuY29t/",
-    }
-    mock_render_to_string.assert_any_call("accounts/change_email/email.html", template_kwargs)
-    mock_render_to_string.assert_any_call("accounts/change_email/email.txt", template_kwargs)
-
-
-@unittest.mock.patch("accounts.views.render_to_string")
-@unittest.mock.patch("accounts.views.send_mail")
-def test_send_email_changed_email(mock_send_mail, mock_render_to_string):
-    mock_render_to_string.side_effect = lambda template, kwargs: template
+
+
+@unittest.mock.patch("accounts.mail.queue_mail")
+def test_send_email_changed_email(mock_queue_mail):
     request = unittest.mock.MagicMock()
     request.build_absolute_uri.side_effect = lambda inp: inp
     user = factories.UserFactory.build()
     views._send_email_changed_email(request, user, "old-email@example.com")
-    mock_send_mail.assert_called_once_with(
+    mock_queue_mail.assert_called_once_with(
         "[Sponge] Your email address has been changed",
-        "accounts/change_email/confirmation_email.txt",
-        "admin@spongepowered.org",
+        "accounts/change_email/confirmation_email",
+        {"new_email": user.email},
         ["old-email@example.com"],
-        html_message="accounts/change_email/confirmation_email.html",
+        user_id=user.pk,
     )
-    template_kwargs = {"user": user, "new_email": user.email}
-    mock_render_to_string.assert_any_call("accounts/change_email/confirmation_email.html", template_kwargs)
-    mock_render_to_string.assert_any_call("accounts/change_email/confirmation_email.txt", template_kwargs)
 
 
 def test_make_gravatar_url():
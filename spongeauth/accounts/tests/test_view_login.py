@@ -1,9 +1,12 @@
 import unittest
 
+from django.conf import settings
 import django.test
 import django.shortcuts
 import django.http
 
+from asgiref.sync import sync_to_async
+import fakeredis
 import oauth2client.crypt
 
 from . import factories
@@ -71,6 +74,41 @@ class TestLogin(django.test.TestCase):
         args, kwargs = mock_log_user_in.call_args
         assert args[1] == user
 
+    def test_errors_with_inactive_user(self):
+        user = factories.UserFactory.create(is_active=False)
+        resp = self.client.post(self.path(), {"username": user.username, "password": "secret"})
+        self.assertFormError(resp.context["form"], "password", "The provided password was incorrect.")
+        user = django.contrib.auth.get_user(self.client)
+        assert not user.is_authenticated
+
+    def test_logs_in_with_minimal_queries(self):
+        user = factories.UserFactory.create()
+        user.groups.set(models.TermsOfService.objects.values_list("group", flat=True))
+        # 1 to fetch the user, 1 to resync ToS groups, 1 to update last_login
+        # and 7 to create and save the session (including savepoints).
+        with self.assertNumQueries(10):
+            resp = self.client.post(self.path(), {"username": user.username.upper(), "password": "secret"})
+        assert resp.status_code == 302
+        assert django.contrib.auth.get_user(self.client) == user
+
+    @unittest.mock.patch("accounts.models.verify_password")
+    def test_throttles_before_checking_password(self, mock_verify_password):
+        buckets = {"login-ip": {"capacity": 1, "rate": 0.01}, "login-username": {"capacity": 5, "rate": 0.01}}
+        with self.settings(RATELIMIT_BUCKETS=buckets):
+            with unittest.mock.patch("core.utils.redis_connection", return_value=fakeredis.FakeStrictRedis()):
+                self.client.post(self.path(), {"username": "foobar", "password": "barbarbar"})
+                resp = self.client.post(self.path(), {"username": "foobar", "password": "barbarbar"})
+        assert resp.status_code == 429
+        assert "Retry-After" in resp
+        mock_verify_password.assert_not_called()
+
+    async def test_logs_in_over_asgi(self):
+        user = await sync_to_async(factories.UserFactory.create)()
+        resp = await self.async_client.post(self.path(), {"username": user.username, "password": "secret"})
+        assert resp.status_code == 302
+        assert resp["Location"] == settings.LOGIN_REDIRECT_URL
+        assert "sessionid" in resp.cookies
+
 
 class TestLoginGoogle(django.test.TestCase):
     def setUp(self):
@@ -0,0 +1,108 @@
+import collections
+import itertools
+import logging
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db.models import Exists, OuterRef
+from django.template.loader import render_to_string
+from django.utils import translation
+
+import core.utils
+from . import mail, models
+
+
+logger = logging.getLogger(__name__)
+
+SUBJECT = "[Sponge] We've updated our {}"
+TEMPLATE_NAME = "accounts/tos_notice/email"
+
+Notice = collections.namedtuple("Notice", ["subject", "text", "html"])
+Result = collections.namedtuple("Result", ["sent", "last_pk", "elapsed"])
+
+
+def _checkpoint_key(tos):
+    return "spongeauth:tos_notice:{}".format(tos.pk)
+
+
+def get_checkpoint(tos):
+    last_pk = core.utils.redis_connection().get(_checkpoint_key(tos))
+    return None if last_pk is None else int(last_pk)
+
+
+def set_checkpoint(tos, last_pk):
+    core.utils.redis_connection().set(_checkpoint_key(tos), last_pk)
+
+
+def clear_checkpoint(tos):
+    core.utils.redis_connection().delete(_checkpoint_key(tos))
+
+
+def eligible_users(tos, after_pk=None):
+    accepted = models.TermsOfServiceAcceptance.objects.filter(user=OuterRef("pk"), tos=tos)
+    users = models.User.objects.filter(is_active=True, email_verified=True, deleted_at__isnull=True).exclude(
+        Exists(accepted)
+    )
+    if after_pk is not None:
+        users = users.filter(pk__gt=after_pk)
+    return users.order_by("pk")
+
+
+def render_notice(tos, language=None):
+    # Nothing in the notice is specific to the recipient, so it's rendered
+    # once up front rather than once per user.
+    with translation.override(language or settings.LANGUAGE_CODE):
+        context = {"tos": tos}
+        return Notice(
+            subject=SUBJECT.format(tos.name),
+            text=render_to_string(TEMPLATE_NAME + ".txt", context),
+            html=render_to_string(TEMPLATE_NAME + ".html", context),
+        )
+
+
+def _build_message(notice, email):
+    msg = EmailMultiAlternatives(notice.subject, notice.text, mail.FROM_EMAIL, [email])
+    msg.attach_alternative(notice.html, "text/html")
+    return msg
+
+
+def send_notices(tos, batch_size=None, rate=None, resume=True, dry_run=False, language=None, sleep=time.sleep):
+    batch_size = batch_size or settings.TOS_NOTICE_BATCH_SIZE
+    rate = settings.TOS_NOTICE_RATE if rate is None else rate
+    notice = render_notice(tos, language=language)
+
+    last_pk = get_checkpoint(tos) if resume else None
+    if not resume and not dry_run:
+        # otherwise a restart failing before its first batch would leave the
+        # old checkpoint for the next run to resume from
+        clear_checkpoint(tos)
+    # iterator() streams rows through a server-side cursor, so memory use is
+    # bounded by the batch size however many users there are.
+    rows = eligible_users(tos, after_pk=last_pk).values_list("pk", "email").iterator(chunk_size=batch_size)
+
+    started = time.monotonic()
+    sent = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        batch_started = time.monotonic()
+
+        if not dry_run:
+            mail.send_messages([_build_message(notice, email) for _, email in batch])
+            last_pk = batch[-1][0]
+            set_checkpoint(tos, last_pk)
+        sent += len(batch)
+        logger.info("Sent %d Terms of Service notices for %s (up to user %d)", sent, tos.name, batch[-1][0])
+
+        if len(batch) < batch_size:
+            break
+        if rate:
+            remaining = len(batch) / rate - (time.monotonic() - batch_started)
+            if remaining > 0:
+                sleep(remaining)
+
+    if not dry_run:
+        mail.close_persistent_connection()
+    return Result(sent, last_pk, time.monotonic() - started)
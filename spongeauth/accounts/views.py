@@ -15,17 +15,23 @@ import django.contrib.auth.views
 import django.contrib.auth.tokens
 from django.contrib.auth.decorators import login_required
 from django.utils.http import url_has_allowed_host_and_scheme
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode, urlencode
 from django.core.signing import Signer, BadSignature, loads, dumps
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 
 from . import models
 from . import forms
+from . import google
+from . import mail
 from . import middleware
+from . import signals
 
-from oauth2client import client, crypt
+import core.ratelimit
+
+from asgiref.sync import sync_to_async
+from oauth2client import crypt
 from dal import autocomplete
 from PIL import Image
 
@@ -47,19 +53,42 @@ verify_token_generator = VerifyTokenGenerator()
 forgot_token_generator = ForgotTokenGenerator()
 
 
-def _log_user_in(request, user, skip_twofa=False):
+def _resync_tos_groups(user):
     # Resync groups with the TOS acceptances.
     # XXX(lukegb): this is a hack, don't do this.
+    user_groups = models.User.groups.through.objects
+    tos_groups = models.TermsOfService.objects.annotate(
+        accepted=Exists(models.TermsOfServiceAcceptance.objects.filter(tos=OuterRef("pk"), user=user)),
+        in_group=Exists(user_groups.filter(group=OuterRef("group"), user=user)),
+    ).values_list("group", "accepted", "in_group")
+
+    should_tos_groups, current_tos_groups = set(), set()
+    for group, accepted, in_group in tos_groups:
+        if accepted:
+            should_tos_groups.add(group)
+        if in_group:
+            current_tos_groups.add(group)
+    add_tos_groups = should_tos_groups - current_tos_groups
+    remove_tos_groups = current_tos_groups - should_tos_groups
+    if not add_tos_groups and not remove_tos_groups:
+        return
+
+    # Write to the through table directly, so the whole change is one
+    # groups_resynced signal (and one SSO update) rather than an m2m_changed
+    # for the additions and another for the removals.
+    with transaction.atomic():
+        if remove_tos_groups:
+            user_groups.filter(user=user, group__in=remove_tos_groups).delete()
+        if add_tos_groups:
+            user_groups.bulk_create(
+                [user_groups.model(user=user, group_id=group) for group in add_tos_groups], ignore_conflicts=True
+            )
+    signals.groups_resynced.send(sender=models.User, user=user)
+
+
+def _log_user_in(request, user, skip_twofa=False):
     if user.pk:
-        all_tos_groups = set(models.TermsOfService.objects.all().values_list("group", flat=True))
-        should_tos_groups = set(user.tos_accepted.all().values_list("group", flat=True))
-        current_tos_groups = set(user.groups.all().values_list("id", flat=True)) & all_tos_groups
-        add_tos_groups = should_tos_groups - current_tos_groups
-        remove_tos_groups = current_tos_groups - should_tos_groups
-        for group in add_tos_groups:
-            user.groups.add(group)
-        for group in remove_tos_groups:
-            user.groups.remove(group)
+        _resync_tos_groups(user)
 
     if user.twofa_enabled and not skip_twofa:
         request.session["twofa_target_user"] = user.pk
@@ -103,16 +132,22 @@ def _verify_google_id_token(request):
         raise crypt.AppIdentityError("google_id_token missing.")
     token = request.POST.get("google_id_token", None)
 
-    idinfo = client.verify_id_token(token, django_settings.GOOGLE_CLIENT_ID)
+    # login_google hands over to register_google for new users, so the same
+    # token is verified twice in one request: only do the work once.
+    verified = getattr(request, "_verified_google_id_token", None)
+    if verified and verified[0] == token:
+        return verified
+
+    idinfo = google.verify_id_token(token, django_settings.GOOGLE_CLIENT_ID)
     if idinfo["iss"] not in ["accounts.google.com", "https://accounts.google.com"]:
         raise crypt.AppIdentityError("Invalid issuer.")
 
+    request._verified_google_id_token = (token, idinfo)
     return token, idinfo
 
 
 def _send_verify_email(request, user):
     template_kwargs = {
-        "user": user,
         "link": request.build_absolute_uri(
             reverse(
                 "accounts:verify-step2",
@@ -123,16 +158,13 @@ def _send_verify_email(request, user):
             )
         ),
     }
-    msg_html = render_to_string("accounts/verify/email.html", template_kwargs)
-    msg_text = render_to_string("accounts/verify/email.txt", template_kwargs)
-    send_mail(
-        "[Sponge] Confirm your email address", msg_text, "admin@spongepowered.org", [user.email], html_message=msg_html
+    mail.queue_mail(
+        "[Sponge] Confirm your email address", "accounts/verify/email", template_kwargs, [user.email], user_id=user.pk
     )
 
 
 def _send_forgot_email(request, user):
     template_kwargs = {
-        "user": user,
         "link": request.build_absolute_uri(
             reverse(
                 "accounts:forgot-step2",
@@ -144,16 +176,15 @@ def _send_forgot_email(request, user):
         ),
         "ip": request.META["REMOTE_ADDR"],
     }
-    msg_html = render_to_string("accounts/forgot/email.html", template_kwargs)
-    msg_text = render_to_string("accounts/forgot/email.txt", template_kwargs)
-    send_mail("[Sponge] Reset your password", msg_text, "admin@spongepowered.org", [user.email], html_message=msg_html)
+    mail.queue_mail(
+        "[Sponge] Reset your password", "accounts/forgot/email", template_kwargs, [user.email], user_id=user.pk
+    )
 
 
 def _send_change_email(request, user, new_email):
     old_email = user.email
     user.email = new_email
     template_kwargs = {
-        "user": user,
         "link": request.build_absolute_uri(
             reverse(
                 "accounts:change-email-step2",
@@ -166,27 +197,23 @@ def _send_change_email(request, user, new_email):
         ),
     }
     user.email = old_email
-    msg_html = render_to_string("accounts/change_email/email.html", template_kwargs)
-    msg_text = render_to_string("accounts/change_email/email.txt", template_kwargs)
-    send_mail(
+    mail.queue_mail(
         "[Sponge] Confirm your new email address",
-        msg_text,
-        "admin@spongepowered.org",
+        "accounts/change_email/email",
+        template_kwargs,
         [new_email],
-        html_message=msg_html,
+        user_id=user.pk,
     )
 
 
 def _send_email_changed_email(request, user, old_email):
-    template_kwargs = {"user": user, "new_email": user.email}
-    msg_html = render_to_string("accounts/change_email/confirmation_email.html", template_kwargs)
-    msg_text = render_to_string("accounts/change_email/confirmation_email.txt", template_kwargs)
-    send_mail(
+    template_kwargs = {"new_email": user.email}
+    mail.queue_mail(
         "[Sponge] Your email address has been changed",
-        msg_text,
-        "admin@spongepowered.org",
+        "accounts/change_email/confirmation_email",
+        template_kwargs,
         [old_email],
-        html_message=msg_html,
+        user_id=user.pk,
     )
 
 
@@ -219,23 +246,31 @@ def logout_success(request):
     return resp
 
 
-def login(request):
-    if request.user.is_authenticated:
+async def login(request):
+    user = await request.auser()
+    if user.is_authenticated:
         return redirect(_login_redirect_url(request))
 
     # check if this is a Google login
     if request.method == "POST":
         login_type = request.POST.get("login_type", "form")
         if login_type == "google":
-            return login_google(request)
+            return await sync_to_async(login_google)(request)
 
     form = forms.AuthenticationForm()
     if request.method == "POST":
+        throttled = await sync_to_async(core.ratelimit.check, thread_sensitive=False)(
+            ("login-ip", request.META["REMOTE_ADDR"]),
+            ("login-username", request.POST.get("username", "").lower()),
+        )
+        if throttled:
+            return throttled
+
         form = forms.AuthenticationForm(request.POST)
-        if form.is_valid() and hasattr(form, "cached_user"):
-            return _log_user_in(request, form.cached_user)
+        if await form.ais_valid() and form.cached_user:
+            return await sync_to_async(_log_user_in)(request, form.cached_user)
 
-    return render(request, "accounts/login.html", {
+    return await sync_to_async(render)(request, "accounts/login.html", {
         "form": form,
         "next": _login_redirect_url(request),
         "client_id": django_settings.GOOGLE_CLIENT_ID
@@ -635,9 +670,35 @@ def _read_filefield_to_pil(filefield):
     return Image.open(fh)
 
 
+def _resize_avatar(image_file, size_w, size_h, canvas_w, canvas_h, output_format):
+    pil_image = _read_filefield_to_pil(image_file)
+    orig_w, orig_h = pil_image.size
+    orig_ratio = orig_h / orig_w
+    size_ratio = size_h / size_w
+    if size_ratio < orig_ratio:
+        # fit using height
+        size_w = size_h / orig_ratio
+    else:
+        # fit using width
+        size_h = size_w * orig_ratio
+
+    pil_image = pil_image.resize((int(size_w), int(size_h)), Image.LANCZOS)
+    if canvas_w != size_w or canvas_h != size_h:
+        paste_x = (canvas_w - size_w) / 2
+        paste_y = (canvas_h - size_h) / 2
+        canvas_image = Image.new("RGBA", (int(canvas_w), int(canvas_h)), color=(0, 0, 0, 0))
+        canvas_image.paste(pil_image, (int(paste_x), int(paste_y)))
+        pil_image = canvas_image
+    out = io.BytesIO()
+    pil_image.save(out, format=output_format)
+    return out.getvalue()
+
+
 @middleware.allow_without_verified_email
-def avatar_for_user(request, username):
-    user = get_object_or_404(models.User, username=username)
+async def avatar_for_user(request, username):
+    user = await sync_to_async(get_object_or_404)(
+        models.User.objects.select_related("current_avatar__user"), username=username
+    )
     avatar = user.avatar
     size = request.GET.get("size", None)
     if size:
@@ -661,27 +722,12 @@ def avatar_for_user(request, username):
             output_format = ("WEBP", "image/webp")
 
         if avatar.source == models.Avatar.UPLOAD:
-            pil_image = _read_filefield_to_pil(avatar.image_file)
-            orig_w, orig_h = pil_image.size
-            orig_ratio = orig_h / orig_w
-            size_ratio = size_h / size_w
-            if size_ratio < orig_ratio:
-                # fit using height
-                size_w = size_h / orig_ratio
-            else:
-                # fit using width
-                size_h = size_w * orig_ratio
-
-            pil_image = pil_image.resize((int(size_w), int(size_h)), Image.LANCZOS)
-            if canvas_w != size_w or canvas_h != size_h:
-                paste_x = (canvas_w - size_w) / 2
-                paste_y = (canvas_h - size_h) / 2
-                canvas_image = Image.new("RGBA", (int(canvas_w), int(canvas_h)), color=(0, 0, 0, 0))
-                canvas_image.paste(pil_image, (int(paste_x), int(paste_y)))
-                pil_image = canvas_image
-            out = io.BytesIO()
-            pil_image.save(out, format=output_format[0])
-            return HttpResponse(out.getvalue(), output_format[1])
+            # resizing is CPU bound and touches no models, so run it on the
+            # thread pool.
+            image = await sync_to_async(_resize_avatar, thread_sensitive=False)(
+                avatar.image_file, size_w, size_h, canvas_w, canvas_h, output_format[0]
+            )
+            return HttpResponse(image, output_format[1])
         elif avatar.source == models.Avatar.URL:
             # This scheme works for Gravatar *shrug*
             return redirect(user.avatar.get_absolute_url() + "?s=" + str(int(max((size_w, size_h)))))
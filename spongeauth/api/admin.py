@@ -1,5 +1,38 @@
 from django.contrib import admin
+from django import forms
 
 import api.models
 
-admin.site.register(api.models.APIKey)
+
+class APIKeyForm(forms.ModelForm):
+    key = forms.CharField(
+        required=False,
+        widget=forms.PasswordInput,
+        help_text="Keys are stored hashed, so they can't be shown here. Leave blank to keep the current key.",
+    )
+
+    class Meta:
+        model = api.models.APIKey
+        fields = ["description"]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        key = cleaned_data.get("key")
+        if not key:
+            if self.instance.pk is None:
+                self.add_error("key", "A new API key needs a key.")
+        elif api.models.APIKey.objects.filter(key_hash=api.models.hash_key(key)).exclude(pk=self.instance.pk).exists():
+            self.add_error("key", "That key is already in use.")
+        return cleaned_data
+
+    def save(self, commit=True):
+        if self.cleaned_data.get("key"):
+            self.instance.key = self.cleaned_data["key"]
+        return super().save(commit=commit)
+
+
+class APIKeyAdmin(admin.ModelAdmin):
+    form = APIKeyForm
+
+
+admin.site.register(api.models.APIKey, APIKeyAdmin)
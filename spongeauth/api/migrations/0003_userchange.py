@@ -0,0 +1,60 @@
+# Generated by Django 5.1.3 on 2026-10-19 14:03
+
+import itertools
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def forwards_func(apps, schema_editor):
+    # Start the feed with every existing user, so consumers can bootstrap from
+    # it rather than fetching users one at a time.
+    User = apps.get_model("accounts", "User")
+    UserChange = apps.get_model("api", "UserChange")
+    db_alias = schema_editor.connection.alias
+    user_ids = User.objects.using(db_alias).order_by("pk").values_list("pk", flat=True).iterator(chunk_size=1000)
+    while True:
+        batch = [UserChange(user_id=user_id, kind="created") for user_id in itertools.islice(user_ids, 1000)]
+        if not batch:
+            break
+        UserChange.objects.using(db_alias).bulk_create(batch)
+
+
+def reverse_func(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0002_auto_20170114_0120"),
+        ("accounts", "0013_user_discord_id"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserChange",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("created", "Created"), ("updated", "Updated"), ("deleted", "Deleted")], max_length=10
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(forwards_func, reverse_func),
+    ]
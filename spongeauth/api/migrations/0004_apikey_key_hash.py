@@ -0,0 +1,34 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def forwards_func(apps, schema_editor):
+    APIKey = apps.get_model("api", "APIKey")
+    db_alias = schema_editor.connection.alias
+    seen = set()
+    for api_key in APIKey.objects.using(db_alias).order_by("pk"):
+        key_hash = hashlib.sha256(api_key.key.encode("utf8")).hexdigest()
+        if key_hash in seen:
+            # the same key twice grants nothing the first doesn't
+            api_key.delete()
+            continue
+        seen.add(key_hash)
+        api_key.key_hash = key_hash
+        api_key.save(update_fields=["key_hash"])
+
+
+def reverse_func(apps, schema_editor):
+    raise RuntimeError("API keys can't be recovered from their hashes")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("api", "0003_userchange")]
+
+    operations = [
+        migrations.AddField(model_name="apikey", name="key_hash", field=models.CharField(max_length=64, null=True)),
+        migrations.RunPython(forwards_func, reverse_func),
+        migrations.RemoveField(model_name="apikey", name="key"),
+        migrations.AlterField(model_name="apikey", name="key_hash", field=models.CharField(max_length=64, unique=True)),
+    ]
@@ -1,9 +1,221 @@
-from django.db import models
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+
+from accounts.models import Group, User
+from accounts.signals import groups_resynced, users_created
+
+
+def hash_key(key):
+    return hashlib.sha256(key.encode("utf8")).hexdigest()
+
+
+# {key digest: (APIKey, expires_at, generation)} for keys this process has
+# recently seen.
+_key_cache = {}
+# Bumped in the shared cache whenever any key changes, so every process
+# stops trusting the keys it has cached.
+KEY_GENERATION = "api:key-generation"
+
+
+def clear_key_cache():
+    _key_cache.clear()
+
+
+def bump_key_generation():
+    cache.add(KEY_GENERATION, 0, timeout=None)
+    try:
+        cache.incr(KEY_GENERATION)
+    except ValueError:
+        # evicted since: a fresh generation is just as good
+        cache.add(KEY_GENERATION, 1, timeout=None)
+
+
+def _cached_key(digest, now, generation):
+    cached = _key_cache.get(digest)
+    if cached is None:
+        return None
+    if cached[1] <= now or cached[2] != generation:
+        _key_cache.pop(digest, None)
+        return None
+    return cached[0]
+
+
+def _cache_key(digest, api_key, now, generation):
+    if len(_key_cache) >= settings.API_KEY_CACHE_SIZE:
+        _key_cache.clear()
+    _key_cache[digest] = (api_key, now + settings.API_KEY_CACHE_TTL, generation)
+
+
+class APIKeyManager(models.Manager):
+    def authenticate(self, key, now=None):
+        digest = hash_key(key)
+        if settings.API_KEY_CACHE_TTL <= 0:
+            return self.filter(key_hash=digest).first()
+        now = time.monotonic() if now is None else now
+        # read before the key is, so a change in between isn't cached
+        generation = cache.get(KEY_GENERATION, 0)
+        api_key = _cached_key(digest, now, generation)
+        if api_key is None:
+            api_key = self.filter(key_hash=digest).first()
+            if api_key is not None:
+                _cache_key(digest, api_key, now, generation)
+        return api_key
+
+    async def aauthenticate(self, key, now=None):
+        digest = hash_key(key)
+        if settings.API_KEY_CACHE_TTL <= 0:
+            return await self.filter(key_hash=digest).afirst()
+        now = time.monotonic() if now is None else now
+        generation = await cache.aget(KEY_GENERATION, 0)
+        api_key = _cached_key(digest, now, generation)
+        if api_key is None:
+            api_key = await self.filter(key_hash=digest).afirst()
+            if api_key is not None:
+                _cache_key(digest, api_key, now, generation)
+        return api_key
 
 
 class APIKey(models.Model):
-    key = models.CharField(max_length=52, null=False, blank=False)
+    # Only a digest of the key is stored: keys are long random strings, so a
+    # plain SHA-256 is enough and can be looked up directly.
+    key_hash = models.CharField(max_length=64, unique=True, null=False, blank=False)
     description = models.CharField(max_length=255, null=False, blank=True, default="")
 
+    objects = APIKeyManager()
+
     def __str__(self):
         return self.description or "<unnamed API key>"
+
+    @property
+    def key(self):
+        return None
+
+    @key.setter
+    def key(self, value):
+        self.key_hash = hash_key(value)
+
+
+@receiver(post_save, sender=APIKey)
+@receiver(post_delete, sender=APIKey)
+def on_api_key_change(sender, **kwargs):
+    clear_key_cache()
+    # other processes, once the change can be seen
+    transaction.on_commit(bump_key_generation)
+
+
+class UserChange(models.Model):
+    CREATED = "created"
+    UPDATED = "updated"
+    DELETED = "deleted"
+    KIND_CHOICES = ((CREATED, _("Created")), (UPDATED, _("Updated")), (DELETED, _("Deleted")))
+
+    # Append-only: the id is the position in the feed consumers page through.
+    id = models.BigAutoField(primary_key=True)
+    # No constraint, so the feed outlives users who are purged.
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, blank=False, null=False)
+    created_at = models.DateTimeField(auto_now_add=True, null=False, blank=False)
+
+    def __str__(self):
+        return "{} {} {}".format(self.id, self.kind, self.user_id)
+
+
+# The User fields the API returns: saves which don't change any of them
+# aren't worth telling consumers about.
+FEED_USER_FIELDS = frozenset(["username", "email", "is_active", "current_avatar_id"])
+
+
+def user_version_key(username):
+    return "api:user-version:{}".format(username)
+
+
+def forget_user_versions(usernames):
+    # Only once the change commits: a request before then would just cache a
+    # new version of the old details again.
+    keys = [user_version_key(username) for username in usernames]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def record_changes(user_ids, kind=UserChange.UPDATED, usernames=None):
+    user_ids = list(user_ids)
+    UserChange.objects.bulk_create(UserChange(user_id=user_id, kind=kind) for user_id in user_ids)
+    if not usernames:
+        usernames = User.objects.filter(pk__in=user_ids).values_list("username", flat=True)
+    forget_user_versions(usernames)
+
+
+def _feed_values(instance):
+    return {name: instance.__dict__[name] for name in FEED_USER_FIELDS if name in instance.__dict__}
+
+
+@receiver(post_init, sender=User)
+def on_user_init(sender, instance=None, **kwargs):
+    instance._feed_values = _feed_values(instance)
+
+
+@receiver(post_save, sender=User)
+def on_user_save(sender, instance=None, created=False, update_fields=None, **kwargs):
+    original = getattr(instance, "_feed_values", {})
+    current = _feed_values(instance)
+    instance._feed_values = current
+    # a renamed user's old username is forgotten too
+    usernames = {values["username"] for values in (original, current) if "username" in values}
+    if created:
+        record_changes([instance.pk], kind=UserChange.CREATED, usernames=usernames)
+    elif original.get("is_active", True) and not current.get("is_active", True):
+        record_changes([instance.pk], kind=UserChange.DELETED, usernames=usernames)
+    elif any(name not in original or original[name] != value for name, value in current.items()):
+        record_changes([instance.pk], usernames=usernames)
+
+
+@receiver(users_created, sender=User)
+def on_users_created(sender, users=None, **kwargs):
+    record_changes([user.pk for user in users], kind=UserChange.CREATED, usernames=[user.username for user in users])
+
+
+@receiver(groups_resynced, sender=User)
+def on_groups_resynced(sender, user=None, **kwargs):
+    record_changes([user.pk], usernames=[user.username])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def on_group_change(sender, instance=None, pk_set=None, action=None, reverse=None, **kwargs):
+    if action in ("post_add", "post_remove"):
+        record_changes(pk_set if reverse else [instance.pk])
+    elif action == "pre_clear" and reverse:
+        record_changes(instance.user_set.values_list("pk", flat=True))
+    elif action == "post_clear" and not reverse:
+        record_changes([instance.pk])
+
+
+@receiver(post_delete, sender=User)
+def on_user_delete(sender, instance=None, **kwargs):
+    record_changes([instance.pk], kind=UserChange.DELETED, usernames=[instance.username])
+
+
+@receiver(post_init, sender=Group)
+def on_group_init(sender, instance=None, **kwargs):
+    instance._api_name = instance.__dict__.get("name")
+
+
+@receiver(post_save, sender=Group)
+def on_group_save(sender, instance=None, created=False, **kwargs):
+    # Members' details include their groups' names.
+    renamed = not created and instance._api_name != instance.name
+    instance._api_name = instance.name
+    if renamed:
+        record_changes(instance.user_set.values_list("pk", flat=True))
+
+
+@receiver(pre_delete, sender=Group)
+def on_group_delete(sender, instance=None, **kwargs):
+    # Memberships are deleted along with the group, without m2m_changed.
+    record_changes(instance.user_set.values_list("pk", flat=True))
@@ -0,0 +1,115 @@
+import json
+import unittest.mock
+
+import django.shortcuts
+from django.contrib.auth import hashers
+
+import pytest
+
+import accounts.hashers
+import accounts.models
+import accounts.tests.factories
+import api.models
+
+
+@pytest.fixture
+def batch_create(client):
+    api.models.APIKey.objects.create(key="foobar")
+
+    def _batch_create(body):
+        url = "{}?apiKey=foobar".format(django.shortcuts.reverse("api:users-batch"))
+        return client.post(url, json.dumps(body), content_type="application/json")
+
+    return _batch_create
+
+
+@pytest.mark.django_db
+def test_invalid_api_key(client):
+    resp = client.post(django.shortcuts.reverse("api:users-batch"), {"api-key": "foobar"})
+    assert resp.status_code == 403
+
+
+@pytest.mark.django_db
+def test_creates_users(batch_create, django_capture_on_commit_callbacks):
+    existing = accounts.tests.factories.UserFactory.create()
+    rows = [
+        {"username": "alice", "email": "alice@example.com", "password": "secret1", "verified": True},
+        {"username": "bob", "email": "bob@example.com", "password": "secret2", "dummy": True},
+        {"username": existing.username, "email": "carol@example.com", "password": "secret3"},
+        {"username": "alice", "email": "alice2@example.com", "password": "secret4"},
+        {"username": "dave", "email": "not an email", "password": "secret5"},
+    ]
+    with django_capture_on_commit_callbacks(execute=True):
+        resp = batch_create({"users": rows})
+    assert resp.status_code == 200
+    results = resp.json()["results"]
+    assert [result["status"] for result in results] == [201, 201, 422, 422, 422]
+    assert results[2]["error"] == ["User with this Username already exists."]
+    assert results[3]["error"] == ["User with this Username already exists."]
+    assert results[4]["error"] == ["Enter a valid email address."]
+
+    alice = accounts.models.User.objects.get(username="alice")
+    bob = accounts.models.User.objects.get(username="bob")
+    assert results[0]["user"]["id"] == alice.id
+    assert results[1]["user"]["groups"] == [{"id": bob.groups.get().id, "name": "Dummy"}]
+    assert alice.email_verified and not bob.email_verified
+    assert alice.check_password("secret1") and bob.check_password("secret2")
+    assert not alice.groups.exists()
+    assert not accounts.models.User.objects.filter(email="carol@example.com").exists()
+    assert set(
+        api.models.UserChange.objects.filter(kind=api.models.UserChange.CREATED).values_list("user_id", flat=True)
+    ) == {existing.id, alice.id, bob.id}
+
+
+@pytest.mark.django_db
+def test_reports_rows_taken_while_hashing(batch_create):
+    rows = [
+        {"username": "alice", "email": "alice@example.com", "password": "secret1"},
+        {"username": "bob", "email": "bob@example.com", "password": "secret2"},
+    ]
+
+    def _hash_passwords(passwords):
+        # someone else signs up as bob in the meantime
+        accounts.tests.factories.UserFactory.create(username="someone", email="bob@example.com")
+        return [hashers.make_password(password) for password in passwords]
+
+    with unittest.mock.patch("accounts.hashers.hash_passwords", side_effect=_hash_passwords):
+        resp = batch_create({"users": rows})
+    assert resp.status_code == 200
+    results = resp.json()["results"]
+    assert [result["status"] for result in results] == [201, 422]
+    assert results[1]["error"] == ["User with this Email already exists."]
+    assert accounts.models.User.objects.filter(username="alice").exists()
+    assert not accounts.models.User.objects.filter(username="bob").exists()
+
+
+@pytest.mark.django_db
+def test_queries_do_not_grow_with_rows(batch_create, django_assert_num_queries):
+    rows = [
+        {"username": "user{}".format(n), "email": "user{}@example.com".format(n), "password": "secret", "dummy": True}
+        for n in range(10)
+    ]
+
+    with unittest.mock.patch(
+        "accounts.hashers.hash_passwords", wraps=accounts.hashers.hash_passwords
+    ) as mock_hash_passwords:
+        # key, taken check, savepoint + insert + feed + release, dummy group
+        # lookup + existing members + insert + feed, groups prefetch
+        with django_assert_num_queries(12):
+            resp = batch_create({"users": rows})
+    assert [result["status"] for result in resp.json()["results"]] == [201] * 10
+    assert mock_hash_passwords.call_count == 1
+
+
+@pytest.mark.django_db
+def test_bad_requests(batch_create, client, settings):
+    assert batch_create({"user": []}).status_code == 400
+    assert batch_create({"users": ["alice"]}).status_code == 400
+
+    settings.API_BATCH_CREATE_MAX_USERS = 1
+    resp = batch_create({"users": [{}, {}]})
+    assert resp.status_code == 400
+    assert resp.json() == {"error": ["At most 1 users can be created at once"]}
+
+    url = "{}?apiKey=foobar".format(django.shortcuts.reverse("api:users-batch"))
+    assert client.get(url).status_code == 405
@@ -0,0 +1,164 @@
+import json
+
+import django.shortcuts
+import django.utils.timezone
+
+import pytest
+
+import accounts.models
+import accounts.tests.factories
+import accounts.views
+import api.models
+import api.views
+
+
+@pytest.fixture
+def changes(client, settings):
+    settings.API_CHANGES_SETTLE = 0
+    api.models.APIKey.objects.create(key="foobar")
+
+    def _changes(**params):
+        resp = client.get(django.shortcuts.reverse("api:changes"), dict(params, apiKey="foobar"))
+        assert resp.status_code == 200
+        assert resp["Content-Type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in resp.content.decode("utf8").splitlines()]
+        return lines[:-1], lines[-1]
+
+    return _changes
+
+
+@pytest.mark.django_db
+def test_invalid_api_key(client):
+    resp = client.get(django.shortcuts.reverse("api:changes"), {"apiKey": "foobar"})
+    assert resp.status_code == 403
+
+
+@pytest.mark.django_db
+def test_pages_through_changes(changes):
+    users = accounts.tests.factories.UserFactory.create_batch(3)
+
+    page, end = changes(limit=2)
+    assert [(line["id"], line["change"]) for line in page] == [(users[0].id, "created"), (users[1].id, "created")]
+    assert page[0]["username"] == users[0].username
+    assert "avatar_url" in page[0]
+    assert end["more"]
+
+    page, end = changes(limit=2, cursor=end["cursor"])
+    assert [line["id"] for line in page] == [users[2].id]
+    assert not end["more"]
+
+    # nothing new: the cursor stays put
+    cursor = end["cursor"]
+    page, end = changes(cursor=cursor)
+    assert page == []
+    assert end["cursor"] == cursor
+
+
+@pytest.mark.django_db
+def test_records_changes(changes):
+    user = accounts.tests.factories.UserFactory.create()
+    group = accounts.tests.factories.GroupFactory.create()
+    _, end = changes()
+    cursor = end["cursor"]
+
+    user.last_login = django.utils.timezone.now()
+    user.save()
+    page, end = changes(cursor=cursor)
+    assert page == []
+
+    user.email = "changed@example.com"
+    user.save()
+    group.user_set.add(user)
+    page, end = changes(cursor=end["cursor"])
+    # collapsed to one line, with the user's current details
+    assert [(line["id"], line["change"]) for line in page] == [(user.id, "updated")]
+    assert page[0]["email"] == "changed@example.com"
+    assert page[0]["groups"] == [{"id": group.id, "name": group.name}]
+
+    group.user_set.clear()
+    page, end = changes(cursor=end["cursor"])
+    assert [line["id"] for line in page] == [user.id]
+
+    user.is_active = False
+    user.save()
+    page, end = changes(cursor=end["cursor"])
+    assert [(line["id"], line["change"]) for line in page] == [(user.id, "deleted")]
+
+
+@pytest.mark.django_db
+def test_records_tos_group_resync(changes):
+    user = accounts.tests.factories.UserFactory.create()
+    group = accounts.tests.factories.GroupFactory.create()
+    tos = accounts.models.TermsOfService.objects.create(
+        name="ToS", tos_date="2018-01-01", tos_url="https://example.com/tos", group=group
+    )
+    _, end = changes()
+
+    accounts.models.TermsOfServiceAcceptance.objects.create(user=user, tos=tos)
+    accounts.views._resync_tos_groups(user)
+    page, end = changes(cursor=end["cursor"])
+    assert [(line["id"], line["change"]) for line in page] == [(user.id, "updated")]
+    assert {"id": group.id, "name": group.name} in page[0]["groups"]
+
+
+@pytest.mark.django_db
+def test_records_group_renames_and_deletes(changes):
+    users = accounts.tests.factories.UserFactory.create_batch(2)
+    group = accounts.tests.factories.GroupFactory.create()
+    group.user_set.add(users[0])
+    _, end = changes()
+
+    group.internal_only = not group.internal_only
+    group.save()
+    page, end = changes(cursor=end["cursor"])
+    assert page == []
+
+    group.name = "Renamed"
+    group.save()
+    page, end = changes(cursor=end["cursor"])
+    assert [(line["id"], line["change"]) for line in page] == [(users[0].id, "updated")]
+    assert {"id": group.id, "name": "Renamed"} in page[0]["groups"]
+
+    group.delete()
+    page, end = changes(cursor=end["cursor"])
+    assert [(line["id"], line["change"]) for line in page] == [(users[0].id, "updated")]
+    assert "Renamed" not in [group["name"] for group in page[0]["groups"]]
+
+
+@pytest.mark.django_db
+def test_records_hard_deletes(changes):
+    user = accounts.tests.factories.UserFactory.create()
+    user_id = user.id
+    _, end = changes()
+
+    user.delete()
+    page, _ = changes(cursor=end["cursor"])
+    assert page == [{"id": user_id, "change": "deleted"}]
+
+
+@pytest.mark.django_db
+def test_purged_users(changes):
+    user = accounts.tests.factories.UserFactory.create()
+    user_id = user.id
+    accounts.models.User.objects.filter(pk=user_id).delete()
+
+    page, _ = changes()
+    assert page == [{"id": user_id, "change": "deleted"}]
+
+
+@pytest.mark.django_db
+def test_holds_back_unsettled_changes(changes, settings):
+    accounts.tests.factories.UserFactory.create()
+    settings.API_CHANGES_SETTLE = 60
+
+    page, end = changes()
+    assert page == []
+    assert end == {"cursor": api.views._encode_cursor(0), "more": False}
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("params", [{"cursor": "nonsense"}, {"cursor": "djI6MTI"}, {"limit": "lots"}])
+def test_bad_params(client, params):
+    api.models.APIKey.objects.create(key="foobar")
+    resp = client.get(django.shortcuts.reverse("api:changes"), dict(params, apiKey="foobar"))
+    assert resp.status_code == 400
@@ -0,0 +1,118 @@
+import json
+
+import django.shortcuts
+
+import pytest
+
+from asgiref.sync import async_to_sync
+
+import accounts.models
+import accounts.tests.factories
+import api.models
+import api.views
+
+
+def _lines(content):
+    return [json.loads(line) for line in content.decode("utf8").splitlines()]
+
+
+@pytest.fixture
+def export(client):
+    api.models.APIKey.objects.create(key="foobar")
+
+    def _export(**params):
+        resp = client.get(django.shortcuts.reverse("api:users-export"), dict(params, apiKey="foobar"))
+        assert resp.status_code == 200
+        assert resp["Content-Type"] == "application/x-ndjson"
+        return _lines(b"".join(resp.streaming_content))
+
+    return _export
+
+
+@pytest.mark.django_db
+def test_invalid_api_key(client):
+    resp = client.get(django.shortcuts.reverse("api:users-export"), {"apiKey": "foobar"})
+    assert resp.status_code == 403
+
+
+@pytest.mark.django_db
+def test_exports_active_users(export, rf):
+    group = accounts.tests.factories.GroupFactory.create()
+    users = accounts.tests.factories.UserFactory.create_batch(3)
+    users[1].groups.add(group)
+    users[2].current_avatar = accounts.models.Avatar.objects.create(
+        user=users[2], source=accounts.models.Avatar.URL, remote_url="https://example.com/avatar.png"
+    )
+    users[2].save()
+    accounts.tests.factories.UserFactory.create(is_active=False)
+
+    lines = export()
+    request = rf.get("/")
+    assert lines[:-1] == [
+        api.views._encode_user(request, accounts.models.User.objects.get(pk=user.pk)) for user in users
+    ]
+    assert lines[-1] == {"cursor": api.views._encode_cursor(users[2].id, "users-v1"), "more": False}
+
+
+@pytest.mark.django_db
+def test_streams_in_batches(export, settings, django_assert_num_queries):
+    settings.API_EXPORT_BATCH_SIZE = 2
+    users = accounts.tests.factories.UserFactory.create_batch(5)
+
+    # the key, then users and groups for each of three batches
+    with django_assert_num_queries(7):
+        lines = export()
+    assert [line.get("id") for line in lines] == [
+        users[0].id,
+        users[1].id,
+        None,
+        users[2].id,
+        users[3].id,
+        None,
+        users[4].id,
+        None,
+    ]
+    assert [line["more"] for line in lines if "cursor" in line] == [True, True, False]
+
+
+@pytest.mark.django_db
+def test_resumes_from_cursor(export):
+    users = accounts.tests.factories.UserFactory.create_batch(5)
+
+    lines = export(limit=2)
+    assert [line["id"] for line in lines[:-1]] == [users[0].id, users[1].id]
+    assert lines[-1]["more"]
+
+    lines = export(cursor=lines[-1]["cursor"], limit=2)
+    assert [line["id"] for line in lines[:-1]] == [users[2].id, users[3].id]
+
+    lines = export(cursor=lines[-1]["cursor"])
+    assert [line["id"] for line in lines[:-1]] == [users[4].id]
+    assert not lines[-1]["more"]
+
+
+@pytest.mark.django_db
+def test_bad_requests(client):
+    api.models.APIKey.objects.create(key="foobar")
+    url = django.shortcuts.reverse("api:users-export")
+    changes_cursor = api.views._encode_cursor(1)
+
+    for params in [{"cursor": "!!"}, {"cursor": changes_cursor}, {"limit": "many"}, {"limit": "0"}]:
+        assert client.get(url, dict(params, apiKey="foobar")).status_code == 400
+    assert client.post(url, {"api-key": "foobar"}).status_code == 405
+
+
+@pytest.mark.django_db
+def test_exports_asgi(async_client, settings):
+    settings.API_EXPORT_BATCH_SIZE = 2
+    api.models.APIKey.objects.create(key="foobar")
+    users = accounts.tests.factories.UserFactory.create_batch(3)
+
+    async def _export():
+        resp = await async_client.get(django.shortcuts.reverse("api:users-export"), {"apiKey": "foobar"})
+        assert resp.status_code == 200
+        assert resp.is_async
+        return b"".join([chunk async for chunk in resp.streaming_content])
+
+    lines = _lines(async_to_sync(_export)())
+    assert [line.get("id") for line in lines] == [users[0].id, users[1].id, None, users[2].id, None]
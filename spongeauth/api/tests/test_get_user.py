@@ -1,11 +1,16 @@
+import django.core.cache
 import django.shortcuts
+import django.utils.timezone
 
+from asgiref.sync import async_to_sync
 import pytest
 import faker
 
 import accounts.models
 import accounts.tests.factories
+import accounts.views
 import api.models
+import api.views
 
 
 @pytest.fixture
@@ -78,3 +83,168 @@ def test_existing_user_in_group(client, fake):
     assert "groups" in data
     assert len(data["groups"]) == 1
     assert data["groups"][0] == {"id": group.id, "name": group.name}
+
+
+@pytest.mark.django_db
+def test_existing_user_asgi(async_client):
+    api.models.APIKey.objects.create(key="foobar")
+    group = accounts.tests.factories.GroupFactory.create()
+    user = accounts.tests.factories.UserFactory.create()
+    user.groups.add(group)
+
+    resp = async_to_sync(async_client.get)(
+        django.shortcuts.reverse("api:users-detail", kwargs={"username": user.username}), {"apiKey": "foobar"}
+    )
+    assert resp.status_code == 200
+    assert resp.json()["groups"] == [{"id": group.id, "name": group.name}]
+
+
+@pytest.mark.django_db
+def test_invalid_api_key_asgi(async_client, fake):
+    resp = async_to_sync(async_client.get)(
+        django.shortcuts.reverse("api:users-detail", kwargs={"username": fake.user_name()}), {"apiKey": "foobar"}
+    )
+    assert resp.status_code == 403
+
+
+@pytest.mark.django_db
+def test_attaches_api_key(rf):
+    apikey = api.models.APIKey.objects.create(key="foobar")
+    view = api.views._require_api_key(lambda request: request.api_key)
+
+    assert view(rf.get("/", {"apiKey": "foobar"})) == apikey
+
+
+@pytest.fixture
+def cached(settings):
+    settings.API_KEY_CACHE_TTL = 60
+    api.models.clear_key_cache()
+    django.core.cache.cache.clear()
+    yield
+    api.models.clear_key_cache()
+
+
+@pytest.mark.django_db
+def test_conditional_get(client, cached, django_assert_num_queries, django_capture_on_commit_callbacks):
+    api.models.APIKey.objects.create(key="foobar")
+    user = accounts.tests.factories.UserFactory.create()
+    url = django.shortcuts.reverse("api:users-detail", kwargs={"username": user.username})
+
+    resp = client.get(url, {"apiKey": "foobar"})
+    assert resp.status_code == 200
+    etag = resp["ETag"]
+
+    # an unchanged user costs nothing but cache lookups
+    with django_assert_num_queries(0):
+        resp = client.get(url, {"apiKey": "foobar"}, HTTP_IF_NONE_MATCH=etag)
+    assert resp.status_code == 304
+    assert resp["ETag"] == etag
+
+    resp = client.get(url, {"apiKey": "foobar"}, HTTP_IF_NONE_MATCH='"something-else"')
+    assert resp.status_code == 200
+    assert resp["ETag"] == etag
+
+    # saves which don't change what the API returns keep the same version
+    with django_capture_on_commit_callbacks(execute=True):
+        user.last_login = django.utils.timezone.now()
+        user.save()
+    assert client.get(url, {"apiKey": "foobar"}, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    with django_capture_on_commit_callbacks(execute=True):
+        user.groups.add(accounts.tests.factories.GroupFactory.create())
+    resp = client.get(url, {"apiKey": "foobar"}, HTTP_IF_NONE_MATCH=etag)
+    assert resp.status_code == 200
+    assert resp["ETag"] != etag
+    assert len(resp.json()["groups"]) == 1
+
+    with django_capture_on_commit_callbacks(execute=True):
+        user.is_active = False
+        user.save()
+    assert client.get(url, {"apiKey": "foobar"}, HTTP_IF_NONE_MATCH=resp["ETag"]).status_code == 404
+
+
+@pytest.mark.django_db
+def test_conditional_get_after_rename(client, cached, django_capture_on_commit_callbacks):
+    api.models.APIKey.objects.create(key="foobar")
+    user = accounts.tests.factories.UserFactory.create()
+    old_url = django.shortcuts.reverse("api:users-detail", kwargs={"username": user.username})
+    etag = client.get(old_url, {"apiKey": "foobar"})["ETag"]
+
+    with django_capture_on_commit_callbacks(execute=True):
+        user.username = "renamed"
+        user.save()
+    assert client.get(old_url, {"apiKey": "foobar"}, HTTP_IF_NONE_MATCH=etag).status_code == 404
+
+
+@pytest.mark.django_db
+def test_conditional_get_after_tos_resync(client, cached, django_capture_on_commit_callbacks):
+    api.models.APIKey.objects.create(key="foobar")
+    user = accounts.tests.factories.UserFactory.create()
+    group = accounts.tests.factories.GroupFactory.create()
+    tos = accounts.models.TermsOfService.objects.create(
+        name="ToS", tos_date="2018-01-01", tos_url="https://example.com/tos", group=group
+    )
+    url = django.shortcuts.reverse("api:users-detail", kwargs={"username": user.username})
+    etag = client.get(url, {"apiKey": "foobar"})["ETag"]
+
+    with django_capture_on_commit_callbacks(execute=True):
+        accounts.models.TermsOfServiceAcceptance.objects.create(user=user, tos=tos)
+        accounts.views._resync_tos_groups(user)
+    resp = client.get(url, {"apiKey": "foobar"}, HTTP_IF_NONE_MATCH=etag)
+    assert resp.status_code == 200
+    assert {"id": group.id, "name": group.name} in resp.json()["groups"]
+
+
+@pytest.mark.django_db
+def test_conditional_get_any(client, cached):
+    api.models.APIKey.objects.create(key="foobar")
+    user = accounts.tests.factories.UserFactory.create()
+    deleted = accounts.tests.factories.UserFactory.create(is_active=False)
+
+    url = django.shortcuts.reverse("api:users-detail", kwargs={"username": user.username})
+    assert client.get(url, {"apiKey": "foobar"}, HTTP_IF_NONE_MATCH="*").status_code == 304
+
+    for username in ["nobody", deleted.username]:
+        url = django.shortcuts.reverse("api:users-detail", kwargs={"username": username})
+        assert client.get(url, {"apiKey": "foobar"}, HTTP_IF_NONE_MATCH="*").status_code == 404
+        assert django.core.cache.cache.get(api.models.user_version_key(username)) is None
+
+
+@pytest.mark.django_db
+def test_conditional_get_after_group_changes(client, cached, django_capture_on_commit_callbacks):
+    api.models.APIKey.objects.create(key="foobar")
+    user = accounts.tests.factories.UserFactory.create()
+    group = accounts.tests.factories.GroupFactory.create()
+    user.groups.add(group)
+    url = django.shortcuts.reverse("api:users-detail", kwargs={"username": user.username})
+    etag = client.get(url, {"apiKey": "foobar"})["ETag"]
+
+    with django_capture_on_commit_callbacks(execute=True):
+        group.internal_only = not group.internal_only
+        group.save()
+    assert client.get(url, {"apiKey": "foobar"}, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    with django_capture_on_commit_callbacks(execute=True):
+        group.name = "Renamed"
+        group.save()
+    resp = client.get(url, {"apiKey": "foobar"}, HTTP_IF_NONE_MATCH=etag)
+    assert resp.status_code == 200
+    assert {"id": group.id, "name": "Renamed"} in resp.json()["groups"]
+
+    with django_capture_on_commit_callbacks(execute=True):
+        group.delete()
+    resp = client.get(url, {"apiKey": "foobar"}, HTTP_IF_NONE_MATCH=resp["ETag"])
+    assert resp.status_code == 200
+    assert "Renamed" not in [group["name"] for group in resp.json()["groups"]]
+
+
+@pytest.mark.django_db
+def test_conditional_get_after_delete(client, cached, django_capture_on_commit_callbacks):
+    api.models.APIKey.objects.create(key="foobar")
+    user = accounts.tests.factories.UserFactory.create()
+    client.get(django.shortcuts.reverse("api:users-detail", kwargs={"username": user.username}), {"apiKey": "foobar"})
+    assert django.core.cache.cache.get(api.models.user_version_key(user.username)) is not None
+
+    with django_capture_on_commit_callbacks(execute=True):
+        user.delete()
+    assert django.core.cache.cache.get(api.models.user_version_key(user.username)) is None
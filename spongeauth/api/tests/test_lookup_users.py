@@ -0,0 +1,69 @@
+import django.shortcuts
+
+import pytest
+
+import accounts.tests.factories
+import api.models
+
+
+@pytest.fixture
+def lookup(client):
+    api.models.APIKey.objects.create(key="foobar")
+
+    def _lookup(method="get", **params):
+        if method == "get":
+            return client.get(django.shortcuts.reverse("api:users-lookup"), dict(params, apiKey="foobar"))
+        return client.post(django.shortcuts.reverse("api:users-lookup"), dict(params, **{"api-key": "foobar"}))
+
+    return _lookup
+
+
+@pytest.mark.django_db
+def test_invalid_api_key(client):
+    resp = client.get(django.shortcuts.reverse("api:users-lookup"), {"apiKey": "foobar"})
+    assert resp.status_code == 403
+
+
+@pytest.mark.django_db
+def test_looks_up_users(lookup, django_assert_num_queries):
+    group = accounts.tests.factories.GroupFactory.create()
+    users = accounts.tests.factories.UserFactory.create_batch(4)
+    users[0].groups.add(group)
+    deleted = accounts.tests.factories.UserFactory.create(is_active=False)
+
+    # one query for the key, one for the users and one for their groups
+    with django_assert_num_queries(3):
+        resp = lookup(
+            username=[users[1].username, "nobody", users[0].username, deleted.username],
+            id=[users[2].id, users[0].id, 0],
+            email=[users[3].email, "nobody@example.com"],
+        )
+    assert resp.status_code == 200
+    data = resp.json()
+    assert [user["id"] for user in data["users"]] == [users[1].id, users[0].id, users[2].id, users[3].id]
+    assert data["users"][1]["groups"] == [{"id": group.id, "name": group.name}]
+    assert "avatar_url" in data["users"][0]
+    assert data["missing"] == {
+        "username": ["nobody", deleted.username],
+        "id": [0],
+        "email": ["nobody@example.com"],
+    }
+
+
+@pytest.mark.django_db
+def test_looks_up_by_post(lookup):
+    user = accounts.tests.factories.UserFactory.create()
+
+    resp = lookup(method="post", username=[user.username])
+    assert resp.status_code == 200
+    assert [found["username"] for found in resp.json()["users"]] == [user.username]
+
+
+@pytest.mark.django_db
+def test_bad_requests(lookup, settings):
+    assert lookup(id=["one"]).status_code == 400
+
+    settings.API_LOOKUP_MAX_USERS = 2
+    resp = lookup(username=["a", "b"], email=["c@example.com"])
+    assert resp.status_code == 400
+    assert resp.json() == {"error": ["At most 2 users can be looked up at once"]}
@@ -1,4 +1,11 @@
-from .. import models
+import hashlib
+
+import django.core.cache
+
+from asgiref.sync import async_to_sync
+import pytest
+
+from .. import admin, models
 
 
 def test_str():
@@ -10,3 +17,86 @@ def test_str():
 
     apikey = models.APIKey(description="")
     assert str(apikey) == "<unnamed API key>"
+
+
+def test_stores_only_a_hash():
+    apikey = models.APIKey(description="", key="foobar")
+    assert apikey.key is None
+    assert apikey.key_hash == hashlib.sha256(b"foobar").hexdigest()
+
+
+@pytest.fixture
+def cached(settings):
+    settings.API_KEY_CACHE_TTL = 60
+    models.clear_key_cache()
+    django.core.cache.cache.clear()
+    yield
+    models.clear_key_cache()
+
+
+@pytest.mark.django_db
+def test_authenticate_caches_keys(cached, django_assert_num_queries):
+    apikey = models.APIKey.objects.create(key="foobar")
+
+    with django_assert_num_queries(1):
+        assert models.APIKey.objects.authenticate("foobar", now=0) == apikey
+        assert models.APIKey.objects.authenticate("foobar", now=59) == apikey
+    with django_assert_num_queries(1):
+        assert models.APIKey.objects.authenticate("foobar", now=60) == apikey
+    with django_assert_num_queries(2):
+        # unknown keys aren't cached
+        assert models.APIKey.objects.authenticate("nope", now=60) is None
+        assert models.APIKey.objects.authenticate("nope", now=60) is None
+
+
+@pytest.mark.django_db
+def test_authenticate_forgets_changed_keys(cached):
+    apikey = models.APIKey.objects.create(key="foobar")
+    assert async_to_sync(models.APIKey.objects.aauthenticate)("foobar") == apikey
+
+    apikey.key = "bazqux"
+    apikey.save()
+    assert models.APIKey.objects.authenticate("foobar") is None
+    assert models.APIKey.objects.authenticate("bazqux") == apikey
+
+    apikey.delete()
+    assert models.APIKey.objects.authenticate("bazqux") is None
+
+
+@pytest.mark.django_db
+def test_authenticate_forgets_keys_changed_elsewhere(
+    cached, django_assert_num_queries, django_capture_on_commit_callbacks
+):
+    apikey = models.APIKey.objects.create(key="foobar")
+    assert models.APIKey.objects.authenticate("foobar", now=0) == apikey
+
+    # as if another process revoked it: this process's copy isn't cleared
+    models.APIKey.objects.filter(pk=apikey.pk).update(key_hash=models.hash_key("bazqux"))
+    models.bump_key_generation()
+    with django_assert_num_queries(1):
+        assert models.APIKey.objects.authenticate("foobar", now=1) is None
+
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        apikey.delete()
+    assert callbacks
+    assert django.core.cache.cache.get(models.KEY_GENERATION) == 2
+
+
+@pytest.mark.django_db
+def test_admin_form():
+    form = admin.APIKeyForm(data={"description": "bot", "key": ""})
+    assert not form.is_valid()
+
+    form = admin.APIKeyForm(data={"description": "bot", "key": "foobar"})
+    assert form.is_valid()
+    apikey = form.save()
+    assert models.APIKey.objects.authenticate("foobar") == apikey
+
+    form = admin.APIKeyForm(data={"description": "other bot", "key": "foobar"})
+    assert not form.is_valid()
+
+    # leaving the key blank keeps it
+    form = admin.APIKeyForm(data={"description": "renamed", "key": ""}, instance=apikey)
+    assert form.is_valid()
+    form.save()
+    assert models.APIKey.objects.authenticate("foobar").description == "renamed"
@@ -6,6 +6,10 @@ app_name = "api"
 
 urlpatterns = [
     re_path(r"^users$", api.views.list_users, name="users-list"),
+    re_path(r"^changes$", api.views.changes, name="changes"),
+    re_path(r"^lookup$", api.views.lookup_users, name="users-lookup"),
+    re_path(r"^export$", api.views.export_users, name="users-export"),
+    re_path(r"^batch$", api.views.batch_create_users, name="users-batch"),
     re_path(r"^users/(?P<username>[^/]+)$", api.views.user_detail, name="users-detail"),
     re_path(
         r"^users/(?P<for_username>[^/]+)/change-avatar-token/$",
@@ -1,25 +1,58 @@
+import base64
+import collections
+import datetime
 import functools
 import http
+import json
+import uuid
 
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.cache import cache
 from django.shortcuts import get_object_or_404, reverse
 import django.core.exceptions
 import django.http
 import django.views.decorators.csrf
+from django.db import transaction
+from django.db.models import Q, prefetch_related_objects
 from django.utils import timezone
+from django.utils.http import parse_etags
 from django.core.exceptions import ValidationError
 
+from asgiref.sync import iscoroutinefunction, sync_to_async
+
+from accounts import letter_avatar
 from accounts.views import change_other_avatar_key as base_change_other_avatar_key
 
+import accounts.hashers
 import accounts.models
+import accounts.signals
 import api.models
 
 
+def _get_api_key(request):
+    return request.POST.get("api-key", request.GET.get("apiKey", None))
+
+
 def _require_api_key(fn):
+    if iscoroutinefunction(fn):
+
+        @functools.wraps(fn)
+        async def _async_wrap(request, *args, **kwargs):
+            api_key = _get_api_key(request)
+            request.api_key = await api.models.APIKey.objects.aauthenticate(api_key) if api_key else None
+            if not request.api_key:
+                raise django.core.exceptions.PermissionDenied("No such API key")
+
+            return await fn(request, *args, **kwargs)
+
+        return _async_wrap
+
     @functools.wraps(fn)
     def _wrap(request, *args, **kwargs):
-        api_key = None
-        api_key = request.POST.get("api-key", request.GET.get("apiKey", None))
-        if not api_key or not api.models.APIKey.objects.filter(key=api_key).exists():
+        api_key = _get_api_key(request)
+        request.api_key = api.models.APIKey.objects.authenticate(api_key) if api_key else None
+        if not request.api_key:
             raise django.core.exceptions.PermissionDenied("No such API key")
 
         return fn(request, *args, **kwargs)
@@ -100,16 +133,353 @@ def _delete_user(request):
 
 
 @_require_api_key
-def user_detail(request, username):
+async def user_detail(request, username):
     handlers = {"GET": _user_detail}
-    handler = handlers.get(request.method, _four_oh_five(handlers.keys()))
-    return handler(request, username)
+    handler = handlers.get(request.method)
+    if handler is None:
+        return _four_oh_five(handlers.keys())(request, username)
+    return await handler(request, username)
 
 
-def _user_detail(request, username):
-    qs = accounts.models.User.objects.all().prefetch_related("groups")
-    user = get_object_or_404(qs, is_active=True, username=username)
-    return django.http.JsonResponse(_encode_user(request, user), status=http.HTTPStatus.OK)
+def _etag(version):
+    return '"{}"'.format(version)
+
+
+async def _new_user_version(version_key):
+    version = uuid.uuid4().hex
+    if not await cache.aadd(version_key, version, timeout=settings.API_USER_VERSION_TTL):
+        version = await cache.aget(version_key) or version
+    return version
+
+
+def _not_modified(version):
+    resp = django.http.HttpResponseNotModified()
+    resp["ETag"] = _etag(version)
+    return resp
+
+
+async def _user_detail(request, username):
+    # Any change to what's returned for the user forgets their version, so
+    # one which is still cached means the client's copy is current.
+    version_key = api.models.user_version_key(username)
+    etags = parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+    version = await cache.aget(version_key)
+    if version is not None and _etag(version) in etags:
+        return _not_modified(version)
+    # The version is settled before the user is fetched, so a change made in
+    # between forgets it rather than being hidden behind it.
+    if version is None:
+        version = await _new_user_version(version_key)
+
+    # everything _encode_user needs is fetched up front, as it can't touch the
+    # database from async code.
+    qs = accounts.models.User.objects.select_related("current_avatar__user").prefetch_related("groups")
+    try:
+        user = await qs.aget(is_active=True, username=username)
+    except accounts.models.User.DoesNotExist:
+        # don't keep versions for usernames nobody has
+        await cache.adelete(version_key)
+        raise django.http.Http404("No such user")
+    if "*" in etags:
+        return _not_modified(version)
+    resp = django.http.JsonResponse(_encode_user(request, user), status=http.HTTPStatus.OK)
+    resp["ETag"] = _etag(version)
+    return resp
+
+
+def _reject_taken(users, errors):
+    # Moves rows whose username or email is already taken, by an existing user
+    # or an earlier row, from users to errors. Returns whether any were.
+    taken = list(
+        accounts.models.User.objects.filter(
+            Q(username__in=[user.username for user in users.values()])
+            | Q(email__in=[user.email for user in users.values()])
+        ).values_list("username", "email")
+    )
+    taken_usernames = {username for username, _ in taken}
+    taken_emails = {email for _, email in taken}
+    rejected = False
+    for index, user in list(users.items()):
+        messages = []
+        for field, taken_values in [("username", taken_usernames), ("email", taken_emails)]:
+            if getattr(user, field) in taken_values:
+                messages.extend(user.unique_error_message(accounts.models.User, [field]).messages)
+        if messages:
+            errors[index] = messages
+            del users[index]
+            rejected = True
+        else:
+            taken_usernames.add(user.username)
+            taken_emails.add(user.email)
+    return rejected
+
+
+@_require_api_key
+@django.views.decorators.csrf.csrf_exempt
+def batch_create_users(request):
+    if request.method != "POST":
+        return _four_oh_five(["POST"])(request)
+    try:
+        rows = json.loads(request.body)["users"]
+    except (ValueError, KeyError, TypeError):
+        rows = None
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        return django.http.JsonResponse(
+            {"error": ['Expected a JSON object with a list of "users"']}, status=http.HTTPStatus.BAD_REQUEST
+        )
+    if len(rows) > settings.API_BATCH_CREATE_MAX_USERS:
+        return django.http.JsonResponse(
+            {"error": ["At most {} users can be created at once".format(settings.API_BATCH_CREATE_MAX_USERS)]},
+            status=http.HTTPStatus.BAD_REQUEST,
+        )
+
+    # Every row is validated before any password is hashed, with one query
+    # for usernames and emails already taken rather than two per row.
+    errors = {}
+    users = {}
+    for index, row in enumerate(rows):
+        user = accounts.models.User(
+            username=row.get("username"), email=row.get("email"), email_verified=row.get("verified") is True
+        )
+        try:
+            user.full_clean(exclude=["password"], validate_unique=False)
+        except ValidationError as exc:
+            errors[index] = exc.messages
+        else:
+            users[index] = user
+    _reject_taken(users, errors)
+
+    passwords = accounts.hashers.hash_passwords(rows[index].get("password") for index in users)
+    for user, password in zip(users.values(), passwords):
+        user.password = password
+
+    while True:
+        dummies = [user for index, user in users.items() if rows[index].get("dummy") is True]
+        try:
+            with transaction.atomic():
+                accounts.models.User.objects.bulk_create(users.values())
+                accounts.signals.users_created.send(sender=accounts.models.User, users=list(users.values()))
+                if dummies:
+                    accounts.models.Group.objects.get(name="Dummy").user_set.add(*dummies)
+            break
+        except django.db.IntegrityError as exc:
+            # Someone else took a username or email since they were checked:
+            # reject the rows which now clash and insert the rest.
+            if not _reject_taken(users, errors):
+                return django.http.JsonResponse({"error": [str(exc)]}, status=http.HTTPStatus.UNPROCESSABLE_ENTITY)
+    prefetch_related_objects(list(users.values()), "groups")
+
+    # Each row gets the status and body creating it alone would have.
+    results = []
+    for index in range(len(rows)):
+        if index in users:
+            results.append({"status": http.HTTPStatus.CREATED, "user": _encode_user(request, users[index])})
+        else:
+            results.append({"status": http.HTTPStatus.UNPROCESSABLE_ENTITY, "error": errors[index]})
+    return django.http.JsonResponse({"results": results}, status=http.HTTPStatus.OK)
+
+
+@_require_api_key
+@django.views.decorators.csrf.csrf_exempt
+def lookup_users(request):
+    # POST is accepted too, for lists too long for a query string.
+    if request.method not in ("GET", "POST"):
+        return _four_oh_five(["GET", "POST"])(request)
+    params = request.POST if request.method == "POST" else request.GET
+    usernames = list(dict.fromkeys(params.getlist("username")))
+    emails = list(dict.fromkeys(params.getlist("email")))
+    try:
+        ids = list(dict.fromkeys(int(user_id) for user_id in params.getlist("id")))
+    except ValueError:
+        return django.http.JsonResponse({"error": ["Invalid id"]}, status=http.HTTPStatus.BAD_REQUEST)
+    if len(usernames) + len(ids) + len(emails) > settings.API_LOOKUP_MAX_USERS:
+        return django.http.JsonResponse(
+            {"error": ["At most {} users can be looked up at once".format(settings.API_LOOKUP_MAX_USERS)]},
+            status=http.HTTPStatus.BAD_REQUEST,
+        )
+
+    users = list(
+        accounts.models.User.objects.filter(
+            Q(username__in=usernames) | Q(pk__in=ids) | Q(email__in=emails), is_active=True
+        )
+        .select_related("current_avatar__user")
+        .prefetch_related("groups")
+    )
+    by_username = {user.username: user for user in users}
+    by_id = {user.pk: user for user in users}
+    by_email = {user.email: user for user in users}
+
+    # users come back in the order they were asked for, each once
+    found = {}
+    for lookup, keys in [(by_username, usernames), (by_id, ids), (by_email, emails)]:
+        for key in keys:
+            user = lookup.get(key)
+            if user is not None:
+                found.setdefault(user.pk, user)
+    return django.http.JsonResponse(
+        {
+            "users": [_encode_user(request, user) for user in found.values()],
+            "missing": {
+                "username": [username for username in usernames if username not in by_username],
+                "id": [user_id for user_id in ids if user_id not in by_id],
+                "email": [email for email in emails if email not in by_email],
+            },
+        },
+        status=http.HTTPStatus.OK,
+    )
+
+
+def _encode_cursor(position, kind="v1"):
+    return base64.urlsafe_b64encode("{}:{}".format(kind, position).encode("ascii")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor, kind="v1"):
+    if not cursor:
+        return 0
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("ascii")
+        version, _, position = raw.partition(":")
+        if version != kind:
+            return None
+        return int(position)
+    except ValueError:
+        return None
+
+
+@_require_api_key
+async def changes(request):
+    if request.method != "GET":
+        return _four_oh_five(["GET"])(request)
+
+    after = _decode_cursor(request.GET.get("cursor", ""))
+    try:
+        limit = int(request.GET.get("limit", settings.API_CHANGES_PAGE_SIZE))
+    except ValueError:
+        limit = None
+    if after is None or limit is None:
+        return django.http.JsonResponse({"error": ["Invalid cursor or limit"]}, status=http.HTTPStatus.BAD_REQUEST)
+    limit = max(1, min(limit, settings.API_CHANGES_MAX_PAGE_SIZE))
+
+    # Ids are handed out when a change is made, not when it commits, so one
+    # from a slow transaction can appear behind a cursor already past it. Only
+    # changes older than the settle window are served; any committing later
+    # than that can still be missed.
+    settled = timezone.now() - datetime.timedelta(seconds=settings.API_CHANGES_SETTLE)
+    page = api.models.UserChange.objects.filter(id__gt=after, created_at__lte=settled).order_by("id")
+    page = [change async for change in page.values_list("id", "user_id", "kind")[:limit]]
+
+    # Each user appears once, at their latest change, with their current
+    # details: consumers never need to fetch users one at a time.
+    latest = {}
+    for change_id, user_id, kind in page:
+        latest.pop(user_id, None)
+        latest[user_id] = kind
+    qs = accounts.models.User.objects.select_related("current_avatar__user").prefetch_related("groups")
+    users = await qs.ain_bulk(latest)
+
+    lines = []
+    for user_id, kind in latest.items():
+        user = users.get(user_id)
+        if user is None or not user.is_active:
+            kind = api.models.UserChange.DELETED
+        encoded = _encode_user(request, user) if user is not None else {"id": user_id}
+        encoded["change"] = kind
+        lines.append(encoded)
+    lines.append({"cursor": _encode_cursor(page[-1][0] if page else after), "more": len(page) == limit})
+    return django.http.HttpResponse(
+        "".join(json.dumps(line) + "\n" for line in lines), content_type="application/x-ndjson"
+    )
+
+
+EXPORT_CURSOR = "users-v1"
+
+
+def _export_avatar_url(request, username, source, remote_url, image_file):
+    # Avatar.get_absolute_url, from the joined columns rather than a model.
+    url = remote_url
+    if source == accounts.models.Avatar.UPLOAD and image_file:
+        url = accounts.models.Avatar._meta.get_field("image_file").storage.url(image_file)
+    return request.build_absolute_uri(url or letter_avatar.LetterAvatar(username).get_absolute_url())
+
+
+def _export_batch(request, after, limit):
+    # Two queries per batch however many users are in it, and only tuples are
+    # built: the users, with their current avatar joined, then their groups.
+    # A cursor line ends each batch, so an interrupted export can resume.
+    wanted = settings.API_EXPORT_BATCH_SIZE if limit is None else min(settings.API_EXPORT_BATCH_SIZE, limit)
+    users = list(
+        accounts.models.User.objects.filter(is_active=True, id__gt=after)
+        .order_by("id")
+        .values_list(
+            "id",
+            "username",
+            "email",
+            "current_avatar__source",
+            "current_avatar__remote_url",
+            "current_avatar__image_file",
+        )[:wanted]
+    )
+    groups = collections.defaultdict(list)
+    if users:
+        memberships = (
+            accounts.models.User.groups.through.objects.filter(user_id__in=[user[0] for user in users])
+            .order_by("group_id")
+            .values_list("user_id", "group_id", "group__name")
+        )
+        for user_id, group_id, name in memberships:
+            groups[user_id].append({"id": group_id, "name": name})
+
+    lines = []
+    for user_id, username, email, source, remote_url, image_file in users:
+        user = {
+            "id": user_id,
+            "username": username,
+            "email": email,
+            "avatar_url": _export_avatar_url(request, username, source, remote_url, image_file),
+            "groups": groups[user_id],
+        }
+        lines.append(json.dumps(user) + "\n")
+
+    if users:
+        after = users[-1][0]
+    if limit is not None:
+        limit -= len(users)
+    more = len(users) == wanted
+    lines.append(json.dumps({"cursor": _encode_cursor(after, EXPORT_CURSOR), "more": more}) + "\n")
+    return "".join(lines), after, limit, more and limit != 0
+
+
+def _export_stream(request, after, limit):
+    more = True
+    while more:
+        lines, after, limit, more = _export_batch(request, after, limit)
+        yield lines
+
+
+async def _aexport_stream(request, after, limit):
+    # Under ASGI a synchronous iterator would be read into memory whole before
+    # sending, so each batch is fetched in a thread instead.
+    more = True
+    while more:
+        lines, after, limit, more = await sync_to_async(_export_batch)(request, after, limit)
+        yield lines
+
+
+@_require_api_key
+def export_users(request):
+    if request.method != "GET":
+        return _four_oh_five(["GET"])(request)
+
+    after = _decode_cursor(request.GET.get("cursor", ""), EXPORT_CURSOR)
+    try:
+        limit = int(request.GET["limit"]) if "limit" in request.GET else None
+    except ValueError:
+        limit = 0
+    if after is None or (limit is not None and limit < 1):
+        return django.http.JsonResponse({"error": ["Invalid cursor or limit"]}, status=http.HTTPStatus.BAD_REQUEST)
+
+    stream = _aexport_stream if isinstance(request, ASGIRequest) else _export_stream
+    return django.http.StreamingHttpResponse(stream(request, after, limit), content_type="application/x-ndjson")
 
 
 change_other_avatar_key = _require_api_key(base_change_other_avatar_key)
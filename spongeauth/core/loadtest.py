@@ -0,0 +1,59 @@
+import collections
+import concurrent.futures
+import math
+import threading
+import time
+
+import requests
+
+
+Result = collections.namedtuple("Result", ["url", "latencies", "errors", "elapsed"])
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def _fetch(session, url, timeout):
+    started = time.monotonic()
+    try:
+        resp = session.get(url, timeout=timeout, allow_redirects=False)
+        ok = resp.status_code < 500
+    except requests.RequestException:
+        ok = False
+    return ok, time.monotonic() - started
+
+
+def run(url, total=1000, concurrency=16, timeout=10):
+    # one session per worker thread, so connections are reused like a real
+    # client (or nginx) would
+    sessions = collections.defaultdict(requests.Session)
+
+    def _worker(_):
+        return _fetch(sessions[threading.get_ident()], url, timeout)
+
+    started = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(_worker, range(total)))
+    elapsed = time.monotonic() - started
+
+    for session in sessions.values():
+        session.close()
+    latencies = [latency for ok, latency in outcomes if ok]
+    return Result(url, latencies, len(outcomes) - len(latencies), elapsed)
+
+
+def format_result(result):
+    completed = len(result.latencies)
+    rate = completed / result.elapsed if result.elapsed else float(completed)
+    return "{}: {} ok, {} errors, {:.1f} req/s, p50 {:.1f}ms, p99 {:.1f}ms".format(
+        result.url,
+        completed,
+        result.errors,
+        rate,
+        percentile(result.latencies, 50) * 1000,
+        percentile(result.latencies, 99) * 1000,
+    )
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import retention
+
+
+class Command(BaseCommand):
+    help = "Delete expired sessions, used backup codes, removed 2FA devices and unused avatars"
+
+    def add_arguments(self, parser):
+        parser.add_argument("policy", nargs="*", type=str)
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--sleep", type=float, default=None, help="Seconds to sleep between batches")
+        parser.add_argument("--dry-run", action="store_true", help="Count stale rows without deleting them")
+        parser.add_argument(
+            "--schedule", action="store_true", help="Schedule the recurring cleanup job instead of running now"
+        )
+
+    def handle(self, *args, **options):
+        if options["schedule"]:
+            job = retention.schedule()
+            if job is None:
+                self.stdout.write("Cleanup job already scheduled")
+            else:
+                self.stdout.write(self.style.SUCCESS("Scheduled cleanup job {}".format(job.id)))
+            return
+
+        known = {policy.name for policy in retention.POLICIES}
+        unknown = set(options["policy"]) - known
+        if unknown:
+            raise CommandError('Unknown policy: "{}"'.format('", "'.join(sorted(unknown))))
+
+        results = retention.purge_all(
+            policy_names=options["policy"],
+            batch_size=options["batch_size"],
+            sleep=options["sleep"],
+            dry_run=options["dry_run"],
+        )
+        for result in results:
+            self.stdout.write(retention.format_result(result))
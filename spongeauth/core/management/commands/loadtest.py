@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure requests/sec and latency percentiles for one or more URLs, "
+        "e.g. the same view served by the WSGI and the ASGI deployments"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("url", nargs="+", type=str)
+        parser.add_argument("--requests", type=int, default=1000, help="Requests to send to each URL")
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--timeout", type=float, default=10)
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1 or options["concurrency"] < 1:
+            raise CommandError("--requests and --concurrency must be positive")
+
+        for url in options["url"]:
+            result = loadtest.run(
+                url, total=options["requests"], concurrency=options["concurrency"], timeout=options["timeout"]
+            )
+            self.stdout.write(loadtest.format_result(result))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core import metrics
+
+
+class Command(BaseCommand):
+    help = "Print the counters recorded by core.metrics"
+
+    def add_arguments(self, parser):
+        parser.add_argument("prefix", nargs="?", type=str, default="")
+
+    def handle(self, *args, **options):
+        for name, value in metrics.get_all(options["prefix"]).items():
+            self.stdout.write("{} {}".format(name, value))
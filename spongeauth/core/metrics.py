@@ -0,0 +1,23 @@
+import logging
+
+import redis.exceptions
+
+import core.utils
+
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = "spongeauth:metrics"
+
+
+def incr(name, amount=1):
+    try:
+        core.utils.redis_connection().hincrby(METRICS_KEY, name, amount)
+    except redis.exceptions.RedisError:
+        logger.warning("Failed to record metric %s", name, exc_info=True)
+
+
+def get_all(prefix=""):
+    counters = core.utils.redis_connection().hgetall(METRICS_KEY)
+    counters = {k.decode("utf8"): int(v) for k, v in counters.items()}
+    return {k: v for k, v in sorted(counters.items()) if k.startswith(prefix)}
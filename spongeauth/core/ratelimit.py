@@ -0,0 +1,84 @@
+import hashlib
+import http
+import logging
+import math
+import time
+
+from django.conf import settings
+import django.http
+
+import redis.exceptions
+
+import core.utils
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+def _bucket_key(bucket_name, key):
+    # keys may contain user-controlled input, so hash them to keep the Redis
+    # keyspace tidy and bounded in length.
+    digest = hashlib.sha256(str(key).encode("utf8")).hexdigest()
+    return "spongeauth:ratelimit:{}:{}".format(bucket_name, digest)
+
+
+def _take(conn, bucket_key, capacity, rate, now):
+    result = {}
+
+    def _txn(pipe):
+        tokens, updated_at = pipe.hmget(bucket_key, "tokens", "updated_at")
+        if tokens is None or updated_at is None:
+            tokens = capacity
+        else:
+            tokens = min(capacity, float(tokens) + max(0.0, now - float(updated_at)) * rate)
+        result["allowed"] = tokens >= 1
+        if result["allowed"]:
+            tokens -= 1
+        result["retry_after"] = 0 if result["allowed"] else math.ceil((1 - tokens) / rate)
+
+        pipe.multi()
+        pipe.hset(bucket_key, mapping={"tokens": tokens, "updated_at": now})
+        # once the bucket would have refilled completely it's equivalent to a
+        # missing bucket, so let it expire.
+        pipe.expire(bucket_key, math.ceil(capacity / rate) + 1)
+
+    conn.transaction(_txn, bucket_key)
+    return result["allowed"], result["retry_after"]
+
+
+def consume(bucket_name, key, now=None):
+    if not settings.RATELIMIT_ENABLED:
+        return True, 0
+    bucket = settings.RATELIMIT_BUCKETS[bucket_name]
+    now = time.time() if now is None else now
+    try:
+        return _take(
+            core.utils.redis_connection(), _bucket_key(bucket_name, key), bucket["capacity"], bucket["rate"], now
+        )
+    except redis.exceptions.RedisError:
+        # Fail open: being unable to rate limit shouldn't stop people logging in.
+        logger.warning("Rate limiter unavailable, allowing request", exc_info=True)
+        return True, 0
+
+
+def throttled_response(retry_after):
+    resp = django.http.HttpResponse(
+        "Too many attempts. Please try again later.",
+        status=http.HTTPStatus.TOO_MANY_REQUESTS,
+        content_type="text/plain",
+    )
+    resp["Retry-After"] = str(retry_after)
+    return resp
+
+
+def check(*limits):
+    # Call this before doing any expensive work, such as hashing a password:
+    # rejected requests should cost as little as possible.
+    for bucket_name, key in limits:
+        allowed, retry_after = consume(bucket_name, key)
+        if not allowed:
+            logger.info("Throttled request in bucket %s", bucket_name)
+            metrics.incr("ratelimit.throttled.{}".format(bucket_name))
+            return throttled_response(retry_after)
+    return None
@@ -0,0 +1,160 @@
+import collections
+import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+import django_rq
+
+from user_sessions.models import Session
+
+import accounts.models
+import api.models
+import twofa.models
+
+
+logger = logging.getLogger(__name__)
+
+JOB_FUNC_NAME = "core.retention.run_retention_job"
+
+# file_field names a FileField whose files are deleted along with the rows.
+Policy = collections.namedtuple("Policy", ["name", "model", "stale_filter", "file_field"], defaults=[None])
+Result = collections.namedtuple("Result", ["name", "deleted", "elapsed"])
+
+
+def _expired_sessions(cutoff):
+    return Q(expire_date__lt=cutoff)
+
+
+def _used_paper_codes(cutoff):
+    return Q(used_at__lt=cutoff)
+
+
+def _deleted_devices(cutoff):
+    return Q(deleted_at__lt=cutoff)
+
+
+def _old_user_changes(cutoff):
+    return Q(created_at__lt=cutoff)
+
+
+def _unreferenced_avatars(cutoff):
+    referenced = accounts.models.User.objects.filter(current_avatar__isnull=False).values("current_avatar")
+    return Q(added_at__lt=cutoff) & ~Q(pk__in=referenced)
+
+
+POLICIES = [
+    Policy("sessions", Session, _expired_sessions),
+    Policy("paper_codes", twofa.models.PaperCode, _used_paper_codes),
+    Policy("devices", twofa.models.Device, _deleted_devices),
+    Policy("avatars", accounts.models.Avatar, _unreferenced_avatars, file_field="image_file"),
+    Policy("user_changes", api.models.UserChange, _old_user_changes),
+]
+
+
+def _rate(result):
+    if not result.elapsed:
+        return float(result.deleted)
+    return result.deleted / result.elapsed
+
+
+def format_result(result):
+    return "{}: deleted {} rows in {:.2f}s ({:.1f} rows/s)".format(
+        result.name, result.deleted, result.elapsed, _rate(result)
+    )
+
+
+def _delete_files(storage, names):
+    for name in names:
+        try:
+            storage.delete(name)
+        except OSError:
+            logger.warning("Couldn't delete %s", name, exc_info=True)
+
+
+def _delete_batch(policy, rows):
+    if policy.file_field is None:
+        _, per_model = rows.delete()
+        return per_model.get(policy.model._meta.label, 0)
+
+    # The rows are locked while their files are collected, so the files are
+    # exactly those of the rows deleted. The files go only once that commits.
+    with transaction.atomic():
+        names = [name for name in rows.select_for_update().values_list(policy.file_field, flat=True) if name]
+        _, per_model = rows.delete()
+        storage = policy.model._meta.get_field(policy.file_field).storage
+        transaction.on_commit(lambda: _delete_files(storage, names))
+    return per_model.get(policy.model._meta.label, 0)
+
+
+def purge(policy, now=None, batch_size=None, sleep=None, dry_run=False):
+    now = now or timezone.now()
+    batch_size = batch_size or settings.RETENTION_BATCH_SIZE
+    sleep = settings.RETENTION_BATCH_SLEEP if sleep is None else sleep
+    max_age = settings.RETENTION_MAX_AGE_DAYS[policy.name]
+
+    # Re-evaluate the stale filter when deleting each batch, so rows which
+    # became live again since they were selected (e.g. an avatar which was
+    # just re-selected) are left alone.
+    stale = policy.model.objects.filter(policy.stale_filter(now - datetime.timedelta(days=max_age)))
+    pk_name = policy.model._meta.pk.name
+
+    started = time.monotonic()
+    deleted = 0
+    last_pk = None
+    while True:
+        batch = stale.order_by(pk_name)
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        pks = list(batch.values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            break
+        last_pk = pks[-1]
+
+        if dry_run:
+            deleted += len(pks)
+        else:
+            deleted += _delete_batch(policy, stale.filter(pk__in=pks))
+
+        if len(pks) < batch_size:
+            break
+        if sleep:
+            time.sleep(sleep)
+
+    return Result(policy.name, deleted, time.monotonic() - started)
+
+
+def purge_all(policy_names=None, **kwargs):
+    results = []
+    for policy in POLICIES:
+        if policy_names and policy.name not in policy_names:
+            continue
+        result = purge(policy, **kwargs)
+        logger.info(format_result(result))
+        results.append(result)
+    return results
+
+
+def _is_scheduled(queue):
+    job_ids = queue.scheduled_job_registry.get_job_ids()
+    jobs = queue.job_class.fetch_many(job_ids, connection=queue.connection)
+    return any(job is not None and job.func_name == JOB_FUNC_NAME for job in jobs)
+
+
+def schedule(queue=None):
+    queue = queue or django_rq.get_queue("default")
+    if _is_scheduled(queue):
+        return None
+    return queue.enqueue_in(datetime.timedelta(seconds=settings.RETENTION_INTERVAL), run_retention_job)
+
+
+@django_rq.job
+def run_retention_job():
+    try:
+        purge_all()
+    finally:
+        schedule()
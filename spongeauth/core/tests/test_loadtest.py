@@ -0,0 +1,42 @@
+import io
+import unittest.mock
+
+from django.core.management import call_command
+
+import requests
+
+from .. import loadtest
+
+
+def test_percentile():
+    values = [n / 100 for n in range(1, 101)]
+    assert loadtest.percentile(values, 50) == 0.5
+    assert loadtest.percentile(values, 99) == 0.99
+    assert loadtest.percentile([0.3], 99) == 0.3
+    assert loadtest.percentile([], 99) == 0.0
+
+
+@unittest.mock.patch.object(requests.Session, "get")
+def test_run_counts_errors(mock_get):
+    ok = unittest.mock.Mock(status_code=200)
+    server_error = unittest.mock.Mock(status_code=502)
+    mock_get.side_effect = [ok, server_error, requests.ConnectionError("down"), ok]
+
+    result = loadtest.run("http://example.com/", total=4, concurrency=1)
+
+    assert len(result.latencies) == 2
+    assert result.errors == 2
+    assert "http://example.com/: 2 ok, 2 errors" in loadtest.format_result(result)
+
+
+@unittest.mock.patch.object(requests.Session, "get")
+def test_command_runs_each_url(mock_get):
+    mock_get.return_value = unittest.mock.Mock(status_code=200)
+    out = io.StringIO()
+
+    call_command("loadtest", "http://wsgi/", "http://asgi/", "--requests=5", "--concurrency=2", stdout=out)
+
+    lines = out.getvalue().splitlines()
+    assert lines[0].startswith("http://wsgi/: 5 ok, 0 errors")
+    assert lines[1].startswith("http://asgi/: 5 ok, 0 errors")
+    assert "req/s" in lines[0] and "p99" in lines[0]
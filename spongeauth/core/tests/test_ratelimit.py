@@ -0,0 +1,63 @@
+import unittest.mock
+
+import fakeredis
+import pytest
+import redis.exceptions
+
+from .. import metrics, ratelimit
+
+
+@pytest.fixture
+def fake_redis():
+    conn = fakeredis.FakeStrictRedis()
+    with unittest.mock.patch("core.utils.redis_connection", return_value=conn):
+        yield conn
+
+
+@pytest.fixture
+def buckets(settings):
+    settings.RATELIMIT_ENABLED = True
+    settings.RATELIMIT_BUCKETS = {"test": {"capacity": 3, "rate": 0.5}}
+
+
+def test_allows_burst_then_throttles(fake_redis, buckets):
+    for n in range(3):
+        assert ratelimit.consume("test", "key", now=1000) == (True, 0)
+    assert ratelimit.consume("test", "key", now=1000) == (False, 2)
+
+
+def test_refills_over_time(fake_redis, buckets):
+    for n in range(3):
+        ratelimit.consume("test", "key", now=1000)
+    assert not ratelimit.consume("test", "key", now=1001)[0]
+    assert ratelimit.consume("test", "key", now=1002)[0]
+    assert not ratelimit.consume("test", "key", now=1002)[0]
+
+
+def test_keys_are_independent(fake_redis, buckets):
+    for n in range(3):
+        ratelimit.consume("test", "key", now=1000)
+    assert ratelimit.consume("test", "other-key", now=1000)[0]
+
+
+def test_disabled(fake_redis, buckets, settings):
+    settings.RATELIMIT_ENABLED = False
+    for n in range(10):
+        assert ratelimit.consume("test", "key") == (True, 0)
+
+
+def test_fails_open(buckets):
+    conn = unittest.mock.MagicMock()
+    conn.transaction.side_effect = redis.exceptions.ConnectionError("boom")
+    with unittest.mock.patch("core.utils.redis_connection", return_value=conn):
+        assert ratelimit.consume("test", "key") == (True, 0)
+
+
+def test_check_returns_429_and_counts(fake_redis, buckets):
+    for n in range(3):
+        assert ratelimit.check(("test", "key")) is None
+
+    resp = ratelimit.check(("test", "key"))
+    assert resp.status_code == 429
+    assert int(resp["Retry-After"]) > 0
+    assert metrics.get_all("ratelimit.") == {"ratelimit.throttled.test": 1}
@@ -0,0 +1,160 @@
+import datetime
+import io
+
+from django.core.management import call_command, CommandError
+from django.utils import timezone
+
+import django_rq
+import pytest
+
+from user_sessions.models import Session
+
+import accounts.models
+import accounts.tests.factories
+import api.models
+import twofa.models
+from .. import retention
+
+
+def _policy(name):
+    return next(policy for policy in retention.POLICIES if policy.name == name)
+
+
+def _days_ago(days):
+    return timezone.now() - datetime.timedelta(days=days)
+
+
+@pytest.fixture
+def user():
+    return accounts.tests.factories.UserFactory.create()
+
+
+@pytest.mark.django_db
+def test_purges_expired_sessions(user):
+    Session.objects.create(session_key="expired", session_data="", expire_date=_days_ago(1), user=user)
+    Session.objects.create(session_key="live", session_data="", expire_date=_days_ago(-1), user=user)
+
+    result = retention.purge(_policy("sessions"), sleep=0)
+
+    assert result.deleted == 1
+    assert list(Session.objects.values_list("session_key", flat=True)) == ["live"]
+
+
+@pytest.mark.django_db
+def test_purges_in_batches(user, settings):
+    settings.RETENTION_BATCH_SIZE = 2
+    for n in range(5):
+        Session.objects.create(session_key="s{}".format(n), session_data="", expire_date=_days_ago(1), user=user)
+
+    result = retention.purge(_policy("sessions"), sleep=0)
+
+    assert result.deleted == 5
+    assert not Session.objects.exists()
+
+
+@pytest.mark.django_db
+def test_dry_run_deletes_nothing(user):
+    Session.objects.create(session_key="expired", session_data="", expire_date=_days_ago(1), user=user)
+
+    result = retention.purge(_policy("sessions"), sleep=0, dry_run=True)
+
+    assert result.deleted == 1
+    assert Session.objects.exists()
+
+
+@pytest.mark.django_db
+def test_purges_old_used_paper_codes(user):
+    device = twofa.models.PaperDevice.objects.create(owner=user, activated_at=timezone.now())
+    twofa.models.PaperCode.objects.create(device=device, code="aaaaaaaa", used_at=_days_ago(31))
+    recent = twofa.models.PaperCode.objects.create(device=device, code="bbbbbbbb", used_at=_days_ago(1))
+    unused = twofa.models.PaperCode.objects.create(device=device, code="cccccccc")
+
+    result = retention.purge(_policy("paper_codes"), sleep=0)
+
+    assert result.deleted == 1
+    assert set(twofa.models.PaperCode.objects.values_list("pk", flat=True)) == {recent.pk, unused.pk}
+
+
+@pytest.mark.django_db
+def test_purges_old_deleted_devices(user):
+    old = twofa.models.TOTPDevice.objects.create(owner=user, last_t=0, deleted_at=_days_ago(31))
+    recent = twofa.models.TOTPDevice.objects.create(owner=user, last_t=0, deleted_at=_days_ago(1))
+    live = twofa.models.TOTPDevice.objects.create(owner=user, last_t=0)
+
+    result = retention.purge(_policy("devices"), sleep=0)
+
+    assert result.deleted == 1
+    assert not twofa.models.TOTPDevice.objects.filter(pk=old.pk).exists()
+    assert set(twofa.models.Device.objects.values_list("pk", flat=True)) == {recent.pk, live.pk}
+
+
+@pytest.mark.django_db
+def test_purges_unreferenced_avatars(user):
+    current = accounts.tests.factories.AvatarFactory.create(user=user)
+    old = accounts.tests.factories.AvatarFactory.create(user=user)
+    recent = accounts.tests.factories.AvatarFactory.create(user=user)
+    accounts.models.Avatar.objects.filter(pk__in=[current.pk, old.pk]).update(added_at=_days_ago(31))
+    user.current_avatar = current
+    user.save()
+
+    result = retention.purge(_policy("avatars"), sleep=0)
+
+    assert result.deleted == 1
+    assert set(accounts.models.Avatar.objects.values_list("pk", flat=True)) == {current.pk, recent.pk}
+
+
+@pytest.mark.django_db
+def test_purges_old_user_changes(user):
+    old, recent = api.models.UserChange.objects.bulk_create(
+        [api.models.UserChange(user=user, kind="updated"), api.models.UserChange(user=user, kind="updated")]
+    )
+    api.models.UserChange.objects.filter(pk=old.pk).update(created_at=_days_ago(91))
+
+    result = retention.purge(_policy("user_changes"), sleep=0)
+
+    assert result.deleted == 1
+    assert not api.models.UserChange.objects.filter(pk=old.pk).exists()
+    assert api.models.UserChange.objects.filter(pk=recent.pk).exists()
+
+
+@pytest.mark.django_db
+def test_purges_avatar_files(user, settings, tmp_path, django_capture_on_commit_callbacks):
+    settings.MEDIA_ROOT = str(tmp_path)
+    old = accounts.tests.factories.AvatarFactory.create(user=user, uploaded=True)
+    recent = accounts.tests.factories.AvatarFactory.create(user=user, uploaded=True)
+    accounts.models.Avatar.objects.filter(pk=old.pk).update(added_at=_days_ago(31))
+    assert old.image_file.storage.exists(old.image_file.name)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        result = retention.purge(_policy("avatars"), sleep=0)
+
+    assert result.deleted == 1
+    assert not old.image_file.storage.exists(old.image_file.name)
+    assert recent.image_file.storage.exists(recent.image_file.name)
+
+
+@pytest.mark.django_db
+def test_command_reports_rate(user):
+    Session.objects.create(session_key="expired", session_data="", expire_date=_days_ago(1), user=user)
+    out = io.StringIO()
+
+    call_command("cleanup_stale_data", "sessions", "--sleep=0", stdout=out)
+
+    assert "sessions: deleted 1 rows in" in out.getvalue()
+    assert "rows/s" in out.getvalue()
+    assert "avatars" not in out.getvalue()
+
+
+def test_command_unknown_policy():
+    with pytest.raises(CommandError) as exc:
+        call_command("cleanup_stale_data", "bananas")
+    assert str(exc.value) == 'Unknown policy: "bananas"'
+
+
+def test_schedule_only_once():
+    queue = django_rq.get_queue("default")
+    queue.scheduled_job_registry.remove_jobs()
+
+    assert retention.schedule(queue) is not None
+    assert retention.schedule(queue) is None
+    assert queue.scheduled_job_registry.count == 1
@@ -0,0 +1,5 @@
+import django_rq
+
+
+def redis_connection():
+    return django_rq.get_connection("default")
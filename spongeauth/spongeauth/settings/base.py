@@ -51,6 +51,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "core.middleware.XRealIPMiddleware",
+    "sso.middleware.BatchSSOSync",
     "django.middleware.security.SecurityMiddleware",
     "user_sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -109,6 +110,20 @@ AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.NumericPasswordValidator"},
 ]
 
+# Django's defaults, but with PBKDF2 iterations taken from
+# PASSWORD_PBKDF2_ITERATIONS. Run the calibrate_hashers command on the
+# deployment host to choose a value; unset uses Django's default.
+PASSWORD_HASHERS = [
+    "accounts.hashers.PBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv("PASSWORD_PBKDF2_ITERATIONS", "0")) or None
+# Threads hashing the passwords of users created together through the API.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or os.cpu_count() or 1
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.10/topics/i18n/
 
@@ -136,6 +151,10 @@ LOGIN_REDIRECT_URL = "/"
 
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", "")
 GOOGLE_SCOPES = ["profile", "email"]
+GOOGLE_ID_TOKEN_CERTS_URI = "https://www.googleapis.com/oauth2/v1/certs"
+# If set, a dict of key ID to PEM certificate used instead of fetching
+# GOOGLE_ID_TOKEN_CERTS_URI, e.g. for tests.
+GOOGLE_ID_TOKEN_CERTS = None
 SECURE_CROSS_ORIGIN_OPENER_POLICY = 'same-origin-allow-popups'
 
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap3"
@@ -156,6 +175,52 @@ EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 # }
 SSO_ENDPOINTS = {}
 
+# Changed users are collected for SSO_SYNC_WINDOW seconds and then synced to
+# each endpoint once, SSO_SYNC_BATCH_SIZE users at a time.
+SSO_SYNC_WINDOW = 5
+SSO_SYNC_BATCH_SIZE = 500
+# How many sync requests each worker has in flight to an endpoint at once.
+SSO_SYNC_CONCURRENCY = 8
+# Connect and read timeouts for each sync request, in seconds: a hung
+# endpoint fails and is retried rather than holding up the whole drain.
+SSO_SYNC_TIMEOUT = (5, 30)
+# Users per second sso_ping_discourse queues for each endpoint when syncing
+# everyone, unless the endpoint sets its own "sync_rate"; 0 for no limit.
+SSO_SYNC_RATE = 50
+# Failed syncs are retried with exponential backoff (in seconds), and users
+# who fail SSO_RETRY_MAX_ATTEMPTS times in a row are dead-lettered until
+# replayed with sso_dead_letters --replay.
+SSO_RETRY_BASE_DELAY = 5
+SSO_RETRY_MAX_DELAY = 600
+SSO_RETRY_MAX_ATTEMPTS = 8
+# After this many failures in a row syncs to an endpoint are paused for
+# SSO_BREAKER_COOLDOWN seconds, doubling for each failed probe.
+SSO_BREAKER_THRESHOLD = 5
+SSO_BREAKER_COOLDOWN = 30
+
+# Pages of the user change feed hold up to API_CHANGES_MAX_PAGE_SIZE changes.
+# Changes younger than API_CHANGES_SETTLE seconds are held back, so one from
+# a transaction which commits late isn't skipped over by a consumer's cursor.
+# That only covers transactions committing within the window: a change from
+# one which commits later can land behind a cursor and be missed.
+API_CHANGES_PAGE_SIZE = 500
+API_CHANGES_MAX_PAGE_SIZE = 5000
+API_CHANGES_SETTLE = 2
+
+# Validated API keys are remembered by each process for API_KEY_CACHE_TTL
+# seconds; a key which is changed or deleted may keep working for that long.
+API_KEY_CACHE_TTL = 60
+API_KEY_CACHE_SIZE = 1000
+# Seconds a user's ETag is remembered for, if they don't change before then.
+API_USER_VERSION_TTL = 24 * 60 * 60
+# Most usernames, ids and emails /api/lookup takes in one request.
+API_LOOKUP_MAX_USERS = 200
+# /api/export streams users API_EXPORT_BATCH_SIZE at a time.
+API_EXPORT_BATCH_SIZE = 1000
+# Most users /api/batch creates in one request. Their passwords are hashed
+# while the request waits, so this keeps it well inside the worker timeout.
+API_BATCH_CREATE_MAX_USERS = 50
+
 IS_TESTING = False
 
 # The period for which an avatar change token for an organisation is valid.
@@ -164,8 +229,51 @@ ACCOUNTS_AVATAR_CHANGE_MAX_AGE = 1800
 ACCOUNTS_AVATAR_RESIZE_MAX_DIMENSION = 240
 ACCOUNTS_AVATAR_CHANGE_GROUPS = ["dummy"]
 
+# Data retention settings, used by core.retention.
+# Rows are deleted once they have been stale for this many days.
+# user_changes is how far back the /api/changes feed reaches: consumers
+# whose cursor is older than that have to start again from /api/export.
+RETENTION_MAX_AGE_DAYS = {"sessions": 0, "paper_codes": 30, "devices": 30, "avatars": 30, "user_changes": 90}
+RETENTION_BATCH_SIZE = 1000
+# Seconds to sleep between batches, to keep lock times short.
+RETENTION_BATCH_SLEEP = 0.1
+# Seconds between scheduled cleanup runs. Default: daily.
+RETENTION_INTERVAL = 86400
+
+# Token bucket rate limits, used by core.ratelimit.
+# capacity is the burst size, and rate is the number of tokens refilled per second.
+RATELIMIT_ENABLED = True
+RATELIMIT_BUCKETS = {
+    "login-ip": {"capacity": 30, "rate": 0.5},
+    "login-username": {"capacity": 10, "rate": 0.1},
+    "twofa-ip": {"capacity": 30, "rate": 0.5},
+    "twofa-device": {"capacity": 5, "rate": 0.05},
+}
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://{}:6379/1".format(os.getenv("REDIS_HOST", "localhost")),
+    }
+}
+
 # Redis queue settings.
-RQ_QUEUES = {"default": {"HOST": os.getenv("REDIS_HOST", "localhost"), "PORT": 6379, "DB": 0, "DEFAULT_TIMEOUT": 300}}
+RQ_QUEUES = {
+    "default": {"HOST": os.getenv("REDIS_HOST", "localhost"), "PORT": 6379, "DB": 0, "DEFAULT_TIMEOUT": 300},
+    "mail": {"HOST": os.getenv("REDIS_HOST", "localhost"), "PORT": 6379, "DB": 0, "DEFAULT_TIMEOUT": 300},
+}
+
+# Seconds to wait before each retry of a failed outgoing email.
+MAIL_RETRY_INTERVALS = [10, 60, 300]
+# The same email to the same recipient is sent at most MAIL_DEDUPE_MAX_SENDS
+# times in any MAIL_DEDUPE_WINDOW seconds; further requests are dropped.
+MAIL_DEDUPE_WINDOW = 300
+MAIL_DEDUPE_MAX_SENDS = 1
+
+# Terms of Service change notices: users per batch, and the maximum number of
+# emails sent per second.
+TOS_NOTICE_BATCH_SIZE = 500
+TOS_NOTICE_RATE = 20
 
 LETTER_AVATAR_BASE = os.getenv("LETTER_AVATAR_BASE", "https://avatars.discourse-cdn.com/v4") \
                      + "/letter/{}/{}/240.png"
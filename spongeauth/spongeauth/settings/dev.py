@@ -12,6 +12,8 @@ MIDDLEWARE = ["debug_toolbar.middleware.DebugToolbarMiddleware"] + MIDDLEWARE
 
 INSTALLED_APPS = INSTALLED_APPS + ["debug_toolbar"]
 
+CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
 for queue in RQ_QUEUES.values():
     queue["ASYNC"] = False
 from fakeredis import FakeRedis, FakeStrictRedis
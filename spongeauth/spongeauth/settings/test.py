@@ -4,6 +4,10 @@ from .base import *
 
 IS_TESTING = True
 
+CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+# API keys cached by one test would otherwise outlive its database
+API_KEY_CACHE_TTL = 0
+
 for queue in RQ_QUEUES.values():
     queue["ASYNC"] = False
 from fakeredis import FakeRedis, FakeStrictRedis
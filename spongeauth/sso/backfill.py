@@ -0,0 +1,117 @@
+import collections
+import datetime
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+
+import django_rq
+
+from accounts.models import User
+import core.utils
+from . import dispatch
+
+
+Progress = collections.namedtuple("Progress", ["queued", "total", "last_pk", "elapsed", "eta"])
+
+
+def _checkpoint_key(since, groups, endpoints):
+    ident = json.dumps([since.isoformat() if since else None, sorted(groups), sorted(endpoints)]).encode("utf8")
+    return "spongeauth:sso:backfill:{}".format(hashlib.sha256(ident).hexdigest())
+
+
+def get_checkpoint(since, groups, endpoints):
+    last_pk = core.utils.redis_connection().get(_checkpoint_key(since, groups, endpoints))
+    return None if last_pk is None else int(last_pk)
+
+
+def set_checkpoint(since, groups, endpoints, last_pk):
+    core.utils.redis_connection().set(_checkpoint_key(since, groups, endpoints), last_pk)
+
+
+def clear_checkpoint(since, groups, endpoints):
+    core.utils.redis_connection().delete(_checkpoint_key(since, groups, endpoints))
+
+
+def eligible_users(since=None, groups=None):
+    users = User.objects.filter(is_active=True, email_verified=True)
+    if since is not None:
+        # Users have no modification time: joining or logging in is the best
+        # sign of a user whose details might have changed.
+        users = users.filter(Q(joined_at__gte=since) | Q(last_login__gte=since))
+    if groups:
+        members = User.groups.through.objects.filter(user=OuterRef("pk"), group__internal_name__in=groups)
+        users = users.filter(Exists(members))
+    return users
+
+
+def keyset_batches(users, batch_size, after_pk=None):
+    # Each batch is its own query starting after the last pk seen, so every
+    # one is an index range scan however far through the table we are.
+    pks = users.order_by("pk").values_list("pk", flat=True)
+    while True:
+        batch = list((pks if after_pk is None else pks.filter(pk__gt=after_pk))[:batch_size])
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        after_pk = batch[-1]
+
+
+def endpoint_rate(endpoint_name, rate=None):
+    # Users per second; 0 for no limit.
+    if rate is not None:
+        return rate
+    return float(settings.SSO_ENDPOINTS[endpoint_name].get("sync_rate", settings.SSO_SYNC_RATE))
+
+
+@django_rq.job
+def sync_batch(endpoint_name, user_ids, force=False):
+    return dispatch.dispatch(endpoint_name, user_ids, force=force)
+
+
+def _enqueue_batch(queue, endpoints, user_ids, force, rates, slots, now):
+    # One job per endpoint, all sent to Redis in one round trip. An endpoint's
+    # jobs are spaced out to keep to its rate, so later ones are scheduled.
+    with queue.connection.pipeline() as pipe:
+        for endpoint in endpoints:
+            job = queue.create_job(sync_batch, args=(endpoint, user_ids), kwargs={"force": force})
+            at = max(slots.get(endpoint, now), now)
+            if at > now:
+                queue.schedule_job(job, datetime.datetime.fromtimestamp(at, tz=datetime.timezone.utc), pipeline=pipe)
+            else:
+                queue.enqueue_job(job, pipeline=pipe)
+            slots[endpoint] = at + (len(user_ids) / rates[endpoint] if rates[endpoint] else 0)
+        pipe.execute()
+
+
+def enqueue_all(endpoints, since=None, groups=None, force=False, batch_size=None, rate=None, resume=True):
+    batch_size = batch_size or settings.SSO_SYNC_BATCH_SIZE
+    groups = groups or []
+    rates = {endpoint: endpoint_rate(endpoint, rate) for endpoint in endpoints}
+    queue = django_rq.get_queue("default")
+
+    last_pk = get_checkpoint(since, groups, endpoints) if resume else None
+    users = eligible_users(since=since, groups=groups)
+    total = (users if last_pk is None else users.filter(pk__gt=last_pk)).count()
+
+    started = time.monotonic()
+    slots = {}
+    queued = 0
+    for batch in keyset_batches(users, batch_size, after_pk=last_pk):
+        now = time.time()
+        _enqueue_batch(queue, endpoints, batch, force, rates, slots, now)
+        last_pk = batch[-1]
+        set_checkpoint(since, groups, endpoints, last_pk)
+        queued += len(batch)
+
+        elapsed = time.monotonic() - started
+        remaining = (total - queued) * elapsed / queued
+        # The last job scheduled for the slowest endpoint is when we're done.
+        synced_in = max(slots.values()) - now
+        yield Progress(queued, total, last_pk, elapsed, max(remaining, synced_in))
+
+    clear_checkpoint(since, groups, endpoints)
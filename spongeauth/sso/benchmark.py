@@ -0,0 +1,105 @@
+import collections
+import http.server
+import threading
+import time
+
+import requests
+
+from . import dispatch, utils
+
+
+Result = collections.namedtuple("Result", ["mode", "requests", "failed", "connections", "elapsed"])
+
+
+class _StandInHandler(http.server.BaseHTTPRequestHandler):
+    # HTTP/1.1, so clients can keep connections alive between requests.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):  # noqa: N802
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        body = b'{"success":"OK"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer:
+    """A local server answering Discourse's sync_sso endpoint, for benchmarking."""
+
+    def __init__(self, latency=0.0):
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.lock = threading.Lock()
+        self.httpd.connections = 0
+
+    @property
+    def url(self):
+        return "http://{}:{}/admin/users/sync_sso".format(*self.httpd.server_address)
+
+    @property
+    def connections(self):
+        return self.httpd.connections
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _pings(endpoint_name, url, total):
+    headers = {"Api-Username": "system", "Api-Key": "benchmark"}
+    return [
+        utils.Ping(n, endpoint_name, None, url, headers, {"sso": "payload-{}".format(n), "sig": "sig"})
+        for n in range(total)
+    ]
+
+
+def _unpooled(pings):
+    # How syncs were sent before: a fresh connection for every request.
+    failed = 0
+    for ping in pings:
+        try:
+            requests.post(ping.url, headers=ping.headers, data=ping.data).raise_for_status()
+        except requests.RequestException:
+            failed += 1
+    return failed
+
+
+def run(total=200, concurrency=8, latency=0.0):
+    results = []
+    modes = [("unpooled", None), ("pooled", 1), ("pooled x{}".format(concurrency), concurrency)]
+    for mode, workers in modes:
+        with StandInServer(latency=latency) as server:
+            pings = _pings("benchmark-{}".format(mode), server.url, total)
+            started = time.monotonic()
+            if workers is None:
+                failed = _unpooled(pings)
+            else:
+                failed = len(dispatch.post_all(pings, concurrency=workers)[1])
+            elapsed = time.monotonic() - started
+            results.append(Result(mode, total, failed, server.connections, elapsed))
+    return results
+
+
+def format_result(result):
+    rate = result.requests / result.elapsed if result.elapsed else float(result.requests)
+    return "{}: {} requests, {} failed, {} connections, {:.1f} req/s".format(
+        result.mode, result.requests, result.failed, result.connections, rate
+    )
@@ -0,0 +1,88 @@
+import collections
+import concurrent.futures
+import logging
+
+from django.conf import settings
+
+from accounts.models import User
+from core import metrics
+from . import retry, utils
+
+
+logger = logging.getLogger(__name__)
+
+Result = collections.namedtuple("Result", ["sent", "skipped", "failed", "deferred"])
+
+
+def post_all(pings, concurrency=None):
+    # Only the HTTP requests run on the pool: they spend their time waiting on
+    # the endpoint, and keeping them off the database means threads never need
+    # connections of their own.
+    concurrency = concurrency or settings.SSO_SYNC_CONCURRENCY
+    succeeded, failed = [], []
+    if not pings:
+        return succeeded, failed
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(concurrency, len(pings))) as pool:
+        futures = {pool.submit(utils.post_ping, ping): ping for ping in pings}
+        for future in concurrent.futures.as_completed(futures):
+            ping = futures[future]
+            try:
+                future.result()
+            except Exception as exc:
+                logger.warning("Syncing user %s to %s failed: %r", ping.user_id, ping.endpoint_name, exc)
+                failed.append((ping, exc))
+            else:
+                succeeded.append(ping)
+    return succeeded, failed
+
+
+def _send(endpoint_name, pings, concurrency):
+    state = retry.breaker_state(endpoint_name)
+    if state == retry.OPEN:
+        return [], [], pings
+    succeeded, failed = [], []
+    if state == retry.HALF_OPEN:
+        # Probe with one request before letting the rest through.
+        succeeded, failed = post_all(pings[:1], concurrency=1)
+        retry.record_results(endpoint_name, [ping.user_id for ping in succeeded], [])
+        if failed:
+            return succeeded, failed, pings[1:]
+        pings = pings[1:]
+    more_succeeded, more_failed = post_all(pings, concurrency=concurrency)
+    return succeeded + more_succeeded, failed + more_failed, []
+
+
+def dispatch(endpoint_name, user_ids, exclude_groups=None, force=False, concurrency=None):
+    endpoint_settings = settings.SSO_ENDPOINTS.get(endpoint_name)
+    if not endpoint_settings or "sync_sso_endpoint" not in endpoint_settings:
+        return Result(0, 0, 0, 0)
+
+    pings, errors = [], []
+    for user in User.objects.filter(pk__in=user_ids).order_by("pk").iterator():
+        try:
+            ping = utils.prepare_ping(user, endpoint_name, exclude_groups, force=force)
+        except Exception:
+            logger.exception("Preparing sync of user %s to %s failed", user.pk, endpoint_name)
+            errors.append(user.pk)
+            continue
+        if ping is not None:
+            pings.append(ping)
+    retry.schedule_retries(endpoint_name, errors)
+
+    succeeded, failed, deferred = _send(endpoint_name, pings, concurrency)
+    sent = len(succeeded) + len(failed)
+    if sent:
+        metrics.incr("sso.ping.{}".format(endpoint_name), sent)
+    if failed:
+        metrics.incr("sso.ping_failed.{}".format(endpoint_name), len(failed))
+    if deferred:
+        metrics.incr("sso.ping_deferred.{}".format(endpoint_name), len(deferred))
+
+    for ping in succeeded:
+        utils.set_synced_digest(ping.user_id, endpoint_name, ping.digest)
+    retry.record_results(
+        endpoint_name, [ping.user_id for ping in succeeded], [(ping.user_id, exc) for ping, exc in failed]
+    )
+    retry.defer(endpoint_name, [ping.user_id for ping in deferred])
+    skipped = len(user_ids) - len(pings) - len(errors)
+    return Result(len(succeeded), skipped, len(failed) + len(errors), len(deferred))
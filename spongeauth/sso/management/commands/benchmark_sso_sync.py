@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sso import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure sync request throughput against a local stand-in Discourse server, "
+        "with and without pooled connections and concurrency"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--latency", type=float, default=20, help="Simulated Discourse response time, in ms")
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1 or options["concurrency"] < 1:
+            raise CommandError("--requests and --concurrency must be positive")
+
+        results = benchmark.run(
+            total=options["requests"], concurrency=options["concurrency"], latency=options["latency"] / 1000
+        )
+        for result in results:
+            self.stdout.write(benchmark.format_result(result))
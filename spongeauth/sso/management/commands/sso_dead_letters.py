@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sso import retry, sync_queue
+
+
+class Command(BaseCommand):
+    help = "List, or replay, users whose Discourse syncs failed every retry"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--endpoint", action="append", help="Only these endpoints (default: all)")
+        parser.add_argument("--replay", action="store_true", help="Queue the dead-lettered users to be synced again")
+
+    def handle(self, *args, **options):
+        endpoints = sync_queue.sync_endpoints()
+        if options["endpoint"]:
+            unknown = set(options["endpoint"]) - set(endpoints)
+            if unknown:
+                raise CommandError("Unknown sync endpoints: {}".format(", ".join(sorted(unknown))))
+            endpoints = options["endpoint"]
+
+        for endpoint in endpoints:
+            if options["replay"]:
+                count = sync_queue.replay_dead_letters(endpoint)
+                self.stdout.write("{}: replaying {} users".format(endpoint, count))
+            else:
+                user_ids = retry.dead_letters(endpoint)
+                state = retry.breaker_state(endpoint)
+                self.stdout.write("{}: {} dead-lettered users, circuit {}".format(endpoint, len(set(user_ids)), state))
@@ -1,7 +1,23 @@
+import datetime
+
 from django.core.management.base import BaseCommand, CommandError
+from django.utils import dateparse, timezone
 
+from sso import backfill, sync_queue
 from sso.utils import send_update_ping
-from accounts.models import User
+from accounts.models import Group, User
+
+
+def _parse_since(value):
+    since = dateparse.parse_datetime(value)
+    if since is None:
+        date = dateparse.parse_date(value)
+        if date is None:
+            raise CommandError('Invalid --since "{}": use YYYY-MM-DD or an ISO 8601 time'.format(value))
+        since = datetime.datetime.combine(date, datetime.time())
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
 
 
 class Command(BaseCommand):
@@ -9,20 +25,37 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("username", nargs="*", type=str)
+        parser.add_argument(
+            "--force", action="store_true", help="Send users even if Discourse already has their current details"
+        )
+        parser.add_argument("--since", type=str, help="Only users who joined or logged in since this date")
+        parser.add_argument("--group", action="append", help="Only members of this group (by internal name)")
+        parser.add_argument("--endpoint", action="append", help="Only sync to this endpoint (default: all)")
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument(
+            "--rate", type=float, default=None, help="Maximum users per second to each endpoint, 0 for no limit"
+        )
+        parser.add_argument(
+            "--restart", action="store_true", help="Ignore the checkpoint left by a previous run and start over"
+        )
 
-    def send_update(self, user):
-        return send_update_ping(user)
+    def send_update(self, user, force=False):
+        return send_update_ping(user, force=force)
 
     def handle(self, *args, **options):
         if options["username"]:
-            users = list(User.objects.filter(username__in=options["username"]))
-            usernames = {user.username for user in users}
-            if usernames != set(options["username"]):
-                raise CommandError(
-                    'User mismatch: couldn\'t find "{}"'.format('", "'.join(set(options["username"]) - usernames))
-                )
-        else:
-            users = list(User.objects.filter(is_active=True, email_verified=True))
+            if options["since"] or options["group"] or options["endpoint"]:
+                raise CommandError("--since, --group and --endpoint can't be used with usernames")
+            return self.handle_users(options)
+        return self.handle_all(options)
+
+    def handle_users(self, options):
+        users = list(User.objects.filter(username__in=options["username"]))
+        usernames = {user.username for user in users}
+        if usernames != set(options["username"]):
+            raise CommandError(
+                'User mismatch: couldn\'t find "{}"'.format('", "'.join(set(options["username"]) - usernames))
+            )
 
         for user in users:
             self.stdout.write(user.username, ending=" ")
@@ -32,7 +65,59 @@ class Command(BaseCommand):
                 continue
 
             try:
-                self.send_update(user)
+                self.send_update(user, force=options["force"])
                 self.stdout.write(self.style.SUCCESS("OK"))
             except Exception as ex:
                 self.stdout.write(self.style.ERROR("failed: {}".format(repr(ex))))
+
+    def handle_all(self, options):
+        endpoints = sync_queue.sync_endpoints()
+        if options["endpoint"]:
+            unknown = set(options["endpoint"]) - set(endpoints)
+            if unknown:
+                raise CommandError("Unknown sync endpoints: {}".format(", ".join(sorted(unknown))))
+            endpoints = sorted(set(options["endpoint"]))
+        if not endpoints:
+            raise CommandError("No endpoints to sync to")
+
+        groups = sorted(set(options["group"] or []))
+        missing = set(groups) - set(
+            Group.objects.filter(internal_name__in=groups).values_list("internal_name", flat=True)
+        )
+        if missing:
+            raise CommandError("Unknown groups: {}".format(", ".join(sorted(missing))))
+        since = _parse_since(options["since"]) if options["since"] else None
+
+        checkpoint = None if options["restart"] else backfill.get_checkpoint(since, groups, endpoints)
+        if checkpoint is not None:
+            self.stdout.write("Resuming after user {}".format(checkpoint))
+
+        progress = None
+        try:
+            for progress in backfill.enqueue_all(
+                endpoints,
+                since=since,
+                groups=groups,
+                force=options["force"],
+                batch_size=options["batch_size"],
+                rate=options["rate"],
+                resume=not options["restart"],
+            ):
+                self.stdout.write(
+                    "Queued {}/{} users ({:.0f}/s), up to user {}, ETA {}".format(
+                        progress.queued,
+                        progress.total,
+                        progress.queued / progress.elapsed if progress.elapsed else progress.queued,
+                        progress.last_pk,
+                        datetime.timedelta(seconds=round(progress.eta)),
+                    )
+                )
+        except Exception as ex:
+            raise CommandError(
+                "Queueing failed after user {}, run again to resume: {}".format(
+                    backfill.get_checkpoint(since, groups, endpoints), repr(ex)
+                )
+            )
+
+        queued = progress.queued if progress else 0
+        self.stdout.write(self.style.SUCCESS("Queued {} users for {}".format(queued, ", ".join(endpoints))))
@@ -0,0 +1,31 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from . import sync_queue
+
+
+class BatchSSOSync:
+    # Users changed while handling a request are marked dirty once, when it's
+    # done, however many times they were saved.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with sync_queue.batched():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        batch = sync_queue.Batch()
+        token = sync_queue.current_batch.set(batch)
+        try:
+            return await self.get_response(request)
+        finally:
+            sync_queue.current_batch.reset(token)
+            await sync_to_async(batch.flush)()
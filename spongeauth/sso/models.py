@@ -1,21 +1,52 @@
 from django.conf import settings
-from django.db.models.signals import post_save, m2m_changed
+from django.db.models.signals import post_init, post_save, m2m_changed
 from django.dispatch import receiver
 
 from accounts.models import User, Avatar
+from accounts.signals import groups_resynced, users_created
 
-from .utils import send_update_ping
+from .sync_queue import batched_ids, mark_dirty_on_commit
+from .utils import SYNCED_USER_FIELDS
 
 
 def _can_ping():
     return settings.SSO_ENDPOINTS
 
 
+def _synced_values(instance):
+    # deferred fields are left out, and count as changed if they're saved
+    return {name: instance.__dict__[name] for name in SYNCED_USER_FIELDS if name in instance.__dict__}
+
+
+def _synced_fields_changed(instance, update_fields):
+    if update_fields is not None and not SYNCED_USER_FIELDS.intersection(update_fields):
+        return False
+    original = getattr(instance, "_sso_synced_values", {})
+    current = _synced_values(instance)
+    return any(name not in original or original[name] != value for name, value in current.items())
+
+
+@receiver(post_init, sender=User)
+def on_user_init(sender, instance=None, **kwargs):
+    instance._sso_synced_values = _synced_values(instance)
+
+
 @receiver(post_save, sender=User)
-def on_user_save(sender, instance=None, **kwargs):
+def on_user_save(sender, instance=None, created=False, update_fields=None, **kwargs):
+    if not _can_ping():
+        return  # do nothing
+    changed = created or _synced_fields_changed(instance, update_fields)
+    instance._sso_synced_values = _synced_values(instance)
+    if not changed:
+        return  # nothing Discourse can see has changed
+    mark_dirty_on_commit([instance.pk])
+
+
+@receiver(users_created, sender=User)
+def on_users_created(sender, users=None, **kwargs):
     if not _can_ping():
         return  # do nothing
-    send_update_ping(instance)
+    mark_dirty_on_commit([user.pk for user in users])
 
 
 @receiver(m2m_changed, sender=User.groups.through)
@@ -25,27 +56,33 @@ def on_group_change(sender, instance=None, pk_set=None, action=None, reverse=Non
     if not _can_ping():
         return  # do nothing, again
     if reverse:
-        instances = User.objects.filter(pk__in=pk_set)
+        mark_dirty_on_commit(pk_set)
     else:
-        instances = [instance]
-    for instance in instances:
-        send_update_ping(instance)
+        mark_dirty_on_commit([instance.pk])
+
+
+@receiver(groups_resynced, sender=User)
+def on_groups_resynced(sender, user=None, **kwargs):
+    if not _can_ping():
+        return  # do nothing
+    mark_dirty_on_commit([user.pk])
 
 
 @receiver(m2m_changed, sender=User.groups.through)
 def on_group_clear(sender, instance=None, pk_set=None, action=None, reverse=None, **kwargs):
+    # Members have to be collected before the clear, but they're only marked
+    # once it commits, so the sync sees the cleared groups.
     if action != "pre_clear":
         return
     if not _can_ping():
         return  # do nothing, again
     if reverse:
-        instances = list(instance.user_set.all())
-        groups = [instance.id]
+        # stream the members: a group can have a great many
+        members = instance.user_set.values_list("pk", flat=True).iterator(chunk_size=settings.SSO_SYNC_BATCH_SIZE)
+        for chunk in batched_ids(members, settings.SSO_SYNC_BATCH_SIZE):
+            mark_dirty_on_commit(chunk)
     else:
-        instances = [instance]
-        groups = list(instance.groups.values_list("id", flat=True))
-    for instance in instances:
-        send_update_ping(instance, exclude_groups=groups)
+        mark_dirty_on_commit([instance.pk])
 
 
 @receiver(post_save, sender=Avatar)
@@ -58,4 +95,4 @@ def on_avatar_save(sender, instance=None, **kwargs):
     # This shouldn't trigger, because avatars shouldn't change once they've
     # been saved to the database, but just in case someone messes around with
     # the admin panel...
-    send_update_ping(instance.user)
+    mark_dirty_on_commit([instance.user_id])
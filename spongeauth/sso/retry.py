@@ -0,0 +1,213 @@
+import datetime
+import email.utils
+import random
+import time
+
+from django.conf import settings
+
+import django_rq
+
+from core import metrics
+import core.utils
+
+
+DRAIN_SCHEDULED_KEY = "spongeauth:sso:drain-scheduled"
+# Sorted set of user id to the time their next attempt is due.
+RETRY_KEY = "spongeauth:sso:retry:{}"
+# Hash of user id to how many attempts in a row have failed.
+ATTEMPTS_KEY = "spongeauth:sso:attempts:{}"
+# List of user ids which failed every attempt, kept until replayed.
+DEAD_LETTER_KEY = "spongeauth:sso:dead:{}"
+# Hash of consecutive failures and the time the endpoint is paused until.
+BREAKER_KEY = "spongeauth:sso:breaker:{}"
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+def schedule_drain(delay, now=None):
+    # The flag holds when the next drain is due, so a sooner drain can still
+    # be scheduled if one is only due later; an extra drain is harmless.
+    now = time.time() if now is None else now
+    due = now + delay
+    conn = core.utils.redis_connection()
+    scheduled = conn.get(DRAIN_SCHEDULED_KEY)
+    if scheduled is not None and float(scheduled) <= due:
+        return
+    conn.set(DRAIN_SCHEDULED_KEY, due, ex=int(delay) + settings.SSO_SYNC_WINDOW * 10)
+    django_rq.get_queue("default").enqueue_in(datetime.timedelta(seconds=delay), "sso.sync_queue.drain")
+
+
+def backoff(attempt):
+    # Exponential, with jitter so users who failed together don't all retry
+    # at the same moment.
+    delay = min(settings.SSO_RETRY_MAX_DELAY, settings.SSO_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def parse_retry_after(value, now=None):
+    if not value:
+        return None
+    now = time.time() if now is None else now
+    if value.strip().isdigit():
+        return int(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, when.timestamp() - now)
+
+
+def _rate_limit_delay(exc, now):
+    response = getattr(exc, "response", None)
+    if response is None or response.status_code != 429:
+        return None
+    delay = parse_retry_after(response.headers.get("Retry-After"), now=now)
+    return settings.SSO_RETRY_BASE_DELAY if delay is None else delay
+
+
+def breaker_state(endpoint_name, now=None):
+    now = time.time() if now is None else now
+    failures, open_until = core.utils.redis_connection().hmget(
+        BREAKER_KEY.format(endpoint_name), "failures", "open_until"
+    )
+    if open_until is not None and float(open_until) > now:
+        return OPEN
+    if int(failures or 0) >= settings.SSO_BREAKER_THRESHOLD:
+        # The pause is over: let a single request through to see whether the
+        # endpoint has recovered.
+        return HALF_OPEN
+    return CLOSED
+
+
+def paused_until(endpoint_name):
+    open_until = core.utils.redis_connection().hget(BREAKER_KEY.format(endpoint_name), "open_until")
+    return None if open_until is None else float(open_until)
+
+
+def pause(endpoint_name, until):
+    core.utils.redis_connection().hset(BREAKER_KEY.format(endpoint_name), "open_until", until)
+
+
+def _is_endpoint_failure(exc):
+    # Errors which say the endpoint is unhealthy, rather than that it turned
+    # down one user's details: no response at all, or a server error.
+    response = getattr(exc, "response", None)
+    return response is None or response.status_code >= 500
+
+
+def _record_failure(endpoint_name, now):
+    failures = core.utils.redis_connection().hincrby(BREAKER_KEY.format(endpoint_name), "failures", 1)
+    threshold = settings.SSO_BREAKER_THRESHOLD
+    if failures >= threshold:
+        # Each failed probe doubles the pause.
+        cooldown = min(settings.SSO_RETRY_MAX_DELAY, settings.SSO_BREAKER_COOLDOWN * 2 ** (failures - threshold))
+        pause(endpoint_name, now + cooldown)
+        metrics.incr("sso.breaker_opened.{}".format(endpoint_name))
+
+
+def schedule_retries(endpoint_name, user_ids, delay=None, count=True, now=None):
+    # Without a delay each user backs off according to how often they've
+    # failed; deferred users (count=False) don't use up attempts.
+    if not user_ids:
+        return
+    now = time.time() if now is None else now
+    conn = core.utils.redis_connection()
+    attempts_key = ATTEMPTS_KEY.format(endpoint_name)
+    with conn.pipeline(transaction=False) as pipe:
+        for user_id in user_ids:
+            if count:
+                pipe.hincrby(attempts_key, user_id, 1)
+            else:
+                pipe.hget(attempts_key, user_id)
+        attempts = [int(n or 0) for n in pipe.execute()]
+
+    due, dead = {}, []
+    for user_id, attempt in zip(user_ids, attempts):
+        if count and attempt > settings.SSO_RETRY_MAX_ATTEMPTS:
+            dead.append(user_id)
+        else:
+            due[user_id] = now + (backoff(max(attempt, 1)) if delay is None else delay)
+
+    with conn.pipeline(transaction=False) as pipe:
+        if due:
+            pipe.zadd(RETRY_KEY.format(endpoint_name), due)
+        if dead:
+            pipe.hdel(attempts_key, *dead)
+            pipe.rpush(DEAD_LETTER_KEY.format(endpoint_name), *dead)
+        pipe.execute()
+    if dead:
+        metrics.incr("sso.dead_lettered.{}".format(endpoint_name), len(dead))
+    if due:
+        metrics.incr("sso.retry_scheduled.{}".format(endpoint_name), len(due))
+        schedule_drain(max(0, min(due.values()) - now), now=now)
+
+
+def defer(endpoint_name, user_ids, now=None):
+    if not user_ids:
+        return
+    now = time.time() if now is None else now
+    until = paused_until(endpoint_name) or now
+    schedule_retries(endpoint_name, user_ids, delay=max(0, until - now), count=False, now=now)
+
+
+def record_results(endpoint_name, succeeded, failed, now=None):
+    # succeeded is a list of user ids, failed a list of (user id, exception).
+    now = time.time() if now is None else now
+    conn = core.utils.redis_connection()
+    if succeeded:
+        conn.hdel(ATTEMPTS_KEY.format(endpoint_name), *succeeded)
+        conn.hdel(BREAKER_KEY.format(endpoint_name), "failures", "open_until")
+    if not failed:
+        return
+
+    rate_limited = {}
+    errored = []
+    endpoint_failed = False
+    for user_id, exc in failed:
+        delay = _rate_limit_delay(exc, now)
+        if delay is None:
+            errored.append(user_id)
+            endpoint_failed = endpoint_failed or _is_endpoint_failure(exc)
+        else:
+            rate_limited[user_id] = delay
+    if rate_limited:
+        # Discourse asked us to slow down: pause the endpoint for as long as
+        # it said, without counting it as the endpoint or the users failing.
+        delay = max(rate_limited.values())
+        pause(endpoint_name, now + delay)
+        metrics.incr("sso.rate_limited.{}".format(endpoint_name))
+        schedule_retries(endpoint_name, list(rate_limited), delay=delay, count=False, now=now)
+    if errored:
+        # A batch counts as one failure of the endpoint, and not at all if
+        # some of it got through: users Discourse rejects only use up their
+        # own attempts.
+        if endpoint_failed and not succeeded:
+            _record_failure(endpoint_name, now)
+        schedule_retries(endpoint_name, errored, now=now)
+
+
+def due_retries(endpoint_name, now=None):
+    now = time.time() if now is None else now
+    key = RETRY_KEY.format(endpoint_name)
+    conn = core.utils.redis_connection()
+    user_ids = conn.zrangebyscore(key, "-inf", now)
+    if user_ids:
+        conn.zrem(key, *user_ids)
+    return [int(user_id) for user_id in user_ids]
+
+
+def dead_letters(endpoint_name):
+    return [
+        int(user_id) for user_id in core.utils.redis_connection().lrange(DEAD_LETTER_KEY.format(endpoint_name), 0, -1)
+    ]
+
+
+def take_dead_letters(endpoint_name):
+    key = DEAD_LETTER_KEY.format(endpoint_name)
+    with core.utils.redis_connection().pipeline() as pipe:
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+        user_ids, _ = pipe.execute()
+    return sorted({int(user_id) for user_id in user_ids})
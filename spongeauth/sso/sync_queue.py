@@ -0,0 +1,167 @@
+import contextlib
+import contextvars
+import functools
+import itertools
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+import django_rq
+
+from core import metrics
+import core.utils
+from . import dispatch, retry
+
+
+DIRTY_KEY = "spongeauth:sso:dirty:{}"
+# Users taken from the dirty set by a drain and not yet synced.
+PROCESSING_KEY = "spongeauth:sso:processing:{}"
+
+
+def sync_endpoints():
+    return [name for name, endpoint in settings.SSO_ENDPOINTS.items() if "sync_sso_endpoint" in endpoint]
+
+
+def batched_ids(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def mark_dirty(user_ids):
+    # Users are added to a set per endpoint rather than each getting a job, so
+    # however often a user changes before the next drain they're synced once.
+    # user_ids may be a lazy iterator: it's consumed in batches.
+    endpoints = sync_endpoints()
+    if not endpoints:
+        return
+
+    conn = core.utils.redis_connection()
+    marked = 0
+    for batch in batched_ids(user_ids, settings.SSO_SYNC_BATCH_SIZE):
+        with conn.pipeline(transaction=False) as pipe:
+            for endpoint in endpoints:
+                pipe.sadd(DIRTY_KEY.format(endpoint), *batch)
+            pipe.execute()
+        marked += len(batch)
+    if not marked:
+        return
+
+    retry.schedule_drain(settings.SSO_SYNC_WINDOW)
+
+
+class Batch:
+    def __init__(self):
+        self.user_ids = set()
+        self.closed = False
+
+    def add(self, user_ids):
+        if self.closed:
+            mark_dirty(user_ids)
+        else:
+            self.user_ids.update(user_ids)
+
+    def flush(self):
+        self.closed = True
+        if self.user_ids:
+            mark_dirty(sorted(self.user_ids))
+
+
+current_batch = contextvars.ContextVar("sso_sync_batch", default=None)
+
+
+@contextlib.contextmanager
+def batched():
+    # Users marked inside this block are marked dirty once, at the end of it.
+    # Nested blocks join the outermost one.
+    batch = current_batch.get()
+    if batch is not None:
+        yield batch
+        return
+    batch = Batch()
+    token = current_batch.set(batch)
+    try:
+        yield batch
+    finally:
+        current_batch.reset(token)
+        batch.flush()
+
+
+def mark_dirty_on_commit(user_ids):
+    # Inside a transaction users are only marked once it commits, so workers
+    # never sync them from data they can't see yet (and nothing is marked if
+    # it rolls back).
+    batch = current_batch.get()
+    add = batch.add if batch is not None else mark_dirty
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(functools.partial(add, list(user_ids)))
+    else:
+        add(user_ids)
+
+
+def pending(endpoint):
+    return core.utils.redis_connection().scard(DIRTY_KEY.format(endpoint))
+
+
+def _take_batch(conn, endpoint):
+    # Each user is moved rather than popped, so if the worker dies mid-batch
+    # they're left in the processing set instead of being lost. Users another
+    # drain moved first are left to it.
+    user_ids = conn.srandmember(DIRTY_KEY.format(endpoint), settings.SSO_SYNC_BATCH_SIZE)
+    if not user_ids:
+        return None
+    with conn.pipeline(transaction=False) as pipe:
+        for user_id in user_ids:
+            pipe.smove(DIRTY_KEY.format(endpoint), PROCESSING_KEY.format(endpoint), user_id)
+        moved = pipe.execute()
+    return [int(user_id) for user_id, ok in zip(user_ids, moved) if ok]
+
+
+def requeue_processing(conn, endpoint):
+    # Anything still being processed when a drain starts was left by a drain
+    # which died; at worst, one still running syncs a user twice.
+    with conn.pipeline() as pipe:
+        pipe.scard(PROCESSING_KEY.format(endpoint))
+        pipe.sunionstore(DIRTY_KEY.format(endpoint), [DIRTY_KEY.format(endpoint), PROCESSING_KEY.format(endpoint)])
+        pipe.delete(PROCESSING_KEY.format(endpoint))
+        requeued, _, _ = pipe.execute()
+    if requeued:
+        metrics.incr("sso.requeued.{}".format(endpoint), requeued)
+    return requeued
+
+
+@django_rq.job
+def drain():
+    conn = core.utils.redis_connection()
+    # Clear the flag first: users marked while this runs get another drain.
+    conn.delete(retry.DRAIN_SCHEDULED_KEY)
+
+    now = time.time()
+    for endpoint in sync_endpoints():
+        key = DIRTY_KEY.format(endpoint)
+        requeue_processing(conn, endpoint)
+        due = retry.due_retries(endpoint, now=now)
+        if due:
+            conn.sadd(key, *due)
+        while True:
+            user_ids = _take_batch(conn, endpoint)
+            if user_ids is None:
+                break
+            if not user_ids:
+                continue
+            dispatch.dispatch(endpoint, user_ids)
+            # only once dispatch has recorded how each of them went
+            conn.srem(PROCESSING_KEY.format(endpoint), *user_ids)
+            metrics.incr("sso.drained.{}".format(endpoint), len(user_ids))
+
+
+def replay_dead_letters(endpoint):
+    user_ids = retry.take_dead_letters(endpoint)
+    if user_ids:
+        core.utils.redis_connection().sadd(DIRTY_KEY.format(endpoint), *user_ids)
+        retry.schedule_drain(settings.SSO_SYNC_WINDOW)
+    return len(user_ids)
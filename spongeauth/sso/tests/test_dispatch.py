@@ -0,0 +1,100 @@
+import io
+import os
+import unittest.mock
+
+from django.core.management import call_command
+
+import fakeredis
+import pytest
+import requests
+
+from accounts.tests.factories import UserFactory
+from core import metrics
+from .. import benchmark, dispatch, utils
+
+
+@pytest.fixture
+def stand_in(settings):
+    with benchmark.StandInServer() as server:
+        settings.SSO_ENDPOINTS = {
+            "discourse": {"sync_sso_endpoint": server.url, "sso_secret": "discourse-sso-secret", "api_key": "key"}
+        }
+        yield server
+
+
+@pytest.fixture
+def conn():
+    conn = fakeredis.FakeStrictRedis()
+    with unittest.mock.patch("core.utils.redis_connection", return_value=conn):
+        yield conn
+
+
+@pytest.mark.django_db
+def test_dispatch_reuses_connections(stand_in, conn):
+    users = UserFactory.create_batch(10)
+    user_ids = [user.pk for user in users]
+
+    result = dispatch.dispatch("discourse", user_ids, concurrency=3)
+
+    assert result == dispatch.Result(sent=10, skipped=0, failed=0, deferred=0)
+    assert stand_in.connections <= 3
+    assert metrics.get_all("sso.") == {"sso.ping.discourse": 10}
+
+    # everything is now in sync
+    assert dispatch.dispatch("discourse", user_ids) == dispatch.Result(sent=0, skipped=10, failed=0, deferred=0)
+
+
+@pytest.mark.django_db
+def test_dispatch_failure_doesnt_stop_the_rest(stand_in, conn):
+    users = UserFactory.create_batch(3)
+    post_ping = utils.post_ping
+
+    def _post_ping(ping):
+        if ping.user_id == users[1].pk:
+            raise requests.HTTPError("502")
+        return post_ping(ping)
+
+    with unittest.mock.patch("sso.utils.post_ping", side_effect=_post_ping):
+        result = dispatch.dispatch("discourse", [user.pk for user in users])
+
+    assert result == dispatch.Result(sent=2, skipped=0, failed=1, deferred=0)
+    assert metrics.get_all("sso.ping_failed.") == {"sso.ping_failed.discourse": 1}
+    # only the failed user is sent next time
+    assert dispatch.dispatch("discourse", [user.pk for user in users]) == dispatch.Result(
+        sent=1, skipped=2, failed=0, deferred=0
+    )
+
+
+@pytest.mark.django_db
+def test_dispatch_times_out_hung_endpoint(stand_in, conn, settings):
+    settings.SSO_SYNC_TIMEOUT = (1, 0.1)
+    stand_in.httpd.latency = 1
+    user = UserFactory.create()
+
+    assert dispatch.dispatch("discourse", [user.pk]) == dispatch.Result(sent=0, skipped=0, failed=1, deferred=0)
+
+
+def test_dispatch_unknown_endpoint(settings):
+    settings.SSO_ENDPOINTS = {"login-only": {"sso_secret": "secret"}}
+    assert dispatch.dispatch("login-only", [1]) == dispatch.Result(0, 0, 0, 0)
+    assert dispatch.dispatch("missing", [1]) == dispatch.Result(0, 0, 0, 0)
+
+
+def test_sessions_are_per_endpoint_and_process():
+    session = utils.get_session("discourse")
+    assert utils.get_session("discourse") is session
+    assert utils.get_session("other") is not session
+
+    with unittest.mock.patch.object(os, "getpid", return_value=-1):
+        assert utils.get_session("discourse") is not session
+
+
+def test_benchmark_command():
+    out = io.StringIO()
+
+    call_command("benchmark_sso_sync", "--requests=6", "--concurrency=2", "--latency=0", stdout=out)
+
+    lines = out.getvalue().splitlines()
+    assert lines[0].startswith("unpooled: 6 requests, 0 failed, 6 connections")
+    assert lines[1].startswith("pooled: 6 requests, 0 failed, 1 connections")
+    assert lines[2].startswith("pooled x2: 6 requests, 0 failed, ")
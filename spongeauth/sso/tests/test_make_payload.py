@@ -99,3 +99,17 @@ class TestMakePayload:
             "add_groups": ",".join(sorted([group1_in.internal_name, group2_in.internal_name])),
             "remove_groups": ",".join(sorted([group1_not_in.internal_name, group2_not_in.internal_name])),
         }
+
+    def test_resolves_groups_in_one_query(self, django_assert_num_queries):
+        user = accounts.tests.factories.UserFactory.create()
+        in_groups = [accounts.tests.factories.GroupFactory.create(internal_only=False) for _ in range(3)]
+        out_groups = [accounts.tests.factories.GroupFactory.create(internal_only=False) for _ in range(3)]
+        user.groups.set(in_groups)
+
+        with django_assert_num_queries(1):
+            payload = utils.make_payload(user, "nonce-nce", exclude_groups=[in_groups[0].pk])
+
+        assert payload["add_groups"] == ",".join(sorted(group.internal_name for group in in_groups[1:]))
+        assert payload["remove_groups"] == ",".join(
+            sorted(group.internal_name for group in [in_groups[0]] + out_groups)
+        )
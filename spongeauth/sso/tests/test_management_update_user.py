@@ -1,11 +1,31 @@
+import datetime
 import io
 import unittest.mock
 
 from django.core.management import call_command, CommandError
+from django.utils import timezone
 
+import fakeredis
 import pytest
-
-from accounts.tests.factories import UserFactory
+import rq
+
+from accounts.tests.factories import GroupFactory, UserFactory
+from .. import backfill
+
+TEST_SSO_ENDPOINTS = {
+    "discourse": {
+        "sync_sso_endpoint": "http://discourse.example.com/admin/users/sync_sso",
+        "sso_secret": "discourse-sso-secret",
+        "api_key": "discourse-api-key",
+    },
+    "other": {
+        "sync_sso_endpoint": "http://other.example.com/admin/users/sync_sso",
+        "sso_secret": "other-sso-secret",
+        "api_key": "other-api-key",
+        "sync_rate": "1",
+    },
+    "login-only": {"sso_secret": "login-only-sso-secret"},
+}
 
 
 @pytest.mark.django_db
@@ -28,24 +48,6 @@ def test_users_missing(settings):
     )
 
 
-@pytest.mark.django_db
-@unittest.mock.patch("sso.management.commands.sso_ping_discourse.send_update_ping")
-def test_no_args(fake_send_ping, settings):
-    out = io.StringIO()
-
-    user1 = UserFactory.create()
-    user2 = UserFactory.create(is_active=False)
-    user3 = UserFactory.create(email_verified=False)
-
-    call_command("sso_ping_discourse", stdout=out)
-
-    assert "{} OK".format(user1.username) in out.getvalue()
-    assert user2.username not in out.getvalue()
-    assert user3.username not in out.getvalue()
-
-    fake_send_ping.assert_called_once_with(user1)
-
-
 @pytest.mark.django_db
 @unittest.mock.patch("sso.management.commands.sso_ping_discourse.send_update_ping")
 def test_happy_path(fake_send_ping, settings):
@@ -54,7 +56,7 @@ def test_happy_path(fake_send_ping, settings):
     user1 = UserFactory.create()
     user2 = UserFactory.create()
 
-    def _fake_send_ping(user):
+    def _fake_send_ping(user, force=False):
         if user == user1:
             return None
         raise ValueError("boo")
@@ -79,3 +81,124 @@ def test_skip_on_email_not_verified(fake_send_ping, settings):
 
     assert "{} SKIP\n".format(user1.username) in out.getvalue()
     assert "{} SKIP\n".format(user2.username) in out.getvalue()
+
+
+@pytest.mark.django_db
+@unittest.mock.patch("sso.management.commands.sso_ping_discourse.send_update_ping")
+def test_force(fake_send_ping, settings):
+    user1 = UserFactory.create()
+
+    call_command("sso_ping_discourse", user1.username, "--force", stdout=io.StringIO())
+
+    fake_send_ping.assert_called_once_with(user1, force=True)
+
+
+@pytest.fixture
+def queue(settings):
+    settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
+    conn = fakeredis.FakeStrictRedis()
+    queue = rq.Queue("default", connection=conn)
+    with unittest.mock.patch("core.utils.redis_connection", return_value=conn), unittest.mock.patch(
+        "django_rq.get_queue", return_value=queue
+    ):
+        yield queue
+
+
+def _queued(queue, endpoint):
+    jobs = queue.get_jobs() + [
+        queue.fetch_job(job_id) for job_id in rq.registry.ScheduledJobRegistry(queue=queue).get_job_ids()
+    ]
+    batches = [job.args[1] for job in jobs if job.args[0] == endpoint]
+    return sorted(user_id for batch in batches for user_id in batch), batches
+
+
+@pytest.mark.django_db
+def test_no_args(queue):
+    users = UserFactory.create_batch(5)
+    UserFactory.create(is_active=False)
+    UserFactory.create(email_verified=False)
+    out = io.StringIO()
+
+    call_command("sso_ping_discourse", "--batch-size=2", "--rate=0", stdout=out)
+
+    user_ids = sorted(user.pk for user in users)
+    for endpoint in ["discourse", "other"]:
+        queued, batches = _queued(queue, endpoint)
+        assert queued == user_ids
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert queue.count == 6
+    assert "Queued 2/5 users" in out.getvalue()
+    assert "Queued 5 users for discourse, other" in out.getvalue()
+    assert queue.get_jobs()[0].kwargs == {"force": False}
+
+
+@pytest.mark.django_db
+def test_honours_endpoint_rate(queue, settings):
+    settings.SSO_SYNC_RATE = 0
+    UserFactory.create_batch(5)
+
+    call_command("sso_ping_discourse", "--batch-size=2", stdout=io.StringIO())
+
+    # discourse has no limit, but other only takes a user a second
+    assert len(_queued(queue, "discourse")[1]) == 3
+    assert [job.args[0] for job in queue.get_jobs()] == ["discourse", "other", "discourse", "discourse"]
+    scheduled = rq.registry.ScheduledJobRegistry(queue=queue)
+    assert len(scheduled) == 2
+
+
+@pytest.mark.django_db
+def test_filters(queue):
+    group = GroupFactory.create(internal_name="staff")
+    member, recent, _ = UserFactory.create_batch(3)
+    member.groups.add(group)
+    recent.last_login = timezone.now()
+    recent.save()
+    old = timezone.now() - datetime.timedelta(days=30)
+    type(member).objects.exclude(pk=recent.pk).update(joined_at=old)
+
+    call_command("sso_ping_discourse", "--group=staff", "--endpoint=discourse", "--rate=0", stdout=io.StringIO())
+    assert _queued(queue, "discourse")[0] == [member.pk]
+    assert _queued(queue, "other")[0] == []
+
+    queue.connection.flushdb()
+    since = (timezone.now() - datetime.timedelta(days=1)).date().isoformat()
+    call_command("sso_ping_discourse", "--since", since, "--rate=0", stdout=io.StringIO())
+    assert _queued(queue, "discourse")[0] == [recent.pk]
+
+
+@pytest.mark.django_db
+def test_bad_filters(queue):
+    with pytest.raises(CommandError, match="Unknown sync endpoints: login-only"):
+        call_command("sso_ping_discourse", "--endpoint=login-only")
+    with pytest.raises(CommandError, match="Unknown groups: nope"):
+        call_command("sso_ping_discourse", "--group=nope")
+    with pytest.raises(CommandError, match="Invalid --since"):
+        call_command("sso_ping_discourse", "--since=yesterday")
+    with pytest.raises(CommandError, match="can't be used with usernames"):
+        call_command("sso_ping_discourse", "someone", "--endpoint=discourse")
+
+
+@pytest.mark.django_db
+def test_resumes_after_failure(queue):
+    users = UserFactory.create_batch(5)
+    user_ids = sorted(user.pk for user in users)
+    enqueue_batch = backfill._enqueue_batch
+
+    def _enqueue_batch(queue, endpoints, user_ids, *args):
+        if user_ids[0] == users[2].pk:
+            raise RuntimeError("boom")
+        return enqueue_batch(queue, endpoints, user_ids, *args)
+
+    with unittest.mock.patch("sso.backfill._enqueue_batch", side_effect=_enqueue_batch):
+        with pytest.raises(CommandError) as exc:
+            call_command("sso_ping_discourse", "--batch-size=2", "--rate=0", stdout=io.StringIO())
+    assert "failed after user {}".format(user_ids[1]) in str(exc.value)
+    assert _queued(queue, "discourse")[0] == user_ids[:2]
+
+    out = io.StringIO()
+    call_command("sso_ping_discourse", "--batch-size=2", "--rate=0", stdout=out)
+    assert "Resuming after user {}".format(user_ids[1]) in out.getvalue()
+    assert _queued(queue, "discourse")[0] == user_ids
+
+    # finished, so the next run starts from the beginning
+    assert backfill.get_checkpoint(None, [], ["discourse", "other"]) is None
@@ -0,0 +1,52 @@
+import unittest.mock
+
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from asgiref.sync import async_to_sync, sync_to_async
+
+from .. import sync_queue
+from ..middleware import BatchSSOSync
+
+
+def _view(request):
+    sync_queue.mark_dirty_on_commit([2])
+    sync_queue.mark_dirty_on_commit([1, 2])
+    return HttpResponse()
+
+
+@unittest.mock.patch("sso.sync_queue.mark_dirty")
+def test_marks_once_per_request(mock_mark_dirty):
+    middleware = BatchSSOSync(_view)
+
+    middleware(RequestFactory().get("/"))
+
+    mock_mark_dirty.assert_called_once_with([1, 2])
+
+
+@unittest.mock.patch("sso.sync_queue.mark_dirty")
+def test_marks_once_per_async_request(mock_mark_dirty):
+    async def _async_view(request):
+        return await sync_to_async(_view)(request)
+
+    middleware = BatchSSOSync(_async_view)
+
+    async_to_sync(middleware)(RequestFactory().get("/"))
+
+    mock_mark_dirty.assert_called_once_with([1, 2])
+
+
+@unittest.mock.patch("sso.sync_queue.mark_dirty")
+def test_marks_even_if_the_view_fails(mock_mark_dirty):
+    def _failing_view(request):
+        sync_queue.mark_dirty_on_commit([1])
+        raise RuntimeError("boom")
+
+    middleware = BatchSSOSync(_failing_view)
+
+    try:
+        middleware(RequestFactory().get("/"))
+    except RuntimeError:
+        pass
+
+    mock_mark_dirty.assert_called_once_with([1])
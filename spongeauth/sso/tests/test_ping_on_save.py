@@ -1,9 +1,14 @@
 import unittest.mock
 
+import django.shortcuts
+
 import faker
 import pytest
+import requests
 
 from accounts.tests.factories import UserFactory, GroupFactory, AvatarFactory
+import accounts.signals
+import accounts.models
 import sso.models
 
 TEST_SSO_ENDPOINTS = {
@@ -15,105 +20,206 @@ TEST_SSO_ENDPOINTS = {
 }
 
 
-@unittest.mock.patch("sso.models.send_update_ping")
-def test_no_ping_by_default_test(fake_send_update_ping):
+@unittest.mock.patch("sso.models.mark_dirty_on_commit")
+def test_no_ping_by_default_test(fake_mark_dirty):
     assert not sso.models._can_ping()
 
     sso.models.on_user_save(None)
-    fake_send_update_ping.assert_not_called()
+    fake_mark_dirty.assert_not_called()
 
     sso.models.on_avatar_save(None)
-    fake_send_update_ping.assert_not_called()
+    fake_mark_dirty.assert_not_called()
 
 
-@unittest.mock.patch("sso.models.send_update_ping")
+@unittest.mock.patch("sso.models.mark_dirty_on_commit")
 @pytest.mark.django_db
-def test_pings_on_user_save(fake_send_update_ping, settings):
+def test_pings_on_user_save(fake_mark_dirty, settings):
     settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
 
     user = UserFactory.build()
-    fake_send_update_ping.assert_not_called()
+    fake_mark_dirty.assert_not_called()
 
     user.save()
-    fake_send_update_ping.assert_called_once_with(user)
+    fake_mark_dirty.assert_called_once_with([user.pk])
 
 
-@unittest.mock.patch("sso.models.send_update_ping")
+@unittest.mock.patch("sso.models.mark_dirty_on_commit")
 @pytest.mark.django_db
-def test_pings_on_group_save_forward(fake_send_update_ping, settings):
+def test_pings_on_group_save_forward(fake_mark_dirty, settings):
     user = UserFactory.create()
     group = GroupFactory.create()
     settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
-    fake_send_update_ping.assert_not_called()
+    fake_mark_dirty.assert_not_called()
 
     user.groups.add(group)
-    fake_send_update_ping.assert_called_once_with(user)
+    fake_mark_dirty.assert_called_once_with([user.pk])
 
 
-@unittest.mock.patch("sso.models.send_update_ping")
+@unittest.mock.patch("sso.models.mark_dirty_on_commit")
 @pytest.mark.django_db
-def test_pings_on_group_save(fake_send_update_ping, settings):
+def test_pings_on_group_save(fake_mark_dirty, settings):
     user = UserFactory.create()
     group = GroupFactory.create()
     settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
-    fake_send_update_ping.assert_not_called()
+    fake_mark_dirty.assert_not_called()
 
     group.user_set.add(user)
-    fake_send_update_ping.assert_called_once_with(user)
+    fake_mark_dirty.assert_called_once_with({user.pk})
 
 
-@unittest.mock.patch("sso.models.send_update_ping")
+@unittest.mock.patch("sso.models.mark_dirty_on_commit")
 @pytest.mark.django_db
-def test_pings_on_group_clear_forward(fake_send_update_ping, settings):
+def test_pings_on_groups_resynced(fake_mark_dirty, settings):
+    user = UserFactory.create()
+    settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
+    fake_mark_dirty.assert_not_called()
+
+    accounts.signals.groups_resynced.send(sender=accounts.models.User, user=user)
+    fake_mark_dirty.assert_called_once_with([user.pk])
+
+
+@unittest.mock.patch("sso.models.mark_dirty_on_commit")
+@pytest.mark.django_db
+def test_pings_on_users_created(fake_mark_dirty, settings):
+    users = UserFactory.create_batch(2)
+    settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
+    fake_mark_dirty.assert_not_called()
+
+    accounts.signals.users_created.send(sender=accounts.models.User, users=users)
+    fake_mark_dirty.assert_called_once_with([user.pk for user in users])
+
+
+@unittest.mock.patch("sso.models.mark_dirty_on_commit")
+@pytest.mark.django_db
+def test_pings_on_group_clear_forward(fake_mark_dirty, settings):
     user = UserFactory.create()
     group = GroupFactory.create()
     user.groups.set([group])
     settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
-    fake_send_update_ping.assert_not_called()
+    fake_mark_dirty.assert_not_called()
 
     user.groups.clear()
-    assert list(fake_send_update_ping.call_args[1]["exclude_groups"]) == [group.id]
+    fake_mark_dirty.assert_called_once_with([user.pk])
 
 
-@unittest.mock.patch("sso.models.send_update_ping")
+@unittest.mock.patch("sso.models.mark_dirty_on_commit")
 @pytest.mark.django_db
-def test_pings_on_group_clear(fake_send_update_ping, settings):
+def test_pings_on_group_clear(fake_mark_dirty, settings):
     user = UserFactory.create()
     group = GroupFactory.create()
     group.user_set.set([user])
     settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
-    fake_send_update_ping.assert_not_called()
+    fake_mark_dirty.assert_not_called()
+
+    marked = []
+    fake_mark_dirty.side_effect = marked.extend
 
     group.user_set.clear()
-    fake_send_update_ping.assert_called_once_with(user, exclude_groups=[group.id])
+    fake_mark_dirty.assert_called_once()
+    assert marked == [user.pk]
 
 
-@unittest.mock.patch("sso.models.send_update_ping")
+@unittest.mock.patch("sso.models.mark_dirty_on_commit")
 @pytest.mark.django_db
-def test_no_pings_on_avatar_save_not_current(fake_send_update_ping, settings):
+def test_pings_on_group_clear_in_chunks(fake_mark_dirty, settings):
+    users = UserFactory.create_batch(5)
+    group = GroupFactory.create()
+    group.user_set.set(users)
+    settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
+    settings.SSO_SYNC_BATCH_SIZE = 2
+
+    group.user_set.clear()
+    chunks = [call.args[0] for call in fake_mark_dirty.call_args_list]
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert sorted(sum(chunks, [])) == sorted(user.pk for user in users)
+
+
+@unittest.mock.patch("sso.models.mark_dirty_on_commit")
+@pytest.mark.django_db
+def test_no_pings_on_avatar_save_not_current(fake_mark_dirty, settings):
     settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
 
     user = UserFactory.create()
-    fake_send_update_ping.reset_mock()
+    fake_mark_dirty.reset_mock()
 
     avatar = AvatarFactory.build(user=user)
-    fake_send_update_ping.assert_not_called()
+    fake_mark_dirty.assert_not_called()
 
     avatar.save()
-    fake_send_update_ping.assert_not_called()
+    fake_mark_dirty.assert_not_called()
 
 
-@unittest.mock.patch("sso.models.send_update_ping")
+@unittest.mock.patch("sso.models.mark_dirty_on_commit")
 @pytest.mark.django_db
-def test_pings_on_avatar_save_current(fake_send_update_ping, settings):
+def test_pings_on_avatar_save_current(fake_mark_dirty, settings):
     settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
 
     user = UserFactory.create()
     avatar = AvatarFactory.create(user=user)
     user.current_avatar = avatar
     user.save()
-    fake_send_update_ping.reset_mock()
+    fake_mark_dirty.reset_mock()
 
     avatar.remote_url = faker.Faker().image_url()
     avatar.save()
-    fake_send_update_ping.assert_called_once_with(user)
+    fake_mark_dirty.assert_called_once_with([user.pk])
+
+
+@unittest.mock.patch("sso.models.mark_dirty_on_commit")
+@pytest.mark.django_db
+def test_pings_only_when_synced_fields_change(fake_mark_dirty, settings):
+    user = UserFactory.create()
+    settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
+
+    user.twofa_enabled = True
+    user.set_password("another secret")
+    user.save()
+    fake_mark_dirty.assert_not_called()
+
+    user.email = "new@example.com"
+    user.save()
+    fake_mark_dirty.assert_called_once_with([user.pk])
+
+    # and the saved value becomes the new baseline
+    user.save()
+    fake_mark_dirty.assert_called_once_with([user.pk])
+
+
+@unittest.mock.patch("sso.models.mark_dirty_on_commit")
+@pytest.mark.django_db
+def test_no_ping_for_unsynced_update_fields(fake_mark_dirty, settings):
+    user = UserFactory.create()
+    settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
+
+    user.username = "changed"
+    user.save(update_fields=["last_login"])
+    fake_mark_dirty.assert_not_called()
+
+
+@unittest.mock.patch("sso.models.mark_dirty_on_commit")
+@pytest.mark.django_db
+def test_pings_when_saving_deferred_user(fake_mark_dirty, settings):
+    user = UserFactory.create()
+    settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
+
+    deferred = accounts.models.User.objects.only("pk", "username").get(pk=user.pk)
+    deferred.username = "changed"
+    deferred.save(update_fields=["username"])
+    fake_mark_dirty.assert_called_once_with([user.pk])
+
+
+@unittest.mock.patch.object(requests.Session, "post")
+@unittest.mock.patch("sso.models.mark_dirty_on_commit")
+@pytest.mark.django_db
+def test_no_ping_on_login(fake_mark_dirty, fake_send_post, settings, client):
+    user = UserFactory.create()
+    user.groups.set(accounts.models.TermsOfService.objects.values_list("group", flat=True))
+    settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
+
+    resp = client.post(django.shortcuts.reverse("accounts:login"), {"username": user.username, "password": "secret"})
+
+    assert resp.status_code == 302
+    user.refresh_from_db()
+    assert user.last_login is not None
+    fake_mark_dirty.assert_not_called()
+    fake_send_post.assert_not_called()
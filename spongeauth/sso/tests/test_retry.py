@@ -0,0 +1,160 @@
+import io
+import time
+import unittest.mock
+
+from django.core.management import call_command
+
+import fakeredis
+import pytest
+import requests
+
+from accounts.tests.factories import UserFactory
+from core import metrics
+from .. import dispatch, retry, sync_queue
+
+TEST_SSO_ENDPOINTS = {
+    "discourse": {
+        "sync_sso_endpoint": "http://discourse.example.com/admin/users/sync_sso",
+        "sso_secret": "discourse-sso-secret",
+        "api_key": "discourse-api-key",
+    }
+}
+
+
+@pytest.fixture
+def conn(settings):
+    settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
+    settings.SSO_BREAKER_THRESHOLD = 3
+    settings.SSO_RETRY_MAX_ATTEMPTS = 2
+    conn = fakeredis.FakeStrictRedis()
+    with unittest.mock.patch("core.utils.redis_connection", return_value=conn), unittest.mock.patch(
+        "django_rq.get_queue"
+    ):
+        yield conn
+
+
+def _error(status, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    return requests.HTTPError(str(status), response=response)
+
+
+def test_backoff_grows_with_jitter(settings):
+    settings.SSO_RETRY_BASE_DELAY = 10
+    settings.SSO_RETRY_MAX_DELAY = 60
+    assert 5 <= retry.backoff(1) <= 10
+    assert 20 <= retry.backoff(3) <= 40
+    assert 30 <= retry.backoff(10) <= 60
+
+
+def test_parse_retry_after():
+    assert retry.parse_retry_after("120") == 120
+    assert retry.parse_retry_after("Wed, 21 Oct 2026 07:28:00 GMT", now=1792567650) == 30
+    assert retry.parse_retry_after("soon") is None
+    assert retry.parse_retry_after(None) is None
+
+
+def test_breaker_opens_and_probes(conn, settings):
+    settings.SSO_BREAKER_COOLDOWN = 30
+    now = 1000
+    retry.record_results("discourse", [], [(1, _error(502)), (2, _error(502))], now=now)
+    retry.record_results("discourse", [], [(1, requests.ConnectionError("refused"))], now=now)
+    assert retry.breaker_state("discourse", now=now) == retry.CLOSED
+
+    retry.record_results("discourse", [], [(3, _error(502))], now=now)
+    assert retry.breaker_state("discourse", now=now + 29) == retry.OPEN
+    assert retry.breaker_state("discourse", now=now + 30) == retry.HALF_OPEN
+
+    # a failed probe pauses for twice as long
+    retry.record_results("discourse", [], [(3, _error(502))], now=now + 30)
+    assert retry.breaker_state("discourse", now=now + 89) == retry.OPEN
+    assert retry.breaker_state("discourse", now=now + 90) == retry.HALF_OPEN
+
+    retry.record_results("discourse", [3], [], now=now + 90)
+    assert retry.breaker_state("discourse", now=now + 90) == retry.CLOSED
+
+
+def test_rejected_users_dont_open_breaker(conn):
+    now = 1000
+    rejected = [(user_id, _error(422)) for user_id in range(1, 6)]
+    for _ in range(3):
+        retry.record_results("discourse", list(range(6, 501)), rejected, now=now)
+        retry.record_results("discourse", [], rejected, now=now)
+    # nor do server errors in a batch which partly got through
+    for user_id in range(7, 10):
+        retry.record_results("discourse", [6], [(user_id, _error(502))], now=now)
+
+    assert retry.breaker_state("discourse", now=now) == retry.CLOSED
+    assert set(retry.dead_letters("discourse")) == {1, 2, 3, 4, 5}
+
+
+def test_rate_limited_pauses_without_failing(conn):
+    now = 1000
+    retry.record_results("discourse", [], [(1, _error(429, {"Retry-After": "120"}))], now=now)
+
+    assert retry.breaker_state("discourse", now=now + 119) == retry.OPEN
+    assert retry.breaker_state("discourse", now=now + 120) == retry.CLOSED
+    assert retry.due_retries("discourse", now=now + 119) == []
+    assert retry.due_retries("discourse", now=now + 120) == [1]
+    assert metrics.get_all("sso.rate_limited.") == {"sso.rate_limited.discourse": 1}
+
+
+def test_dead_letters_after_max_attempts(conn):
+    for _ in range(3):
+        retry.schedule_retries("discourse", [1, 2])
+    retry.record_results("discourse", [2], [])
+    retry.schedule_retries("discourse", [2])
+
+    assert retry.dead_letters("discourse") == [1, 2]
+    assert metrics.get_all("sso.dead_lettered.") == {"sso.dead_lettered.discourse": 2}
+
+    out = io.StringIO()
+    call_command("sso_dead_letters", stdout=out)
+    assert out.getvalue() == "discourse: 2 dead-lettered users, circuit closed\n"
+
+    out = io.StringIO()
+    call_command("sso_dead_letters", "--replay", stdout=out)
+    assert out.getvalue() == "discourse: replaying 2 users\n"
+    assert retry.dead_letters("discourse") == []
+    assert sync_queue.pending("discourse") == 2
+
+
+@pytest.mark.django_db
+def test_dispatch_stops_hammering_a_dead_endpoint(conn, settings):
+    settings.SSO_BREAKER_THRESHOLD = 1
+    users = UserFactory.create_batch(5)
+    user_ids = [user.pk for user in users]
+
+    with unittest.mock.patch("sso.utils.post_ping", side_effect=_error(502)) as post_ping:
+        result = dispatch.dispatch("discourse", user_ids, concurrency=1)
+        assert result == dispatch.Result(sent=0, skipped=0, failed=5, deferred=0)
+        assert retry.breaker_state("discourse") == retry.OPEN
+
+        result = dispatch.dispatch("discourse", user_ids)
+        assert result == dispatch.Result(sent=0, skipped=0, failed=0, deferred=5)
+        assert post_ping.call_count == 5
+
+    # once the pause is over a single request probes the endpoint
+    conn.hset(retry.BREAKER_KEY.format("discourse"), "open_until", time.time())
+    with unittest.mock.patch("sso.utils.post_ping", side_effect=_error(502)) as post_ping:
+        result = dispatch.dispatch("discourse", user_ids)
+        assert result == dispatch.Result(sent=0, skipped=0, failed=1, deferred=4)
+        assert post_ping.call_count == 1
+
+    conn.hset(retry.BREAKER_KEY.format("discourse"), "open_until", time.time())
+    with unittest.mock.patch("sso.utils.post_ping") as post_ping:
+        result = dispatch.dispatch("discourse", user_ids)
+        assert result == dispatch.Result(sent=5, skipped=0, failed=0, deferred=0)
+    assert retry.breaker_state("discourse") == retry.CLOSED
+
+
+@unittest.mock.patch("sso.dispatch.dispatch")
+def test_drain_picks_up_due_retries(mock_dispatch, conn):
+    retry.schedule_retries("discourse", [1], delay=0)
+    retry.schedule_retries("discourse", [2], delay=60)
+
+    sync_queue.drain()
+
+    mock_dispatch.assert_called_once_with("discourse", [1])
+    assert retry.due_retries("discourse", now=time.time() + 60) == [2]
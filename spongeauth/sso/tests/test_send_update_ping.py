@@ -1,13 +1,15 @@
 import unittest.mock
 
 import django_rq
+import fakeredis
 import pytest
 import requests
 
 from accounts.tests.factories import UserFactory, GroupFactory
 from accounts.models import Group
+from core import metrics
 from .. import discourse_sso
-from ..utils import send_update_ping
+from ..utils import send_update_ping, send_update_ping_to_endpoint
 
 TEST_SSO_ENDPOINTS = {
     "discourse": {
@@ -20,11 +22,10 @@ TEST_SSO_ENDPOINTS = {
 
 @pytest.mark.django_db
 def test_send_update_ping(settings):
-    with unittest.mock.patch.object(
-        discourse_sso, "DiscourseSigner"
-    ) as fake_discourse_signer_cls, unittest.mock.patch.object(requests, "post") as fake_send_post:
-        fake_discourse_signer = fake_discourse_signer_cls.return_value
-        fake_discourse_signer.sign.return_value = ("payload", "signature")
+    with unittest.mock.patch.object(discourse_sso.DiscourseSigner, "sign") as fake_sign, unittest.mock.patch.object(
+        requests.Session, "post"
+    ) as fake_send_post:
+        fake_sign.return_value = ("payload", "signature")
 
         user = UserFactory.create(
             email="foo@example.com",
@@ -52,8 +53,9 @@ def test_send_update_ping(settings):
             "http://discourse.example.com/admin/users/sync_sso",
             headers={"Api-Username": "system", "Api-Key": "discourse-api-key"},
             data={"sso": "payload", "sig": "signature"},
+            timeout=settings.SSO_SYNC_TIMEOUT,
         )
-        fake_discourse_signer.sign.assert_called_once_with(
+        fake_sign.assert_called_once_with(
             {
                 "nonce": str(user.id),
                 "email": "foo@example.com",
@@ -75,11 +77,10 @@ def test_send_update_ping(settings):
 
 @pytest.mark.django_db
 def test_send_update_ping_better(settings):
-    with unittest.mock.patch.object(
-        discourse_sso, "DiscourseSigner"
-    ) as fake_discourse_signer_cls, unittest.mock.patch.object(requests, "post") as fake_send_post:
-        fake_discourse_signer = fake_discourse_signer_cls.return_value
-        fake_discourse_signer.sign.return_value = ("payload", "signature")
+    with unittest.mock.patch.object(discourse_sso.DiscourseSigner, "sign") as fake_sign, unittest.mock.patch.object(
+        requests.Session, "post"
+    ) as fake_send_post:
+        fake_sign.return_value = ("payload", "signature")
 
         excluded_group = GroupFactory.create(internal_only=False, internal_name="1-excluded")
         in_group = GroupFactory.create(internal_only=False, internal_name="2-in")
@@ -107,8 +108,9 @@ def test_send_update_ping_better(settings):
             "http://discourse.example.com/admin/users/sync_sso",
             headers={"Api-Username": "system", "Api-Key": "discourse-api-key"},
             data={"sso": "payload", "sig": "signature"},
+            timeout=settings.SSO_SYNC_TIMEOUT,
         )
-        fake_discourse_signer.sign.assert_called_once_with(
+        fake_sign.assert_called_once_with(
             {
                 "nonce": str(user.id),
                 "email": "foo@example.com",
@@ -129,7 +131,7 @@ def test_send_update_ping_better(settings):
 
         send_update_ping(user)
         django_rq.get_worker().work(burst=True)
-        fake_discourse_signer.sign.assert_called_with(
+        fake_sign.assert_called_with(
             {
                 "nonce": str(user.id),
                 "email": "foo@example.com",
@@ -147,3 +149,59 @@ def test_send_update_ping_better(settings):
                 "remove_groups": "3-not-in",
             }
         )
+
+
+@pytest.mark.django_db
+def test_send_update_ping_counts_failures(settings):
+    settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
+    user = UserFactory.create()
+    conn = fakeredis.FakeStrictRedis()
+    with unittest.mock.patch.object(requests.Session, "post") as fake_send_post, unittest.mock.patch(
+        "core.utils.redis_connection", return_value=conn
+    ):
+        fake_send_post.return_value.raise_for_status.side_effect = requests.HTTPError("502")
+        send_update_ping_to_endpoint(user.id, "discourse", [])
+
+        assert metrics.get_all("sso.") == {
+            "sso.ping.discourse": 1,
+            "sso.ping_failed.discourse": 1,
+            "sso.retry_scheduled.discourse": 1,
+        }
+
+
+@pytest.mark.django_db
+def test_send_update_ping_skips_unchanged_payload(settings):
+    settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
+    user = UserFactory.create()
+    conn = fakeredis.FakeStrictRedis()
+    with unittest.mock.patch.object(requests.Session, "post") as fake_send_post, unittest.mock.patch(
+        "core.utils.redis_connection", return_value=conn
+    ):
+        send_update_ping_to_endpoint(user.id, "discourse", [])
+        send_update_ping_to_endpoint(user.id, "discourse", [])
+        assert fake_send_post.call_count == 1
+        assert metrics.get_all("sso.") == {"sso.ping.discourse": 1, "sso.ping_skipped.discourse": 1}
+
+        send_update_ping_to_endpoint(user.id, "discourse", [], force=True)
+        assert fake_send_post.call_count == 2
+
+        user.full_name = "Someone Else"
+        user.save()
+        send_update_ping_to_endpoint(user.id, "discourse", [])
+        assert fake_send_post.call_count == 3
+
+
+@pytest.mark.django_db
+def test_send_update_ping_failure_isnt_recorded(settings):
+    settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
+    user = UserFactory.create()
+    conn = fakeredis.FakeStrictRedis()
+    with unittest.mock.patch.object(requests.Session, "post") as fake_send_post, unittest.mock.patch(
+        "core.utils.redis_connection", return_value=conn
+    ):
+        fake_send_post.return_value.raise_for_status.side_effect = requests.HTTPError("502")
+        send_update_ping_to_endpoint(user.id, "discourse", [])
+
+        fake_send_post.return_value.raise_for_status.side_effect = None
+        send_update_ping_to_endpoint(user.id, "discourse", [])
+        assert fake_send_post.call_count == 2
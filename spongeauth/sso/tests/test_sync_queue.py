@@ -0,0 +1,152 @@
+import unittest.mock
+
+from django.db import transaction
+
+import fakeredis
+import pytest
+
+from .. import sync_queue
+
+TEST_SSO_ENDPOINTS = {
+    "discourse": {
+        "sync_sso_endpoint": "http://discourse.example.com/admin/users/sync_sso",
+        "sso_secret": "discourse-sso-secret",
+        "api_key": "discourse-api-key",
+    },
+    "other": {
+        "sync_sso_endpoint": "http://other.example.com/admin/users/sync_sso",
+        "sso_secret": "other-sso-secret",
+        "api_key": "other-api-key",
+    },
+    "login-only": {"sso_secret": "login-only-sso-secret"},
+}
+
+
+@pytest.fixture
+def conn(settings):
+    settings.SSO_ENDPOINTS = TEST_SSO_ENDPOINTS
+    conn = fakeredis.FakeStrictRedis()
+    with unittest.mock.patch("core.utils.redis_connection", return_value=conn):
+        yield conn
+
+
+@pytest.fixture
+def mock_get_queue():
+    with unittest.mock.patch("django_rq.get_queue") as mock_get_queue:
+        yield mock_get_queue
+
+
+def test_coalesces_repeated_changes(conn, mock_get_queue):
+    for _ in range(5):
+        sync_queue.mark_dirty([1])
+    sync_queue.mark_dirty([1, 2])
+
+    assert sync_queue.pending("discourse") == 2
+    assert sync_queue.pending("other") == 2
+    assert sync_queue.pending("login-only") == 0
+    mock_get_queue.return_value.enqueue_in.assert_called_once()
+
+
+def test_consumes_iterators_in_batches(conn, mock_get_queue, settings):
+    settings.SSO_SYNC_BATCH_SIZE = 2
+    sync_queue.mark_dirty(iter(range(1, 6)))
+    assert sync_queue.pending("discourse") == 5
+
+
+def test_nothing_to_mark(conn, mock_get_queue):
+    sync_queue.mark_dirty(iter([]))
+    mock_get_queue.return_value.enqueue_in.assert_not_called()
+
+
+def test_no_sync_endpoints(conn, mock_get_queue, settings):
+    settings.SSO_ENDPOINTS = {"login-only": {"sso_secret": "login-only-sso-secret"}}
+    sync_queue.mark_dirty([1])
+    mock_get_queue.assert_not_called()
+
+
+@unittest.mock.patch("sso.dispatch.dispatch")
+def test_drain_syncs_each_user_once(mock_dispatch, conn, mock_get_queue, settings):
+    settings.SSO_SYNC_BATCH_SIZE = 2
+    sync_queue.mark_dirty([1, 2, 3, 1, 2])
+
+    sync_queue.drain()
+
+    calls = [call.args for call in mock_dispatch.call_args_list]
+    for endpoint in ["discourse", "other"]:
+        batches = [user_ids for name, user_ids in calls if name == endpoint]
+        assert all(len(batch) <= 2 for batch in batches)
+        assert sorted(sum(batches, [])) == [1, 2, 3]
+    assert sync_queue.pending("discourse") == 0
+    assert sync_queue.pending("other") == 0
+
+    # once drained, the next change schedules another drain
+    sync_queue.mark_dirty([1])
+    assert mock_get_queue.return_value.enqueue_in.call_count == 2
+
+
+def test_drain_requeues_users_left_by_a_crash(conn, mock_get_queue, settings):
+    settings.SSO_SYNC_BATCH_SIZE = 2
+    sync_queue.mark_dirty([1, 2, 3])
+
+    with unittest.mock.patch("sso.dispatch.dispatch", side_effect=[None, RuntimeError("worker died")]) as mock_dispatch:
+        with pytest.raises(RuntimeError):
+            sync_queue.drain()
+    synced = set(mock_dispatch.call_args_list[0].args[1])
+    left = conn.smembers(sync_queue.PROCESSING_KEY.format("discourse"))
+    assert {int(user_id) for user_id in left} == {1, 2, 3} - synced
+
+    with unittest.mock.patch("sso.dispatch.dispatch") as mock_dispatch:
+        sync_queue.drain()
+    calls = [call.args for call in mock_dispatch.call_args_list]
+    assert [user_ids for name, user_ids in calls if name == "discourse"] == [[int(user_id) for user_id in left]]
+    assert conn.scard(sync_queue.PROCESSING_KEY.format("discourse")) == 0
+    assert sync_queue.pending("discourse") == 0
+
+
+def test_batched_marks_once(conn, mock_get_queue):
+    with unittest.mock.patch("sso.sync_queue.mark_dirty", wraps=sync_queue.mark_dirty) as mock_mark_dirty:
+        with sync_queue.batched():
+            sync_queue.mark_dirty_on_commit([2])
+            with sync_queue.batched():
+                sync_queue.mark_dirty_on_commit(iter([1, 2]))
+            assert sync_queue.pending("discourse") == 0
+
+    mock_mark_dirty.assert_called_once_with([1, 2])
+    assert sync_queue.pending("discourse") == 2
+
+
+@pytest.mark.django_db
+def test_marks_on_commit(conn, mock_get_queue, django_capture_on_commit_callbacks):
+    with unittest.mock.patch("sso.sync_queue.mark_dirty", wraps=sync_queue.mark_dirty) as mock_mark_dirty:
+        with sync_queue.batched() as batch:
+            with django_capture_on_commit_callbacks(execute=True) as callbacks:
+                with transaction.atomic():
+                    sync_queue.mark_dirty_on_commit([1])
+                    sync_queue.mark_dirty_on_commit([1])
+                    assert batch.user_ids == set()
+            # committed, but only collected until the batch closes
+            assert len(callbacks) == 2
+            assert batch.user_ids == {1}
+            mock_mark_dirty.assert_not_called()
+
+    mock_mark_dirty.assert_called_once_with([1])
+    assert sync_queue.pending("discourse") == 1
+
+
+@pytest.mark.django_db
+def test_marks_nothing_on_rollback(conn, mock_get_queue, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        with sync_queue.batched():
+            with pytest.raises(RuntimeError):
+                with transaction.atomic():
+                    sync_queue.mark_dirty_on_commit([1])
+                    raise RuntimeError("roll back")
+    assert callbacks == []
+    assert sync_queue.pending("discourse") == 0
+
+
+def test_marks_after_batch_closed(conn, mock_get_queue):
+    with sync_queue.batched() as batch:
+        pass
+    batch.add([1])
+    assert sync_queue.pending("discourse") == 1
@@ -4,10 +4,12 @@ import unittest.mock
 import django.test
 import django.shortcuts
 
+import fakeredis
 import pytest
 
 import accounts.tests.factories
-from .. import discourse_sso
+from core import metrics
+from .. import discourse_sso, utils
 
 SSO_ENDPOINTS = {"foo": {"sso_secret": "foo1"}, "bar": {"sso_secret": "slartibartfast"}}
 
@@ -74,3 +76,41 @@ class TestBegin(django.test.TestCase):
 
         reresp = self.client.get(self.path({"sso": params["sso"][0], "sig": params["sig"][0]}))
         assert reresp.status_code == 403
+
+    def test_hint_verifies_against_one_endpoint(self):
+        sso, sig = self.signer.sign({"nonce": "123456", "return_sso_url": "/hi/i/am/sso"})
+        with unittest.mock.patch.object(
+            discourse_sso.DiscourseSigner, "_sign", autospec=True, side_effect=discourse_sso.DiscourseSigner._sign
+        ) as mock_sign:
+            resp = self.client.get(self.path({"sso": sso, "sig": sig, "endpoint": "bar"}))
+        assert resp.status_code == 302
+        # one to verify the request, one to sign the response
+        assert mock_sign.call_count == 2
+
+    def test_wrong_hint_still_verifies(self):
+        sso, sig = self.signer.sign({"nonce": "123456", "return_sso_url": "/hi/i/am/sso"})
+        resp = self.client.get(self.path({"sso": sso, "sig": sig, "endpoint": "foo"}))
+        assert resp.status_code == 302
+
+    def test_counts_requests_per_endpoint(self):
+        sso, sig = self.signer.sign({"nonce": "123456", "return_sso_url": "/hi/i/am/sso"})
+        with unittest.mock.patch("core.utils.redis_connection", return_value=fakeredis.FakeStrictRedis()):
+            self.client.get(self.path({"sso": sso, "sig": sig}))
+            self.client.get(self.path({"sso": sso, "sig": "nope", "endpoint": "foo"}))
+            self.client.get(self.path({"sso": sso, "sig": "nope"}))
+            assert metrics.get_all("sso.") == {
+                "sso.begin.bar": 1,
+                "sso.begin_failed.foo": 1,
+                "sso.begin_failed.unknown": 1,
+            }
+
+
+def test_signers_rebuilt_when_endpoints_change(settings):
+    settings.SSO_ENDPOINTS = SSO_ENDPOINTS
+    signers = utils.get_signers()
+    assert set(signers) == {"foo", "bar"}
+    assert utils.get_signers()["bar"] is signers["bar"]
+
+    settings.SSO_ENDPOINTS = {"bar": {"sso_secret": "slartibartfast"}}
+    assert set(utils.get_signers()) == {"bar"}
+    assert utils.get_signers()["bar"] is not signers["bar"]
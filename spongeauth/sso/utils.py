@@ -1,11 +1,71 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import threading
+
 from django.conf import settings
-from django.db.models import Q
+from django.db.models import Exists, OuterRef
 
 import django_rq
+import redis.exceptions
 import requests
+import requests.adapters
 
 from accounts.models import Group, User
-from . import discourse_sso
+from core import metrics
+import core.utils
+from . import discourse_sso, retry
+
+
+logger = logging.getLogger(__name__)
+
+# Hash of user id to the digest of the last payload Discourse accepted.
+DIGEST_KEY = "spongeauth:sso:digest:{}"
+
+# (SSO_ENDPOINTS, {endpoint name: signer}), rebuilt if the setting changes.
+_signers = None
+
+
+def get_signers():
+    global _signers
+    endpoints = settings.SSO_ENDPOINTS
+    if _signers is None or _signers[0] is not endpoints:
+        signers = {name: discourse_sso.DiscourseSigner(endpoint["sso_secret"]) for name, endpoint in endpoints.items()}
+        _signers = (endpoints, signers)
+    return _signers[1]
+
+
+def unsign(raw_payload, raw_signature, hint=None):
+    signers = get_signers()
+    # Try the hinted endpoint first, so a hinted request usually costs one
+    # HMAC however many endpoints there are.
+    names = sorted(signers, key=lambda name: name != hint)
+    for name in names:
+        try:
+            return name, signers[name], signers[name].unsign(raw_payload, raw_signature)
+        except discourse_sso.SignatureError:
+            pass
+    raise discourse_sso.SignatureError("no endpoint accepted the signature")
+
+
+# The User fields make_payload reads: saves which don't change any of them
+# have nothing to tell Discourse.
+SYNCED_USER_FIELDS = frozenset(
+    [
+        "email",
+        "email_verified",
+        "username",
+        "full_name",
+        "mc_username",
+        "irc_nick",
+        "gh_username",
+        "discord_id",
+        "is_admin",
+        "is_staff",
+    ]
+)
 
 
 def _cast_bool(b):
@@ -14,10 +74,20 @@ def _cast_bool(b):
 
 def make_payload(user, nonce, exclude_groups=None):
     exclude_groups = set(exclude_groups or [])
-    relevant_groups = Group.objects.filter(internal_only=False).order_by("internal_name")
-    filter_q = Q(user=user) & ~Q(pk__in=exclude_groups)
-    add_groups = relevant_groups.filter(filter_q).values_list("internal_name", flat=True)
-    remove_groups = relevant_groups.exclude(filter_q).values_list("internal_name", flat=True)
+    # One query for both lists: every public group, flagged with whether the
+    # user is in it.
+    relevant_groups = (
+        Group.objects.filter(internal_only=False)
+        .annotate(is_member=Exists(User.groups.through.objects.filter(group=OuterRef("pk"), user=user.pk)))
+        .order_by("internal_name")
+        .values_list("pk", "internal_name", "is_member")
+    )
+    add_groups, remove_groups = [], []
+    for pk, internal_name, is_member in relevant_groups:
+        if is_member and pk not in exclude_groups:
+            add_groups.append(internal_name)
+        else:
+            remove_groups.append(internal_name)
     payload = {
         "nonce": nonce,
         "email": user.email,
@@ -37,8 +107,82 @@ def make_payload(user, nonce, exclude_groups=None):
     return payload
 
 
+def payload_digest(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf8")).hexdigest()
+
+
+def _digest_key(endpoint_name):
+    return DIGEST_KEY.format(endpoint_name)
+
+
+def get_synced_digest(user_id, endpoint_name):
+    try:
+        digest = core.utils.redis_connection().hget(_digest_key(endpoint_name), str(user_id))
+    except redis.exceptions.RedisError:
+        logger.warning("Couldn't read last synced payload digest", exc_info=True)
+        return None
+    return None if digest is None else digest.decode("ascii")
+
+
+def set_synced_digest(user_id, endpoint_name, digest):
+    try:
+        core.utils.redis_connection().hset(_digest_key(endpoint_name), str(user_id), digest)
+    except redis.exceptions.RedisError:
+        logger.warning("Couldn't record synced payload digest", exc_info=True)
+
+
+# A signed sync request, ready to be posted.
+Ping = collections.namedtuple("Ping", ["user_id", "endpoint_name", "digest", "url", "headers", "data"])
+
+
+def prepare_ping(user, endpoint_name, exclude_groups, force=False):
+    endpoint_settings = settings.SSO_ENDPOINTS[endpoint_name]
+    payload = make_payload(user, str(user.pk), exclude_groups=exclude_groups)
+    # Skip the request if Discourse was already sent exactly this payload.
+    digest = payload_digest(payload)
+    if not force and get_synced_digest(user.pk, endpoint_name) == digest:
+        metrics.incr("sso.ping_skipped.{}".format(endpoint_name))
+        return None
+    out_payload, out_signature = get_signers()[endpoint_name].sign(payload)
+    headers = {"Api-Username": "system", "Api-Key": endpoint_settings["api_key"]}
+    data = {"sso": out_payload, "sig": out_signature}
+    return Ping(user.pk, endpoint_name, digest, endpoint_settings["sync_sso_endpoint"], headers, data)
+
+
+# {endpoint name: session}, kept for the life of the worker process so syncs
+# reuse kept-alive connections instead of each paying for DNS, TCP and TLS.
+_sessions = {}
+_sessions_pid = None
+_sessions_lock = threading.Lock()
+
+
+def get_session(endpoint_name):
+    global _sessions_pid
+    with _sessions_lock:
+        if _sessions_pid != os.getpid():
+            # Connections inherited from the parent of a fork aren't ours.
+            _sessions.clear()
+            _sessions_pid = os.getpid()
+        session = _sessions.get(endpoint_name)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=settings.SSO_SYNC_CONCURRENCY)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[endpoint_name] = session
+        return session
+
+
+def post_ping(ping):
+    resp = get_session(ping.endpoint_name).post(
+        ping.url, headers=ping.headers, data=ping.data, timeout=settings.SSO_SYNC_TIMEOUT
+    )
+    resp.raise_for_status()
+    return resp
+
+
 @django_rq.job
-def send_update_ping_to_endpoint(user_id, endpoint_name, exclude_groups):
+def send_update_ping_to_endpoint(user_id, endpoint_name, exclude_groups, force=False):
     endpoint_settings = settings.SSO_ENDPOINTS.get(endpoint_name)
     if not endpoint_settings:
         return
@@ -48,19 +192,31 @@ def send_update_ping_to_endpoint(user_id, endpoint_name, exclude_groups):
         user = User.objects.get(pk=user_id)
     except User.DoesNotExist:
         return
-    payload = make_payload(user, str(user.pk), exclude_groups=exclude_groups)
-    sso = discourse_sso.DiscourseSigner(endpoint_settings["sso_secret"])
-    out_payload, out_signature = sso.sign(payload)
-    headers = {"Api-Username": "system", "Api-Key": endpoint_settings["api_key"]}
-    data = {"sso": out_payload, "sig": out_signature}
-    resp = requests.post(endpoint_settings["sync_sso_endpoint"], headers=headers, data=data)
-    resp.raise_for_status()
+    ping = prepare_ping(user, endpoint_name, exclude_groups, force=force)
+    if ping is None:
+        return
+    if retry.breaker_state(endpoint_name) == retry.OPEN:
+        metrics.incr("sso.ping_deferred.{}".format(endpoint_name))
+        retry.defer(endpoint_name, [user.pk])
+        return
+    metrics.incr("sso.ping.{}".format(endpoint_name))
+    try:
+        post_ping(ping)
+    except Exception as exc:
+        # The user is retried by the drain job rather than this one, which
+        # would otherwise fail for good.
+        logger.warning("Syncing user %s to %s failed: %r", user.pk, endpoint_name, exc)
+        metrics.incr("sso.ping_failed.{}".format(endpoint_name))
+        retry.record_results(endpoint_name, [], [(user.pk, exc)])
+        return
+    set_synced_digest(user.pk, endpoint_name, ping.digest)
+    retry.record_results(endpoint_name, [user.pk], [])
 
 
-def send_update_ping(user, exclude_groups=None):
+def send_update_ping(user, exclude_groups=None, force=False):
     exclude_groups = exclude_groups or []
 
     for endpoint_name, endpoint_settings in settings.SSO_ENDPOINTS.items():
         if "sync_sso_endpoint" not in endpoint_settings:
             continue
-        send_update_ping_to_endpoint.delay(user.pk, endpoint_name, exclude_groups)
+        send_update_ping_to_endpoint.delay(user.pk, endpoint_name, exclude_groups, force=force)
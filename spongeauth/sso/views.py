@@ -5,28 +5,34 @@ from django.contrib.auth.decorators import login_required
 from django.http import HttpResponseForbidden
 from django.conf import settings
 
+from asgiref.sync import sync_to_async
+
+from core import metrics
 from . import discourse_sso, utils
 
 
 @login_required
-def begin(request):
+async def begin(request):
     raw_payload = request.GET.get("sso", "")
     raw_signature = request.GET.get("sig", "")
+    # Discourse keeps any query string in its sso_url setting, so each
+    # endpoint can say which secret it uses by adding ?endpoint=<name>.
+    hint = request.GET.get("endpoint")
 
-    for endpoint in settings.SSO_ENDPOINTS.values():
-        sso = discourse_sso.DiscourseSigner(endpoint["sso_secret"])
-        try:
-            payload = sso.unsign(raw_payload, raw_signature)
-            break
-        except discourse_sso.SignatureError:
-            pass
-    else:
+    try:
+        endpoint_name, sso, payload = utils.unsign(raw_payload, raw_signature, hint=hint)
+    except discourse_sso.SignatureError:
+        await sync_to_async(metrics.incr, thread_sensitive=False)(
+            "sso.begin_failed.{}".format(hint if hint in settings.SSO_ENDPOINTS else "unknown")
+        )
         return HttpResponseForbidden()
+    await sync_to_async(metrics.incr, thread_sensitive=False)("sso.begin.{}".format(endpoint_name))
 
     if b"return_sso_url" not in payload:
         return HttpResponseForbidden()
 
-    out_payload, out_signature = sso.sign(utils.make_payload(request.user, payload[b"nonce"]))
+    user = await request.auser()
+    out_payload, out_signature = sso.sign(await sync_to_async(utils.make_payload)(user, payload[b"nonce"]))
     redirect_to = "{}?{}".format(
         payload[b"return_sso_url"].decode("utf8"), urllib.parse.urlencode({"sso": out_payload, "sig": out_signature})
     )
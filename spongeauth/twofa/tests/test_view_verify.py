@@ -5,6 +5,7 @@ import django.test
 import django.contrib.auth
 from django.utils import timezone
 
+import fakeredis
 import pytest
 
 import accounts.models
@@ -62,6 +63,22 @@ class TestVerify(django.test.TestCase):
         user = django.contrib.auth.get_user(self.client)
         assert user.is_authenticated
 
+    def test_throttles_device(self):
+        self.device = models.TOTPDevice(
+            owner=self.user, activated_at=timezone.now(), last_t=0, base32_secret="GEZDGNBVGY3TQOJQGEZDGNBVGY3TQOJQ"
+        )
+        self.device.save()
+
+        buckets = {"twofa-ip": {"capacity": 5, "rate": 0.01}, "twofa-device": {"capacity": 1, "rate": 0.01}}
+        with self.settings(RATELIMIT_BUCKETS=buckets):
+            with unittest.mock.patch("core.utils.redis_connection", return_value=fakeredis.FakeStrictRedis()):
+                resp = self.client.post(self.path(), {"response": "123456"})
+                assert resp.status_code == 200
+                resp = self.client.post(self.path(), {"response": "123456"})
+        assert resp.status_code == 429
+        user = django.contrib.auth.get_user(self.client)
+        assert not user.is_authenticated
+
     def test_can_render_totp(self):
         self.device = models.TOTPDevice(
             owner=self.user, activated_at=timezone.now(), last_t=0, base32_secret="GEZDGNBVGY3TQOJQGEZDGNBVGY3TQOJQ"
@@ -19,6 +19,7 @@ import qrcode.image.svg
 
 from accounts.views import _login_redirect_url
 import accounts.models
+import core.ratelimit
 import twofa.models
 
 
@@ -93,6 +94,10 @@ def verify(request, device_id=None):
 
     form = device.verify_form()
     if request.method == "POST":
+        throttled = core.ratelimit.check(("twofa-ip", request.META["REMOTE_ADDR"]), ("twofa-device", device.pk))
+        if throttled:
+            return throttled
+
         form = device.verify_form(request.POST)
 
         if form.is_valid():